@@ -0,0 +1,159 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import csv
+import time
+import json
+import struct
+import hashlib
+import tarfile
+import zipfile
+import logging
+from StringIO import StringIO
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Archive output: the rendered questions are written into a single ZIP or tar file as they finish, along with
+    a manifest of the questions (manifest.json and manifest.csv).
+
+    Layout of the archive:
+        png/<question>.png      (<question>-0.png, <question>-1.png, ... for questions with several pages)
+        svg/<question>.svg      (instead of the PNG and PDF files, with --format svg)
+        pdf/<question>.pdf
+        <target>/<question>.<format>   (output targets, see targets.py)
+        manifest.json
+        manifest.csv
+"""
+
+logging.getLogger('archive').addHandler(logging.NullHandler())
+
+FIELDS = ['id', 'name', 'title', 'time', 'correct', 'images', 'width', 'height', 'bytes', 'sha1', 'pdf', 'source']
+
+
+class Archive(object):
+    def __init__(self, path):
+        """
+        :param path: path of the archive. The format is given by the extension: .zip, .tar, .tar.gz (.tgz) or
+                     .tar.bz2. It is written under a temporary name and renamed when it is closed.
+        """
+        self.logger = logging.getLogger('archive.Archive')
+        self.path = os.path.realpath(os.path.expanduser(path))
+        self.tmp = self.path + '.part'
+        if self.path.endswith('.zip'):
+            self.zip = zipfile.ZipFile(self.tmp, 'w', allowZip64=True)
+            self.tar = None
+        elif self.path.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2')):
+            mode = 'w|gz' if self.path.endswith(('.gz', '.tgz')) else 'w|bz2' if self.path.endswith('.bz2') else 'w|'
+            self.zip = None
+            self.tar = tarfile.open(self.tmp, mode)
+        else:
+            raise IOError('Unknown archive format: %s (use .zip, .tar, .tar.gz or .tar.bz2).' % path)
+        self.manifest = []
+        self.logger.info("Writing the questions into %s ..." % self.path)
+
+    def add(self, qblock, pngs, pdf=None, outputs=None):
+        """
+        Adds the files of a rendered question and its entry in the manifest.
+        :param qblock: question block.
+        :param pngs: PNG (or SVG) files of the question, in page order.
+        :param pdf: PDF file of the question.
+        :param outputs: files of every output target of the question, by name, in page order.
+        """
+        qid = qblock.get('id', qblock['name'])
+        entry = {'id': qid, 'name': qblock['name'], 'title': qblock.get('title'), 'correct': qblock.get('correct'),
+                 'time': int(qblock['time']) if str(qblock.get('time')).isdigit() else None,
+                 'source': qblock.get('source'), 'images': [], 'width': None, 'height': None, 'bytes': 0,
+                 'sha1': None, 'pdf': None}
+        for k, png in enumerate(pngs):
+            data = self.read(png)
+            ext = os.path.splitext(png)[1][1:]
+            arcname = '%s/%s.%s' % (ext, qid, ext) if len(pngs) == 1 else '%s/%s-%d.%s' % (ext, qid, k, ext)
+            # PNG files are already compressed
+            self.write(arcname, data, zipfile.ZIP_DEFLATED if ext == 'svg' else zipfile.ZIP_STORED)
+            entry['images'].append(arcname)
+            entry['bytes'] += len(data)
+            if k == 0:
+                entry['width'], entry['height'] = png_size(data)
+                entry['sha1'] = hashlib.sha1(data).hexdigest()
+        if pdf:
+            entry['pdf'] = 'pdf/%s.pdf' % qid
+            self.write(entry['pdf'], self.read(pdf), zipfile.ZIP_DEFLATED)
+        if outputs:
+            # Only in manifest.json
+            entry['outputs'] = {}
+            for name, files in sorted(outputs.items()):
+                entry['outputs'][name] = []
+                for k, path in enumerate(files):
+                    ext = os.path.splitext(path)[1]
+                    arcname = '%s/%s%s' % (name, qid, ext) if len(files) == 1 else '%s/%s-%d%s' % (name, qid, k, ext)
+                    self.write(arcname, self.read(path),
+                               zipfile.ZIP_DEFLATED if ext == '.svg' else zipfile.ZIP_STORED)
+                    entry['outputs'][name].append(arcname)
+        self.manifest.append(entry)
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def write(self, arcname, data, compression):
+        if self.zip is not None:
+            info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            info.compress_type = compression
+            info.external_attr = 0o644 << 16
+            self.zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(arcname)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.tar.addfile(info, StringIO(data))
+
+    def close(self):
+        """ Writes the manifest and gives the archive its final name."""
+        self.manifest.sort(key=lambda entry: entry['id'])
+        self.write('manifest.json', json.dumps({'questions': self.manifest}, indent=1, sort_keys=True),
+                   zipfile.ZIP_DEFLATED)
+        rows = StringIO()
+        writer = csv.DictWriter(rows, FIELDS)
+        writer.writeheader()
+        for entry in self.manifest:
+            row = dict((field, '' if value is None else value) for field, value in entry.items() if field in FIELDS)
+            row['images'] = ';'.join(entry['images'])
+            writer.writerow(dict((field, unicode(value).encode('utf-8') if isinstance(value, unicode) else value)
+                                 for field, value in row.items()))
+        self.write('manifest.csv', rows.getvalue(), zipfile.ZIP_DEFLATED)
+        (self.zip or self.tar).close()
+        os.rename(self.tmp, self.path)
+        self.logger.info("%d questions written into %s." % (len(self.manifest), self.path))
+
+    def abort(self):
+        """ Closes the archive and removes it."""
+        try:
+            (self.zip or self.tar).close()
+        finally:
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+
+
+def png_size(data):
+    """ Width and height of a PNG image, from its IHDR chunk (None if it is not a PNG image)."""
+    if data[:8] != '\x89PNG\r\n\x1a\n' or data[12:16] != 'IHDR':
+        return None, None
+    return struct.unpack('>II', data[16:24])
@@ -0,0 +1,544 @@
+#!/usr/bin/python
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import struct
+import marshal
+import random
+import shutil
+import logging
+import platform
+import resource
+import tempfile
+import argparse
+import subprocess
+import qstore
+from index import QuestionIndex
+from fastrender import Unsupported, check
+from questions import QuestionParser
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Benchmarks of pykajut on synthetic question banks.
+
+    python bench.py parse [-n 10 100 1000 10000 100000]
+    python bench.py index [-n 10000 100000]
+    python bench.py store [-n 100000]
+    python bench.py render [-n 20] [--mix text=2 equation=1 graphics=1] [--designs tabular enumerate tabbed]
+                           [--backend fast] [--format svg]
+    python bench.py import [--repeat 3]
+
+    Every benchmark can write its results as JSON (--json results.json) and compare them with a previous run
+    (--baseline results.json): the measures that got slower by more than --tolerance are reported, and the
+    exit status is 1.
+"""
+
+QUESTION = "%% File_name: T%d_c%d.%d_q%d\n" \
+           "%% Title: Pregunta %d\n" \
+           "%s" \
+           "%s\n" \
+           "\\begin{enumerate}\n" \
+           "%s" \
+           "\\end{enumerate}\n\n"
+
+# Statements of the questions, by kind of content
+CONTENTS = {
+    'text': "Enunciado de prueba. Esta vez en castellano (espa\xc3\xb1ol), con un texto que ocupa varias\n"
+            "l\xc3\xadneas para alargar el enunciado.",
+    'inline': "Enunciado con f\xc3\xb3rmulas en l\xc3\xadnea: $\\int_0^1 x\\,dx$ y $\\sum_{n=1}^\\infty 1/n^2$.",
+    'equation': "This is just an example:\n\\begin{equation}\ne^{-i\\pi} + 1 = 0.\n\\end{equation}",
+    'graphics': "Enunciado con una figura:\n\\begin{center}\n\\includegraphics[width=2cm]{bench-figure.png}\n"
+                "\\end{center}"}
+MIX = {'text': 1, 'inline': 1, 'equation': 1}  # Default content mix
+
+
+def synthetic_bank(n, seed=0, mix=None):
+    """
+    Questions file with n questions, in the format of tex_files/input.tex.
+    :param mix: relative weight of every kind of statement (see CONTENTS). Default is MIX.
+    """
+    rnd = random.Random(seed)
+    kinds = []
+    for kind, weight in sorted((mix or MIX).items()):
+        kinds += [CONTENTS[kind]] * weight
+    blocks = []
+    for k in xrange(n):
+        correct = rnd.randrange(4)
+        choices = "".join("\\Myitem Respuesta %d.%s %%enditem\n" % (j + 1, " % Correct" if j == correct else "")
+                          for j in xrange(4))
+        time_line = "%% Time: %d\n" % rnd.choice((10, 20, 30)) if rnd.random() < 0.5 else ""
+        blocks.append(QUESTION % (k // 1000, k // 100 % 10, k // 10 % 10, k, k + 1, time_line,
+                                  rnd.choice(kinds), choices))
+    return "".join(blocks)
+
+
+def figure_png(size=64):
+    """ Gray square PNG image, for the questions with graphics."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = ('\x00' + '\x80' * size) * size
+    return '\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0)) \
+        + chunk('IDAT', zlib.compress(rows)) + chunk('IEND', '')
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile p (0-100) of a list of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def summary(values):
+    """ Statistics of the latencies of a stage (seconds)."""
+    return {'count': len(values), 'total': sum(values), 'mean': sum(values) / len(values) if values else None,
+            'p50': percentile(values, 50), 'p90': percentile(values, 90), 'p99': percentile(values, 99),
+            'max': max(values) if values else None}
+
+
+def peak_memory():
+    """ Peak resident memory (MB) of this process and of the largest child process (pdflatex, ...)."""
+    scale = 1048576.0 if sys.platform == 'darwin' else 1024.0  # ru_maxrss is in bytes on OS X, in kB on Linux
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale}
+
+
+def best_of(function, repeat):
+    best = None
+    for _ in xrange(repeat):
+        t0 = time.time()
+        function()
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_parse(sizes, repeat=3, mix=None):
+    """ Parsing time as a function of the number of questions. The time per question should be flat."""
+    parser = QuestionParser()
+    measures = {}
+    print "%10s %10s %10s %14s" % ("questions", "MB", "seconds", "us/question")
+    for n in sizes:
+        text = synthetic_bank(n, mix=mix)
+        parsed = []
+
+        def parse():
+            start, end = parser.region(text)
+            parsed[:] = parser.parse(text, start, end)
+
+        elapsed = best_of(parse, repeat)
+        if len(parsed) != n:
+            print "Error: %d questions parsed out of %d." % (len(parsed), n)
+            return None
+        measures['%d' % n] = elapsed
+        print "%10d %10.2f %10.4f %14.2f" % (n, len(text) / 1048576.0, elapsed, elapsed / n * 1e6)
+    return {'measures': measures}
+
+
+def bench_index(sizes, mix=None):
+    """ Reading a bank through the question index: first time, unchanged file and one edited question."""
+    parser = QuestionParser()
+    measures = {}
+    print "%10s %10s %10s %10s %10s" % ("questions", "parse", "first", "unchanged", "edited")
+    for n in sizes:
+        text = synthetic_bank(n, mix=mix)
+        edited = text.replace("Pregunta %d\n" % (n // 2 + 1), "Pregunta editada\n", 1)
+        indexdir = tempfile.mkdtemp(prefix='kajut-bench-')
+        try:
+            index = QuestionIndex(indexdir, 'bank.tex', parser)
+            times = [best_of(lambda: parser.parse(text), 1)]
+            for t in (text, text, edited):
+                times.append(best_of(lambda: index.parse(t), 1))
+        finally:
+            shutil.rmtree(indexdir, ignore_errors=True)
+        for label, elapsed in zip(("parse", "first", "unchanged", "edited"), times):
+            measures['%d/%s' % (n, label)] = elapsed
+        print "%10d %10.3f %10.3f %10.3f %10.3f" % tuple([n] + times)
+    return {'measures': measures}
+
+
+def footprint(objects):
+    """ Memory (MB) of an object and of everything it references, counting the shared objects once."""
+    seen = set()
+    stack = [objects]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(type(obj), '__slots__'):
+            stack.extend(getattr(obj, slot) for slot in type(obj).__slots__ if hasattr(obj, slot))
+    return size / 1048576.0
+
+
+def bench_store(sizes, repeat=3, mix=None):
+    """
+    Memory and loading time of the questions: dictionaries with the paths of their file (as they were kept before
+    qstore.py) against Question objects, and a marshalled list of dictionaries (the previous snapshot of the
+    index) against a snapshot of the store. The text of the file, which was also kept, is reported apart.
+    """
+    from core import bank_paths
+    parser = QuestionParser()
+    measures = {}
+    memory = {}
+    print "%10s %9s %9s %9s %10s %10s %10s %10s" % ("questions", "text MB", "dict MB", "store MB", "parse",
+                                                      "dict load", "store load", "snap. MB")
+    for n in sizes:
+        text = synthetic_bank(n, mix=mix)
+        qblocks = parser.parse(text)
+        if len(qblocks) != n:
+            print "Error: %d questions parsed out of %d." % (len(qblocks), n)
+            return None
+        paths = bank_paths('bank.tex')
+        origin = qstore.Origin(**paths)
+        dicts = [dict(qblock, **paths) for qblock in qblocks]
+        store = qstore.questions(qblocks, origin)
+        old, new = marshal.dumps(qblocks), qstore.dumps(store)
+
+        def load_dicts():
+            for qblock in marshal.loads(old):
+                qblock.update(paths)
+
+        times = [best_of(lambda: parser.parse(text), repeat), best_of(load_dicts, repeat),
+                 best_of(lambda: qstore.loads(new, origin), repeat)]
+        for label, elapsed in zip(("parse", "load-dicts", "load-store"), times):
+            measures['%d/%s' % (n, label)] = elapsed
+        memory['%d' % n] = {'text': len(text) / 1048576.0, 'dicts': footprint(dicts), 'store': footprint(store),
+                            'snapshot': len(new) / 1048576.0, 'dict-snapshot': len(old) / 1048576.0}
+        print "%10d %9.1f %9.1f %9.1f %10.3f %10.3f %10.3f %10.1f" \
+              % tuple([n, memory['%d' % n]['text'], memory['%d' % n]['dicts'], memory['%d' % n]['store']] + times
+                      + [memory['%d' % n]['snapshot']])
+    return {'measures': measures, 'memory': memory}
+
+
+STAGES = ['write_latex', 'compile', 'crop', 'rasterize', 'dvisvgm', 'fast', 'question']
+
+
+def bench_render(n, mix=None, designs=('tabular',), density=300, rasterizer='auto', fmt=True, size=(None, None),
+                 letterbox=False, backend='latex', image_format='png'):
+    """
+    Renders a bank of n questions with every design, timing each stage of every question separately:
+    RenderJob.write_latex (writing the .tex file), compilation (pdflatex), cropping (pdfcrop) and rasterization.
+    Reading the bank (Data.read_questions) is timed once per bank.
+    :param size: target width and height of the images in pixels, instead of the density.
+    :param backend: 'fast' renders the questions that allow it with fastrender.py (the 'fast' stage).
+    :param image_format: 'svg' compiles with latex and converts the DVI files with dvisvgm (the 'dvisvgm' stage),
+                         instead of cropping and rasterizing: compare both runs with --json and --baseline.
+    """
+    from core import Data, Kajut, parse_bank
+    from render import workspace
+
+    workdir = tempfile.mkdtemp(prefix='kajut-bench-')
+    results = {'questions': n, 'mix': mix or MIX, 'density': density, 'size': size, 'letterbox': letterbox,
+               'backend': backend, 'format': image_format, 'designs': {}}
+    measures = {}
+    try:
+        texpath = os.path.join(workdir, 'bench.tex')
+        text = synthetic_bank(n, mix=mix)
+        with open(texpath, 'w') as f:
+            f.write(text)
+        with open(os.path.join(workdir, 'bench-figure.png'), 'wb') as f:
+            f.write(figure_png())
+        opts = {'i': texpath, 'd': density, 'crop': True, 'design': designs[0], 'nocache': True, 'noindex': True,
+                'rasterizer': rasterizer, 'noformat': not fmt, 'fmtdir': os.path.join(workdir, 'fmt'),
+                'width_px': size[0], 'height_px': size[1], 'letterbox': letterbox, 'backend': backend,
+                'format': image_format}
+        d = Data(opts, workdir)
+        t0 = time.time()
+        qblocks = d.read_questions(text)
+        elapsed = time.time() - t0
+        if len(qblocks) != n:
+            print "Error: %d questions read out of %d." % (len(qblocks), n)
+            return None
+        results['read'] = {'seconds': elapsed, 'questions/s': n / elapsed if elapsed else None}
+        measures['read'] = elapsed
+        # Names only, as the graphical interface lists them (see QuestionParser.scan)
+        t0 = time.time()
+        parse_bank(text, texpath, d.parser, lazy=True)
+        results['scan'] = measures['scan'] = time.time() - t0
+        kajut = Kajut(d)
+        t0 = time.time()
+        kajut.set_preamble(d.page)
+        kajut.ensure_format()
+        results['format'] = time.time() - t0
+        print "Read: %.4f s (%d questions, names only: %.4f s). Format: %.3f s. Rasterizer: %s." \
+              % (elapsed, n, results['scan'], results['format'], kajut.raster.name if kajut.raster else None)
+
+        print "%-10s %-13s %8s %8s %8s %8s %8s" % ("design", "stage", "mean", "p50", "p90", "p99", "max")
+        for design in designs:
+            d.design = design
+            latencies = dict((stage, []) for stage in STAGES)
+            sizes = []
+            failed = 0
+            t0 = time.time()
+            for name in sorted(qblocks):
+                times = render_stages(kajut, qblocks[name], workspace())
+                if times is None:
+                    failed += 1
+                    continue
+                for stage in STAGES:
+                    if stage in times:
+                        latencies[stage].append(times[stage])
+                sizes.append(times['bytes'])
+            elapsed = time.time() - t0
+            stages = dict((stage, summary(values)) for stage, values in latencies.items())
+            results['designs'][design] = {'stages': stages, 'failed': failed, 'seconds': elapsed,
+                                          'questions/s': (n - failed) / elapsed if elapsed else None,
+                                          'bytes': sum(sizes) / len(sizes) if sizes else None}
+            for stage in STAGES:
+                stats = stages[stage]
+                if not stats['count']:
+                    continue
+                for key in ('p50', 'p90', 'p99'):
+                    measures['%s/%s/%s' % (design, stage, key)] = stats[key]
+                print "%-10s %-13s %8.3f %8.3f %8.3f %8.3f %8.3f" % (design, stage, stats['mean'], stats['p50'],
+                                                                     stats['p90'], stats['p99'], stats['max'])
+            print "%-10s %d questions in %.2f s (%.2f questions/s), %d failed, %.1f kB per image." \
+                  % (design, n, elapsed, results['designs'][design]['questions/s'], failed,
+                     (results['designs'][design]['bytes'] or 0) / 1024.0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    results['memory'] = peak_memory()
+    print "Peak memory: %.1f MB (benchmark), %.1f MB (largest child process)." \
+          % (results['memory']['self'], results['memory']['children'])
+    results['measures'] = measures
+    return results
+
+
+def render_stages(kajut, qblock, workspace):
+    """ Renders a question step by step. Returns the seconds spent in every stage, or None if it failed."""
+    times = {}
+    job = kajut.job([qblock])
+    job.workdir = tempfile.mkdtemp(prefix='kajut-', dir=workspace)
+    try:
+        if job.fast and check(qblock) is None:
+            t = time.time()
+            png = os.path.join(job.workdir, 'tex-%s.png' % qblock['name'])
+            try:
+                job.fast.render(qblock, png, job.density, job.size, job.letterbox, job.crop)
+                times['fast'] = times['question'] = time.time() - t
+                times['bytes'] = os.path.getsize(png)
+                return times
+            except Unsupported:
+                pass  # Rendered with LaTeX
+        filename = os.path.join(job.workdir, 'tex-' + qblock['name'])
+        t = time.time()
+        job.write_latex(filename, [qblock])
+        times['write_latex'] = time.time() - t
+        t = time.time()
+        job.compile(filename)
+        times['compile'] = time.time() - t
+        if not os.path.exists(job.document(filename)):
+            return None
+        if job.format == 'svg':
+            t = time.time()
+            svgs = job.convert_dvi(filename)
+            times['dvisvgm'] = time.time() - t
+            if not svgs:
+                return None
+            times['question'] = sum(times.values())
+            times['bytes'] = sum(os.path.getsize(svg) for svg in svgs)
+            return times
+        t = time.time()
+        cropped = job.crop_pdf(filename + '.pdf')
+        times['crop'] = time.time() - t
+        t = time.time()
+        pngs = job.rasterize(filename)
+        times['rasterize'] = time.time() - t
+        if not cropped or not pngs:
+            return None
+        times['question'] = sum(times.values())
+        times['bytes'] = sum(os.path.getsize(png) for png in pngs)
+    finally:
+        shutil.rmtree(job.workdir, ignore_errors=True)
+    return times
+
+
+# Modules imported by every mode of pykajut: the command line and the service need core, the GUI needs gui
+IMPORTS = ['core', 'render', 'service', 'fastrender', 'gui']
+# Dependencies that take long to import, and that the command line should not load
+HEAVY = ['gi', 'matplotlib', 'numpy', 'yaml']
+IMPORT_CODE = "import sys, time\n" \
+              "t = time.time()\n" \
+              "import %s\n" \
+              "print time.time() - t, len(sys.modules), ' '.join(sorted(set(%r) & set(sys.modules)))\n"
+
+
+def bench_import(repeat=3):
+    """
+    Startup cost of pykajut: time to import each module in a fresh interpreter (the best of repeat runs), the
+    modules it loads and which heavy dependencies among them, and the time of the whole process for
+    'pykajut.py --help'.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    measures = {}
+    print "%-14s %10s %10s %8s  %s" % ("module", "import (s)", "process (s)", "modules", "heavy dependencies")
+    for module in IMPORTS + ['pykajut --help']:
+        if module.startswith('pykajut'):
+            command = [sys.executable, os.path.join(root, 'pykajut.py'), '--help']
+        else:
+            command = [sys.executable, '-c', IMPORT_CODE % (module, HEAVY)]
+        best = None
+        for k in xrange(repeat):
+            t = time.time()
+            p = subprocess.Popen(command, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            elapsed = time.time() - t
+            if p.returncode != 0:
+                best = None
+                break
+            if best is None or elapsed < best[1]:
+                best = (out, elapsed)
+        if best is None:
+            print "%-14s %10s %10s %8s  %s" % (module, "-", "-", "-", "could not be imported")
+            continue
+        out, elapsed = best
+        measures['process/%s' % module] = elapsed
+        if module.startswith('pykajut'):
+            print "%-14s %10s %10.3f %8s" % (module, "-", elapsed, "-")
+            continue
+        fields = out.split(None, 2)
+        measures['import/%s' % module] = float(fields[0])
+        print "%-14s %10.3f %10.3f %8s  %s" % (module, float(fields[0]), elapsed, fields[1],
+                                               fields[2].strip() if len(fields) > 2 else "")
+    return {'measures': measures}
+
+
+def compare(measures, baseline, tolerance):
+    """
+    Compares the measures of a run with those of a baseline run (seconds, lower is better).
+    :return: labels of the measures that are slower than the baseline by more than tolerance (fraction).
+    """
+    slower = []
+    print "%-32s %10s %10s %8s" % ("measure", "baseline", "current", "change")
+    for label in sorted(set(measures) & set(baseline)):
+        old, new = baseline[label], measures[label]
+        if not old or new is None:
+            continue
+        change = new / old - 1
+        flag = ""
+        if change > tolerance:
+            slower.append(label)
+            flag = " slower"
+        print "%-32s %10.4f %10.4f %+7.1f%%%s" % (label, old, new, change * 100, flag)
+    return slower
+
+
+def parse_mix(items):
+    """ Content mix from kind=weight items (see CONTENTS)."""
+    mix = {}
+    for item in items:
+        kind, _, weight = item.partition('=')
+        if kind not in CONTENTS:
+            raise argparse.ArgumentTypeError("Unknown content %s (choose from %s)." % (kind, ", ".join(CONTENTS)))
+        mix[kind] = int(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of pykajut on synthetic question banks.')
+    parser.add_argument('benchmark', choices=['parse', 'index', 'store', 'render', 'import'],
+                        help='Benchmark to run.')
+    parser.add_argument('-n', '--sizes', default=None, dest='sizes', type=int, nargs='+',
+                        help='Number of questions of the synthetic banks. Default is 10 to 100000 (parse, index), '
+                             '100000 (store) and 20 (render).')
+    parser.add_argument('--repeat', default=3, dest='repeat', type=int,
+                        help='Repetitions of each measure (the best one is reported).')
+    parser.add_argument('--mix', default=None, dest='mix', nargs='+', metavar='<content>=<weight>',
+                        help='Content of the statements: %s. Default is text, inline and equation in equal '
+                             'parts.' % ", ".join(sorted(CONTENTS)))
+    parser.add_argument('--designs', default=['tabular', 'enumerate', 'tabbed'], dest='designs', nargs='+',
+                        choices=['tabular', 'enumerate', 'tabbed'], help='Designs rendered (render).')
+    parser.add_argument('-d', '--density', default=300, dest='density', type=int, help='Density (render).')
+    parser.add_argument('--width-px', default=None, dest='width_px', type=int,
+                        help='Width of the images, instead of the density (render).')
+    parser.add_argument('--height-px', default=None, dest='height_px', type=int,
+                        help='Height of the images, instead of the density (render).')
+    parser.add_argument('--letterbox', default=False, dest='letterbox', action='store_true',
+                        help='Pad the images to --width-px x --height-px (render).')
+    parser.add_argument('-r', '--rasterizer', default='auto', dest='rasterizer', type=str,
+                        help='Rasterizer backend (render).')
+    parser.add_argument('--no-format', default=False, dest='noformat', action='store_true',
+                        help='Compile without the precompiled preamble (render).')
+    parser.add_argument('--backend', default='latex', dest='backend', choices=['latex', 'fast'],
+                        help='Render backend: fast renders the simple questions without LaTeX (render).')
+    parser.add_argument('--format', default='png', dest='format', choices=['png', 'svg'],
+                        help='Format of the images: svg goes through DVI and dvisvgm (render).')
+    parser.add_argument('--json', default=None, dest='json', type=str, metavar='<file>',
+                        help='Write the results as JSON into the file (- for the standard output).')
+    parser.add_argument('--baseline', default=None, dest='baseline', type=str, metavar='<file>',
+                        help='JSON results of a previous run, to compare with.')
+    parser.add_argument('--tolerance', default=0.1, dest='tolerance', type=float,
+                        help='Slowdown over the baseline reported as a regression. Default is 0.1 (10%%).')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    stdout = sys.stdout
+    if args.json == '-':
+        sys.stdout = sys.stderr  # The tables do not mix with the results
+    try:
+        mix = parse_mix(args.mix) if args.mix else None
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if args.benchmark == 'parse':
+        results = bench_parse(args.sizes or [10, 100, 1000, 10000, 100000], args.repeat, mix)
+    elif args.benchmark == 'index':
+        results = bench_index(args.sizes or [10, 100, 1000, 10000, 100000], mix)
+    elif args.benchmark == 'store':
+        results = bench_store(args.sizes or [100000], args.repeat, mix)
+    elif args.benchmark == 'import':
+        results = bench_import(args.repeat)
+    else:
+        results = bench_render((args.sizes or [20])[0], mix, args.designs, args.density, args.rasterizer,
+                               not args.noformat, (args.width_px, args.height_px), args.letterbox, args.backend,
+                               args.format)
+    if results is None:
+        return 1
+    results.update({'benchmark': args.benchmark, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(), 'platform': platform.platform()})
+    if args.json == '-':
+        stdout.write(json.dumps(results, indent=1, sort_keys=True) + '\n')
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('benchmark') != args.benchmark:
+            print "Error: the baseline is a %s benchmark." % baseline.get('benchmark')
+            return 1
+        if compare(results['measures'], baseline.get('measures', {}), args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
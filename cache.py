@@ -0,0 +1,178 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import uuid
+import shutil
+import tempfile
+import logging
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Persistent cache of rendered questions (PNG and PDF files, and the files of the output targets in a
+    subdirectory per target), addressed by the hash of everything that affects the output.
+"""
+
+logging.getLogger('cache').addHandler(logging.NullHandler())
+
+
+class RenderCache(object):
+    def __init__(self, cachedir, maxsize=1024):
+        """
+        :param cachedir: directory where the rendered files are stored.
+        :param maxsize: maximum size of the cache in MB. The least recently used entries are evicted first.
+        """
+        self.logger = logging.getLogger('cache.RenderCache')
+        self.cachedir = os.path.realpath(os.path.expanduser(cachedir))
+        self.maxsize = maxsize * 1024 * 1024
+        if not os.path.exists(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError:
+                if not os.path.isdir(self.cachedir):
+                    raise IOError('Path %s does not exist.' % self.cachedir)
+        self.logger.debug("Render cache in %s (%d MB)." % (self.cachedir, maxsize))
+
+    def entry(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def get(self, key, pngdir, pdfdir, outdirs=None, name=None):
+        """
+        Restores the files of a cached render.
+        :param key: hash of the render (see Kajut.render_key).
+        :param pngdir: directory where the PNG (or SVG) files are copied.
+        :param pdfdir: directory where the PDF file is copied.
+        :param outdirs: directories of the output targets, by name.
+        :param name: file name of the question (tex-<question>): its pages of an earlier render are removed
+                     (see prune_pages).
+        :return: True if the render was found in the cache.
+        """
+        entry = self.entry(key)
+        outdirs = outdirs or {}
+        try:
+            files = os.listdir(entry)
+        except OSError:
+            return False
+        pdfs = [pdfdir] if any(name.endswith('.pdf') for name in files) else []  # No PDF file with SVG images
+        for path in [pngdir] + pdfs + outdirs.values():
+            if not os.path.exists(path):
+                try:
+                    os.mkdir(path)
+                except OSError:
+                    if not os.path.isdir(path):
+                        raise IOError('Path %s does not exist.' % path)
+        published = {}
+        for filename in files:
+            if filename in outdirs:
+                for output in os.listdir(os.path.join(entry, filename)):
+                    target = os.path.join(outdirs[filename], output)
+                    publish(os.path.join(entry, filename, output), target, copy=True)
+                    published.setdefault(outdirs[filename], []).append(target)
+                continue
+            target = os.path.join(pdfdir if filename.endswith('.pdf') else pngdir, filename)
+            publish(os.path.join(entry, filename), target, copy=True)
+            published.setdefault(os.path.dirname(target), []).append(target)
+        if name is not None:
+            for directory, paths in published.items():
+                prune_pages(os.path.join(directory, name), paths)
+        # The modification time of the entry is its last use (LRU)
+        os.utime(entry, None)
+        self.logger.debug("Cache hit: %s" % key)
+        return True
+
+    def put(self, key, files, outputs=None):
+        """
+        Stores the files of a render. The entry is written in a temporary directory and then renamed,
+        so that concurrent jobs never see incomplete entries.
+        :param key: hash of the render (see Kajut.render_key).
+        :param files: paths of the PNG and PDF files.
+        :param outputs: paths of the files of every output target, by name.
+        """
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.cachedir)
+        try:
+            for path in files:
+                shutil.copyfile(path, os.path.join(tmp, os.path.basename(path)))
+            for name, paths in (outputs or {}).items():
+                os.mkdir(os.path.join(tmp, name))
+                for path in paths:
+                    shutil.copyfile(path, os.path.join(tmp, name, os.path.basename(path)))
+            os.rename(tmp, entry)
+            self.logger.debug("Cached: %s" % key)
+        except OSError:
+            # Another job stored the same entry in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def trim(self):
+        """ Evicts the least recently used entries until the cache fits in its maximum size."""
+        entries = []
+        total = 0
+        for key in os.listdir(self.cachedir):
+            entry = self.entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(top, name))
+                       for top, dirs, names in os.walk(entry) for name in names)
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        entries.sort()
+        evicted = 0
+        while total > self.maxsize and entries:
+            mtime, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self.logger.info("%d entries evicted from the render cache (%.1f MB in use)."
+                             % (evicted, total / 1048576.0))
+
+
+def prune_pages(filename, keep):
+    """
+    Removes the pages of an earlier render of a question that are not in keep: filename.png when it has now
+    several pages (filename-0.png, filename-1.png, ...), and the other way round, or the pages beyond its new
+    number of pages. Otherwise they would be taken for the current ones.
+    :param filename: path of the files of the question, without the page number and the extension.
+    :param keep: files just published, whose extensions are pruned.
+    """
+    keep = set(keep)
+    for ext in set(os.path.splitext(path)[1] for path in keep):
+        pages = [filename + ext]
+        while os.path.exists('%s-%d%s' % (filename, len(pages) - 1, ext)):
+            pages.append('%s-%d%s' % (filename, len(pages) - 1, ext))
+        for path in pages:
+            if path not in keep and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Removed by another job
+
+
+def publish(src, target, copy=False):
+    """
+    Moves (or copies) a file to its final path atomically: it is first written next to the target, under a
+    unique temporary name, and then renamed. Readers never see partially written files.
+    """
+    tmp = '%s.%s.tmp' % (target, uuid.uuid4().hex)
+    if copy:
+        shutil.copyfile(src, tmp)
+    else:
+        shutil.move(src, tmp)  # The temporary directory may be in another file system
+    os.rename(tmp, target)
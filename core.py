@@ -0,0 +1,879 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import glob
+import shutil
+import hashlib
+import tempfile
+import logging
+import multiprocessing
+from bisect import bisect_right
+from operator import add
+from cache import RenderCache
+import fastrender
+from index import QuestionIndex
+from questions import QuestionParser
+from qstore import Origin, Question, questions
+from raster import get_rasterizer
+from process import run, tail
+from render import RenderJob, cpu_count
+from timing import Trace, stage
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Core of pykajut, without any graphical dependency: the settings and the question banks (Data) and the LaTeX
+    documents of the questions (Kajut). The command line modes (batch, watch, archive and the render service) only
+    need this module; gui.py builds the graphical interface on top of it.
+"""
+
+logging.getLogger('core').addHandler(logging.NullHandler())
+
+
+class Data:
+    def __init__(self, opts, cwd="./"):
+        self.logger = logging.getLogger('core.Data')
+
+        self.cwd = cwd
+        self.inputfile = opts['i']
+        self.density = opts['d']  # Default density for png conversion
+        # Size of the images in pixels, instead of the density, and whether they are padded to exactly that size
+        self.width_px = opts.get('width_px')
+        self.height_px = opts.get('height_px')
+        self.letterbox = opts.get('letterbox', False)
+        self.qblocks = {}
+        self.texcwd = cwd
+        self.crop = opts['crop']
+        self.design = opts['design']
+        # Render backend: 'fast' draws the questions without LaTeX when it can (see fastrender.py)
+        self.backend = opts.get('backend', 'latex')
+        # Render cache (None disables it) and its maximum size in MB
+        self.cachedir = None if opts.get('nocache') else opts.get('cachedir')
+        self.cachesize = opts.get('cachesize', 1024)
+        # Rasterizer backend, its number of threads and its memory cap (MB)
+        self.rasterizer = opts.get('rasterizer', 'auto')
+        self.rthreads = opts.get('rthreads', 0)
+        self.rmemory = opts.get('rmemory', 256)
+        # Seconds after which an external program (pdflatex, pdfcrop, ...) is killed
+        self.timeout = opts.get('timeout', 300)
+        # Directory of the precompiled LaTeX formats (None disables them)
+        self.fmtdir = None if opts.get('noformat') else opts.get('fmtdir')
+        # Directory of the question indexes (None disables them)
+        self.indexdir = None if opts.get('noindex') else opts.get('indexdir')
+        # Only the names of the questions are read, the rest is parsed when they are needed (see Data.details)
+        self.lazy = opts.get('lazy', False)
+        # Memory for the previews of the GUI (MB) and number of rows loaded in advance around the selected one
+        self.previewcache = opts.get('previewcache', 64)
+        self.prefetch = opts.get('prefetch', 3)
+        # Questions rendered at the same time by the GUI (0 uses all the cores)
+        self.workers = opts.get('workers', 0)
+        # Output targets: extra files of every question, converted from its PDF file (see targets.py)
+        self.targets = opts.get('targets') or []
+        # Format of the images: png (pdflatex and a rasterizer) or svg (latex and dvisvgm, without PDF file), and
+        # the fonts of the SVG images: converted into paths, or embedded (woff, woff2)
+        self.format = opts.get('format', 'png')
+        self.svgfonts = opts.get('svgfonts', 'paths')
+        # JSONL trace with the timing of every stage of the render (see timing.py)
+        self.trace = Trace(opts['trace']) if opts.get('trace') else None
+        self.app_path = os.path.dirname(__file__)
+        self.logger.debug("The executable is in %s" % self.app_path)
+
+        # LaTeX related options
+        self.enumerate = ["enumerate", "tabbedenum"]
+        self.parser = QuestionParser(self.enumerate)
+        self.extra_packages = []
+        self.pagedimensions = {'A4': ['21cm', '29.7cm'], 'default': ['21cm', '10cm'], 'custom': ['21cm', '10cm']}
+        self.page = 'default'
+        self.margins = ['0.5cm', '0.5cm', '0.5cm', '0.5cm']
+
+        # Paths (of the first file, when there are several)
+        self.texpath = None
+        self.texfile = None
+        self.texname = None
+        self.texdir = None
+        self.pngdir = None
+        self.pdfdir = None
+        self.sources = []  # Questions files in the bank
+        if isinstance(self.inputfile, list) and len(self.inputfile) == 1:
+            self.inputfile = self.inputfile[0]
+        if self.inputfile in (None, "None", "none", "null", []):
+            self.inputfile = None
+        else:
+            # Opening .tex files
+            paths = self.expand_inputs(self.inputfile if isinstance(self.inputfile, list) else [self.inputfile])
+            self.open_banks(paths)
+
+    def expand_inputs(self, inputs):
+        """
+        Questions files given as input: paths, directories (all their .tex files, except the files of single
+        questions, tex-*.tex) or glob patterns.
+        :return: list of paths.
+        """
+        paths = []
+        for item in inputs:
+            item = os.path.expanduser(item)
+            if os.path.isdir(item):
+                found = [path for path in glob.glob(os.path.join(item, '*.tex'))
+                         if not os.path.basename(path).startswith('tex-')]
+            elif glob.has_magic(item):
+                found = glob.glob(item)
+            else:
+                found = [item]
+            if not found:
+                self.logger.warning("No questions files found in %s." % item)
+            for path in sorted(found):
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def open_banks(self, paths):
+        """
+        Reads several questions files at the same time (one process per file, up to the number of cores) and
+        merges them in the bank.
+        :param paths: paths of the questions files.
+        :return: True if any file could be read.
+        """
+        paths = [path for path in paths if self.check_file(path, critical=False) and self.check_extension(path, 'tex')]
+        if not paths:
+            return False
+        # The first file gives the default paths (new questions, file chooser, ...)
+        self.open_texfile(paths[0])
+        if len(paths) == 1:
+            with stage(self.trace, 'read', files=paths):
+                qblocks = parse_bank(read_text(self.texpath), self.texpath, self.parser, self.indexdir, self.lazy)
+            self.merge(self.texpath, qblocks)
+            return True
+        self.logger.info("Loading %d questions files ..." % len(paths))
+        args = [(path, self.enumerate, self.indexdir, self.lazy) for path in paths]
+        jobs = min(len(paths), cpu_count())
+        with stage(self.trace, 'read', files=paths):
+            if jobs > 1:
+                pool = multiprocessing.Pool(jobs)
+                try:
+                    banks = pool.map(read_bank, args)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                banks = map(read_bank, args)
+        for path in paths:
+            if path not in self.sources:
+                self.sources.append(path)
+        qblocks = [qblock for qblock in self.qblocks.values() if qblock['source'] not in paths]
+        for bank in banks:
+            qblocks.extend(bank)
+        self.qblocks = self.namespace(qblocks)
+        self.logger.info("%d questions in %d files." % (len(self.qblocks), len(self.sources)))
+        return True
+
+    def open_bank(self, path):
+        """ Reads a questions file and adds its questions to the bank (or replaces them, if it was already in it)."""
+        if not self.open_texfile(path):
+            return False
+        with stage(self.trace, 'read', files=[path]):
+            qblocks = parse_bank(read_text(self.texpath), self.texpath, self.parser, self.indexdir, self.lazy)
+        self.merge(self.texpath, qblocks)
+        return True
+
+    def details(self, names):
+        """
+        Parses the questions that were read lazily (see Data.lazy), reading each of their files once. A file that
+        changed since it was read is scanned again, and the questions that can not be parsed are removed from
+        the bank.
+        :param names: identifiers of the questions.
+        :return: list of the question blocks, with all their fields.
+        """
+        pending = {}
+        for name in names:
+            qblock = self.qblocks.get(name)
+            if qblock is not None and qblock.get('lazy'):
+                pending.setdefault(qblock['source'], []).append(name)
+        for source, ids in sorted(pending.items()):
+            try:
+                text = read_text(source)
+            except IOError as e:
+                self.logger.error("The questions of %s could not be read: %s" % (source, e))
+                continue
+            with stage(self.trace, 'details', ids, files=[source]):
+                parsed = [(name, self.parser.details(text, self.qblocks[name])) for name in ids]
+                if None in [fields for name, fields in parsed]:
+                    self.logger.debug("%s changed since it was read. Scanning it again ..." % source)
+                    self.merge(source, parse_bank(text, source, self.parser, lazy=True))
+                    parsed = [(name, self.parser.details(text, self.qblocks[name])) for name in ids
+                              if name in self.qblocks]
+            for name, fields in parsed:
+                if fields is None:
+                    self.logger.error("Bad format for question %s. It is removed from the list." % name)
+                    self.qblocks.pop(name)
+                else:
+                    self.qblocks[name].pop('lazy')
+                    self.qblocks[name].update(fields)
+        return [self.qblocks[name] for name in names if name in self.qblocks]
+
+    def question(self, name):
+        """ Question block of the identifier name, with all its fields (see Data.details). None if there is no
+            such question.
+        """
+        qblocks = self.details([name])
+        return qblocks[0] if qblocks else None
+
+    def merge(self, path, qblocks):
+        """ Adds (or replaces) the questions of a file to the bank."""
+        if path not in self.sources:
+            self.sources.append(path)
+        self.qblocks = self.namespace([qblock for qblock in self.qblocks.values() if qblock['source'] != path]
+                                      + qblocks)
+
+    def namespace(self, qblocks):
+        """
+        Identifiers of the questions: their names or, when the bank has several files, <file>/<name>, where
+        <file> is the name of the file (or its path, if there are files with the same name).
+        :return: dictionary of question blocks, by identifier.
+        """
+        names = self.namespaces()
+        bank = {}
+        for qblock in qblocks:
+            qblock['id'] = self.question_id(qblock['name'], qblock['source'], names)
+            if qblock['id'] in bank:
+                self.logger.warning("Question %s is repeated in %s. Only the last one is kept."
+                                    % (qblock['name'], qblock['source']))
+            bank[qblock['id']] = qblock
+        return bank
+
+    def namespaces(self):
+        """ Namespace of the questions of every file: the name of the file (or its path, if there are files with
+            the same name).
+        """
+        names = dict((path, os.path.basename(path)[:-4]) for path in self.sources)
+        if len(set(names.values())) < len(names):
+            common = os.path.dirname(os.path.commonprefix([os.path.realpath(path) for path in self.sources]))
+            names = dict((path, os.path.relpath(os.path.realpath(path), common)[:-4]) for path in self.sources)
+        return names
+
+    def question_id(self, name, source, names=None):
+        """ Identifier of the question name of the file source."""
+        if len(self.sources) < 2:
+            return name
+        if names is None:
+            names = self.namespaces()
+        return names[source] + '/' + name if source in names else name
+
+    def new_question(self, name, like=None):
+        """
+        Adds an empty question to the bank, in the file of the question like (or in the first file).
+        :return: identifier of the question.
+        """
+        if like in self.qblocks:
+            origin = self.qblocks[like].origin
+        else:
+            origin = Origin(**bank_paths(self.texpath)) if self.texpath else None
+        qblock = Question({'name': name, 'title': '', 'question': '', 'choices': [], 'correct': None,
+                           'time': 'None'}, origin)
+        self.qblocks = self.namespace(self.qblocks.values() + [qblock])
+        return qblock['id']
+
+    def rename_question(self, name, new_name):
+        """
+        Renames a question of the bank. It keeps its block in its file: save it with its former name (see
+        Data.save_questions).
+        :return: new identifier of the question.
+        :raise ValueError: if another question of the file has the new name.
+        """
+        new_id = self.question_id(new_name, self.qblocks[name]['source'])
+        if new_id != name and new_id in self.qblocks:
+            raise ValueError("There is already a question %s in %s." % (new_name, self.qblocks[name]['source']))
+        qblock = self.qblocks.pop(name)
+        qblock['name'] = new_name
+        self.qblocks = self.namespace(self.qblocks.values() + [qblock])
+        return qblock['id']
+
+    def remove_question(self, name):
+        """ Removes a question from the bank and from its file (see Data.save_questions).
+        :return: True if its file was updated.
+        """
+        qblock = self.qblocks.pop(name, None)
+        if qblock is None:
+            return False
+        return self.save_questions(removed=[qblock])
+
+    def save_questions(self, names=(), removed=(), renamed=None):
+        """
+        Writes edited, added and removed questions back into their files. Only the blocks of those questions are
+        rewritten, at the spans recorded when the files were read, and every file is replaced atomically. The
+        spans and lines of the other questions are moved by the size of the changes, so no file is read again.
+        :param names: identifiers of the edited or added questions (new ones go after the last question of their
+                      file).
+        :param removed: question blocks removed from the bank.
+        :param renamed: former names of the renamed questions, by identifier: their blocks are found by them.
+        :return: True if all the changes were written.
+        """
+        changes = {}
+        for qblock in self.details(names):
+            changes.setdefault(qblock['source'], ([], []))[0].append(qblock)
+        for qblock in removed:
+            changes.setdefault(qblock['source'], ([], []))[1].append(qblock)
+        saved = True
+        for source, (edited, deleted) in sorted(changes.items()):
+            if source is None:
+                self.logger.warning("Questions %s have no file: they are not saved."
+                                    % ', '.join(qblock['name'] for qblock in edited + deleted))
+                saved = False
+                continue
+            ids = [qblock.get('id', qblock['name']) for qblock in edited + deleted]
+            try:
+                with stage(self.trace, 'save', ids, files=[source]):
+                    self.write_questions(source, edited, deleted, renamed)
+            except (IOError, OSError) as e:
+                self.logger.error("The questions could not be saved in %s: %s" % (source, e))
+                saved = False
+            else:
+                self.logger.info("%d questions saved in %s." % (len(ids), source))
+        return saved
+
+    def write_questions(self, source, edited, deleted, renamed=None):
+        """
+        Rewrites the blocks of some questions of a file (see Data.save_questions).
+        :param source: path of the file.
+        :param edited: question blocks edited in the file or added to it.
+        :param deleted: question blocks removed from the file.
+        :param renamed: former names of the renamed questions, by identifier.
+        """
+        text = read_text(source)
+        changed = set(id(qblock) for qblock in edited)
+        bank = [qblock for qblock in self.qblocks.values() if qblock['source'] == source and id(qblock) not in changed]
+        # Renamed questions are still under their former names in the file
+        renamed = renamed or {}
+        former = dict((id(qblock), renamed[qblock['id']]) for qblock in edited if qblock.get('id') in renamed)
+        # The file may have been edited since it was read: then the questions are looked for again
+        if not all(self.located(text, qblock, former.get(id(qblock))) for qblock in edited + deleted
+                   if 'span' in qblock):
+            self.logger.debug("%s changed since it was read. Parsing it again ..." % source)
+            start, end = self.parser.region(text)
+            found = dict((fields['name'], fields)
+                         for fields in self.parser.parse(text, start, end, text.count('\n', 0, start) + 1))
+            for qblock in bank + edited + deleted:
+                name = former.get(id(qblock), qblock['name'])
+                if 'span' not in qblock:
+                    continue  # New question
+                elif name in found:
+                    qblock.update(span=found[name]['span'], line=found[name]['line'])
+                elif 'span' in qblock and not qblock.get('lazy'):
+                    del qblock['span']  # Written as a new question
+        # Splices of the text: (start, end, [(new text, question block or None), ...])
+        start, end = self.parser.region(text)
+        splices = []
+        for qblock in deleted:
+            if 'span' in qblock:
+                a, b = qblock['span']
+                while b < end and text[b] == '\n':  # Blank lines after the block
+                    b += 1
+                splices.append((a, b, []))
+        added = []
+        for qblock in edited:
+            if 'span' in qblock:
+                a, b = qblock['span']
+                splices.append((a, b, [(self.parser.format(qblock, text[a:b]), qblock)]))
+            else:
+                added.append(qblock)
+        if added:
+            # After the last question, separated by a blank line (the last one may have been removed)
+            point = min([splice[0] for splice in splices if splice[1] == end] + [end])
+            parts = [('' if point == start or text.endswith('\n\n', 0, point)
+                      else '\n' if text.endswith('\n', 0, point) else '\n\n', None)]
+            for k, qblock in enumerate(added):
+                parts += [('\n' if k else '', None), (self.parser.format(qblock), qblock)]
+            if end < len(text):
+                parts.append(('\n', None))
+            splices.append((end, end, parts))
+        splices.sort(key=lambda splice: splice[:2])
+        pieces, moves, written = [], [], []
+        position, line, shift, lines = 0, 1, 0, 0
+        for a, b, parts in splices:
+            line += text.count('\n', position, a)
+            pieces.append(text[position:a])
+            offset, new_line = a + shift, line + lines
+            for string, qblock in parts:
+                if qblock is not None:
+                    written.append((qblock, offset, offset + len(string), new_line))
+                pieces.append(string)
+                offset += len(string)
+                new_line += string.count('\n')
+            removed_lines = text.count('\n', a, b)
+            shift = offset - b
+            lines = new_line - line - removed_lines
+            line += removed_lines
+            position = b
+            moves.append((a, b, shift, lines))
+        pieces.append(text[position:])
+        new_text = ''.join(pieces)
+        write_text(source, new_text)
+
+        # The other questions of the file move by the changes before them
+        ends = [move[1] for move in moves]
+
+        def moved(x):
+            k = bisect_right(ends, x)
+            if k and moves[k - 1][0] == moves[k - 1][1] == x:
+                k -= 1  # Text added at x goes after x
+            return moves[k - 1][2:] if k else (0, 0)
+
+        first, last = (moves[0][0], ends[-1]) if moves else (len(text), len(text))
+        for qblock in bank:
+            span = qblock.get('span')
+            if span is None or span[1] <= first:
+                continue
+            if span[0] > last:  # After all the changes: the usual case
+                (shift, lines), b_shift = moves[-1][2:], moves[-1][2]
+            else:
+                (shift, lines), b_shift = moved(span[0]), moved(span[1])[0]
+            qblock['span'] = (span[0] + shift, span[1] + b_shift)
+            qblock['line'] += lines
+        for qblock, a, b, line in written:
+            parsed = self.parser.parse(new_text, a, b, line)
+            qblock.update(parsed[0] if len(parsed) == 1 else {'span': (a, b), 'line': line})
+
+    def located(self, text, qblock, name=None):
+        """ Whether the span of a question still holds it in text (the file may have been edited since it was
+            read). A renamed question is looked for by its former name.
+        """
+        if name is not None:
+            qblock = dict(qblock.items(), name=name)
+        fields = self.parser.details(text, qblock)
+        return fields is not None and (qblock.get('lazy') or tuple(fields['span']) == tuple(qblock['span']))
+
+    def open_texfile(self, filepath):
+        """ Function that sets the variables for opening the input file (it is read by read_text)"""
+        if filepath[0] == '~':  # We expand (~/)
+            self.logger.debug(filepath)
+            self.texpath = os.path.expanduser(filepath)
+            self.logger.debug(self.texpath)
+        else:
+            self.texpath = filepath
+        self.logger.info("Loading %s ..." % self.texpath)
+        self.texfile = os.path.basename(self.texpath)
+        self.logger.debug('Tex file: %s' % self.texfile)
+        self.texname = self.texfile[0:-4]
+        self.logger.debug('Tex file name: %s' % self.texname)
+        self.texdir = os.path.dirname(self.texpath)
+        self.texdir = os.path.realpath(self.texdir)
+        self.texcwd = self.texdir
+        if self.texdir == "":  # If the file has local path format we add ./
+            self.texdir = "./"
+        self.logger.debug('Tex directory: %s' % self.texdir)
+        self.pngdir = self.texdir + '/png'
+        self.pdfdir = self.texdir + '/pdf'
+        # We check the existance of the file at that path and the extension
+        if self.check_file(self.texpath):
+            if not self.check_extension(self.texfile, 'tex'):
+                self.texpath = None
+                return False
+        else:
+            self.texpath = None
+            return False
+        return True
+
+    def check_file(self, fin, critical=True, warning=False):
+        """
+        Check if the file exists
+        :param fin: input file's path.
+        :param critical: forces the program to stop if the file is not found. Default is True.
+        :param warning: Raise a warning instead of an error.
+        :return: True if the file exists. False if it does not.
+        """
+        self.logger.debug("Checking %s file ..." % fin)
+        if not os.path.exists(fin):
+            if critical:
+                raise IOError('File %s does not exist.' % fin)
+            elif warning:
+                self.logger.warning('File %s does not exist.' % fin)
+                return False
+            else:
+                self.logger.error('File %s does not exist.' % fin)
+                return False
+        else:
+            return True
+
+    def check_extension(self, fin, extension):
+        """
+        Check the extension of file fin.
+        :param fin: input file's path.
+        :param extension: extension to be checked.
+        :return: True if the extension coincides.
+        """
+        self.logger.debug("Checking %s extension ..." % fin)
+        if not fin.endswith(extension):
+            self.logger.error("File %s is not a %s file." % (fin, extension))
+            return False
+        else:
+            return True
+
+    def read_questions(self, ifile):
+        """
+        Reads the already opened questions file. Looks for questions and choices (see questions.py for the
+        format), in a single pass over the file. Only the questions that changed since the file was last read
+        are parsed when the question index is enabled (see index.py).
+        :return: dictionary of question blocks, by identifier.
+        """
+        with stage(self.trace, 'read', files=[self.texpath]):
+            qblocks = parse_bank(ifile, self.texpath, self.parser, self.indexdir)
+        return self.namespace(qblocks)
+
+
+def bank_paths(texpath):
+    """ Source file of the questions of a file, and their directories (LaTeX, PNG and PDF files)."""
+    texdir = os.path.realpath(os.path.dirname(texpath))
+    return {'source': texpath, 'texdir': texdir, 'pngdir': texdir + '/png', 'pdfdir': texdir + '/pdf'}
+
+
+def parse_bank(text, texpath, parser, indexdir=None, lazy=False):
+    """
+    Question blocks of a questions file, all of them sharing the paths of the file (see bank_paths).
+    :param text: contents of the file.
+    :param texpath: path of the file.
+    :param parser: QuestionParser object.
+    :param indexdir: directory of the question index. None parses the whole file.
+    :param lazy: only the names of the questions are read (see QuestionParser.scan), unless the index has a
+                 snapshot of the file.
+    :return: list of Question objects (see qstore.py), in the order of the file.
+    """
+    logger = logging.getLogger('core')
+    logger.info("Searching for questions in %s ..." % os.path.basename(texpath))
+    start, end = parser.region(text)
+    line = text.count('\n', 0, start) + 1
+    index = None
+    if indexdir:
+        try:
+            index = QuestionIndex(indexdir, texpath, parser)
+        except IOError as e:
+            logger.warning("The question index could not be created: %s" % e)
+    if lazy:
+        qblocks = index.snapshot(text, start, end, line) if index else None
+        if qblocks is None:
+            qblocks = parser.scan(text, start, end, line)
+    else:
+        qblocks = (index or parser).parse(text, start, end, line=line)
+    qblocks = questions(qblocks, Origin(**bank_paths(texpath)))
+    logger.info("Number of questions detected: %d" % len(qblocks))
+    if not qblocks:
+        logger.warning('Bad format for questions or empty file ...')
+    return qblocks
+
+
+def read_bank(args):
+    """ Question blocks of a questions file (see parse_bank), read in a worker process of Data.open_banks.
+    :param args: path of the file, enumerate environments, directory of the question index and lazy reading.
+    """
+    texpath, enumerate_envs, indexdir, lazy = args
+    return parse_bank(read_text(texpath), texpath, QuestionParser(enumerate_envs), indexdir, lazy)
+
+
+def read_text(texpath):
+    """ Contents of a questions file. It is not kept: the questions keep only what they need."""
+    with open(texpath, 'r') as f:
+        return f.read()
+
+
+def dvi_preamble(preamble):
+    """ Preamble for latex and dvisvgm (see Data.format): the dvisvgm option of the document class selects the
+        driver of graphicx and color.
+    """
+    m = re.search(r'\\documentclass(?:\[([^\]]*)\])?', preamble)
+    if m is None or 'dvisvgm' in (m.group(1) or ''):
+        return preamble
+    options = m.group(1) + ',dvisvgm' if m.group(1) else 'dvisvgm'
+    return preamble[:m.start()] + '\\documentclass[%s]' % options + preamble[m.end():]
+
+
+def write_text(texpath, text):
+    """ Replaces the contents of a questions file atomically: they are written next to it, under a temporary name,
+        and then renamed over it, so that the file is never left half written.
+    """
+    target = os.path.realpath(texpath)
+    handle, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(target), suffix='.tmp',
+                                   dir=os.path.dirname(target))
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(target, tmp)
+        os.rename(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Kajut(object):
+    def __init__(self, data):
+        self.logger = logging.getLogger('core.Kajut')
+        self.d = data
+
+        # Basic configuration for LaTeX
+        self.preamble = None
+        self.fmt = None  # (preamble, name of its precompiled format)
+        self.ending = "\\end{document}\n"
+        self.latex_sizes = ['tiny', 'scriptsize', 'small', 'normalsize', 'large', 'Large', 'huge', 'Huge']
+        self.sel_sizes = {'qsize': "\\normalsize", 'size': "\\normalsize", "isize": 0.07}
+
+        self.sizes = None
+        self.set_sizes()
+        design = "\\def\\kajut#1#2#3#4{\n" \
+                 "  \\vspace*{1em}\n" \
+                 "  \\noindent\n" \
+                 "  \\begin{tabular}{c} \n" \
+                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
+                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image0}}}\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
+                 "      {\n" \
+                 "        \\Size #1\n" \
+                 "      }\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
+                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image1}}}\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
+                 "      {\n" \
+                 "        \\Size #2\n" \
+                 "      }\n" \
+                 "    \\end{minipage}\\\\[2em] \n" \
+                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
+                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image2}}}\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
+                 "      {\n" \
+                 "        \\Size #3\n" \
+                 "      }\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
+                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image3}}}\n" \
+                 "    \\end{minipage}\\hspace*{0.5em}\n" \
+                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
+                 "      {\n" \
+                 "       \\Size #4\n" \
+                 "      }\n" \
+                 "    \\end{minipage}\\\\\n" \
+                 "  \\end{tabular}\n" \
+                 "}\n"
+
+        design2 = "\\def\\kajut#1#2#3#4{\n" \
+                  " \\noindent\n" \
+                  " \\begin{enumerate}\n" \
+                  "   \\Myitem \\Size #1\n" \
+                  "   \\Myitem \\Size #2\n" \
+                  "   \\Myitem \\Size #3\n" \
+                  "   \\Myitem \\Size #4\n" \
+                  " \\end{enumerate}  \n" \
+                  "}\n"
+
+        design3 = "\\def\\kajut#1#2#3#4{\n" \
+                  "  \\vspace*{1em}\n" \
+                  "  \\begin{tabbedenum}{2}\n" \
+                  "    \\Myitem \\Size #1\n" \
+                  "    \\Myitem \\Size #2\n" \
+                  "    \\Myitem \\Size #3\n" \
+                  "    \\Myitem \\Size #4\n" \
+                  "  \\end{tabbedenum}  \n" \
+                  "}\n"
+
+        self.designs = {"tabular": design, "enumerate": design2, "tabbed": design3}
+
+        # PDF to PNG conversion
+        self.raster = get_rasterizer(self.d.rasterizer, self.d.rthreads, self.d.rmemory, self.d.timeout)
+        if self.raster is None and self.d.rasterizer != 'auto':
+            self.logger.warning("Using the first available rasterizer instead.")
+            self.raster = get_rasterizer('auto', self.d.rthreads, self.d.rmemory, self.d.timeout)
+        if self.raster is None:
+            # Checked when a PDF file is rasterized: SVG images and the fast backend do not need a rasterizer
+            self.logger.warning("No rasterizer found (install poppler-utils, ghostscript or imagemagick): only SVG "
+                                "images and the questions of the fast backend can be rendered.")
+
+        if self.d.backend == 'fast' and not fastrender.available():
+            self.logger.warning("The fast backend needs matplotlib. Every question is rendered with LaTeX.")
+
+        # Cache of rendered questions
+        self.cache = None
+        if self.d.cachedir:
+            self.cache = RenderCache(self.d.cachedir, self.d.cachesize)
+
+    def ensure_format(self):
+        """
+        Precompiled LaTeX format of the current preamble, so that pdflatex does not load all the packages
+        again for every question. Formats are named after the hash of the preamble, so a new one is built
+        whenever the page, margins or packages change.
+        :return: name of the format, or None if formats are disabled or it could not be built.
+        """
+        if not self.preamble:
+            self.set_preamble(self.d.page)
+        if not self.d.fmtdir:
+            return None
+        fmtdir = os.path.realpath(os.path.expanduser(self.d.fmtdir))
+        # A render job discards the format if it cannot be loaded
+        if self.fmt and self.fmt[0] == self.preamble and \
+                (self.fmt[1] is None or os.path.exists(os.path.join(fmtdir, self.fmt[1] + '.fmt'))):
+            return self.fmt[1]
+        name = 'kajut-' + hashlib.sha1(self.preamble).hexdigest()[:16]
+        if not os.path.exists(os.path.join(fmtdir, name + '.fmt')):
+            with stage(self.d.trace, 'format'):
+                name = self.build_format(name, fmtdir)
+        self.fmt = (self.preamble, name)
+        return name
+
+    def build_format(self, name, fmtdir):
+        """ Dumps the preamble into fmtdir/name.fmt (using mylatexformat). Returns the name or None."""
+        self.logger.info("Building LaTeX format %s ..." % name)
+        if not os.path.exists(fmtdir):
+            try:
+                os.makedirs(fmtdir)
+            except OSError:
+                if not os.path.isdir(fmtdir):
+                    raise IOError('Path %s does not exist.' % fmtdir)
+        # Built in a temporary directory and then renamed, so that concurrent jobs never load half a format
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=fmtdir)
+        with open(os.path.join(tmp, name + '.tex'), 'w') as f:
+            f.write(self.preamble)
+            f.write(self.ending)
+        # The format of the SVG images is built for latex (DVI output)
+        engine = 'latex' if self.d.format == 'svg' else 'pdflatex'
+        status, out, err = run([engine, '-ini', '-interaction=nonstopmode', '-jobname=%s' % name, '&' + engine,
+                                'mylatexformat.ltx', name + '.tex'], cwd=tmp, timeout=self.d.timeout)
+        try:
+            os.rename(os.path.join(tmp, name + '.fmt'), os.path.join(fmtdir, name + '.fmt'))
+            self.logger.debug("Done!")
+        except OSError:
+            self.logger.warning("The LaTeX format could not be built. The full preamble will be compiled instead.")
+            self.logger.debug(tail(out + err))
+            name = None
+        shutil.rmtree(tmp, ignore_errors=True)
+        return name
+
+    def job(self, qblocks):
+        """
+        Render job of one or several questions of the same file, with a snapshot of the current settings.
+        :raise IOError: if the questions have no directory (where their figures are looked up).
+        """
+        if not qblocks[0].get('texdir', self.d.texdir):
+            raise IOError("There is no path defined for question %s." % qblocks[0].get('name'))
+        return RenderJob(self, qblocks)
+
+    def render(self, qblock):
+        """
+        Renders a question into the PNG and PDF files (restoring them from the cache if possible).
+        :param qblock: question block, as returned by Data.read_questions.
+        :return: identifier of the question and whether the PNG file was created.
+        """
+        return self.job([qblock]).run()[0]
+
+    def render_chunk(self, qblocks):
+        """
+        Renders several questions compiling a single LaTeX document. If it does not compile, the questions
+        are rendered one by one, so that only the wrong ones fail.
+        :return: list of (identifier, success) tuples, in the same order as qblocks.
+        """
+        return self.job(qblocks).run()
+
+    def render_key(self, qblock):
+        """ Hash of everything that affects the rendered files of a question."""
+        if not self.preamble:
+            self.set_preamble(self.d.page)
+        h = hashlib.sha1()
+        # The directory of the file is where relative paths (figures, ...) are looked up
+        for field in ('name', 'title', 'time', 'question', 'choices', 'correct', 'texdir'):
+            h.update(repr(qblock.get(field)))
+        h.update(self.preamble)
+        h.update(self.sizes)
+        h.update(self.designs[self.d.design])
+        raster = self.raster.name if self.raster else None
+        h.update(repr((raster, self.d.density, self.d.width_px, self.d.height_px, self.d.letterbox,
+                       self.d.crop, self.d.page, self.d.pagedimensions[self.d.page], self.d.margins)))
+        if self.d.format == 'svg':
+            h.update(repr(('svg', self.d.svgfonts)))
+        if self.d.targets:
+            h.update(repr(self.d.targets))
+        elif self.d.backend == 'fast' and fastrender.check(qblock) is None:
+            h.update('fast')
+        return h.hexdigest()
+
+    def geometry(self, pagestyle='default'):
+        (width, height) = self.d.pagedimensions[pagestyle]
+        self.logger.debug("Paper dimensions: (W, H) = (%s, %s)." % (width, height))
+        margins = "".join(map(str, map(add, [',left=', ',right=', ',top=', ',bottom='], self.d.margins)))
+        self.logger.debug("Text margins:  %s." % margins)
+        geom = "\\usepackage[paperwidth=" + width + ",paperheight=" + height + margins + "]{geometry}\n"
+        return geom
+
+    def set_sizes(self):
+        self.sizes = "\\def\\Size{%s}\n" \
+                     "\\def\\QSize{%s}\n" \
+                     "\\def\\ISize{%f}\n" % (self.sel_sizes['size'], self.sel_sizes['qsize'], self.sel_sizes['isize'])
+
+    def set_preamble(self, pagestyle='default', external=None):
+        self.logger.debug("Generating LaTeX preamble...")
+        if not external:
+            geom = self.geometry(pagestyle)
+            self.preamble = "\\documentclass[12pt]{article}\n" \
+                            "\\usepackage[english, catalan]{babel}\n" \
+                            "\\usepackage[utf8]{inputenc}\n" \
+                            "\\usepackage{amsmath, amssymb, amsthm}\n" \
+                            "\\usepackage{color}\n" \
+                            "\\usepackage{graphicx}\n"
+            self.preamble = self.preamble + geom
+            self.preamble = self.preamble + "" \
+                                            "\\usepackage{adjustbox}\n" \
+                                            "\\setlength{\parindent}{0mm}\n" \
+                                            "\\usepackage{paralist}\n" \
+                                            "\\usepackage{tabto}\n" \
+                                            "\\usepackage{intcalc}\n" \
+                                            "\\usepackage{enumerate, letltxmacro}\n"
+            for package in self.d.extra_packages:
+                self.preamble += "\\usepackage{" + package + "}\n"
+            self.preamble = self.preamble + "\\graphicspath{{" + self.d.app_path + \
+                            "/}}\n" \
+                            "\\newcommand*{\Myitem}{ %\n" \
+                            "\\item[{\\adjustbox{valign = c}{\includegraphics[width = " \
+                            "1cm]{art/image\intcalcMod{\\value{enumi}}{4}}}}]\stepcounter{enumi} %\n" \
+                            "}\n" \
+                            "\\LetLtxMacro\itemold\Myitem\n" \
+                            "\\renewcommand{\Myitem}{\itemindent1cm\itemold}\n" \
+                            "\\newenvironment{tabbedenum}[1]\n" \
+                            "{\NumTabs{#1}\inparaenum\let\latexitem\Myitem\n" \
+                            "\\def\Myitem{\def\Myitem{\\tab\latexitem}\latexitem}}\n" \
+                            "{\endinparaenum}\n" \
+                            "\\begin{document}\n" \
+                            "\\setlength{\\parindent}{0pt}\n" \
+                            "\\pagestyle{empty}\n"
+        else:
+            self.logger.debug("Loading preamble from %s..." % external)
+            with open(external, "r") as f:
+                content = f.read()
+                preamble = re.findall(r'% BEGIN PREAMBLE\n(.*?)% END PREAMBLE\n', content, re.DOTALL)
+            if preamble:
+                self.preamble = preamble[0]
+            else:
+                self.logger.error("Bad format of the latex document. I could not detect any clear preamble.\n"
+                                  "Use:\n"
+                                  "% BEGIN PREAMBLE\n"
+                                  "[preamble]\n"
+                                  "% END PREAMBLE\n")
+                self.logger.warning("Using default preamble...")
+                self.set_preamble(self.d.page)
+        if self.d.format == 'svg':
+            self.preamble = dvi_preamble(self.preamble)
+        self.logger.debug("Done!")
@@ -0,0 +1,439 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import imp
+import zlib
+import threading
+import logging
+from raster import fit_density, write_png
+
+matplotlib = None  # Imported on first use (see load): it takes a good part of a second
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Fast render backend: questions made of plain text and math are laid out in the designs of Kajut (the same
+    icons, sizes and page geometry) and drawn with matplotlib (mathtext), without LaTeX. The PNG image is written
+    directly, in a few milliseconds instead of a pdflatex + pdfcrop + rasterizer round trip.
+
+    check() tells whether a question can be rendered this way: four choices, and no environments, figures or
+    macros other than those of mathtext. Any other question is rendered with LaTeX.
+"""
+
+logging.getLogger('fastrender').addHandler(logging.NullHandler())
+
+# Font sizes (pt) of the size commands of the 12pt article class
+FONT_SIZES = {'tiny': 6, 'scriptsize': 8, 'small': 10.95, 'normalsize': 12, 'large': 14.4, 'Large': 17.28,
+              'huge': 20.74, 'Huge': 24.88}
+TEXT_FONTS = ['CMU Serif', 'Latin Modern Roman', 'DejaVu Serif']
+RC = {'mathtext.fontset': 'cm'}
+CM = 72 / 2.54
+
+# Text mode: macros that are written as characters, spaces or line breaks
+TEXT_CHARS = {'%': u'%', '&': u'&', '#': u'#', '_': u'_', '{': u'{', '}': u'}', '$': u'\\$',
+              'ldots': u'\u2026', 'dots': u'\u2026', 'textendash': u'\u2013', 'textemdash': u'\u2014'}
+TEXT_SPACES = set([' ', ',', ';', 'quad', 'qquad', 'enspace', 'thinspace'])
+TEXT_BREAKS = set(['\\', 'newline'])
+TEXT_IGNORED = set(['noindent', 'centering', 'relax', '/'])
+LIGATURES = [(u'---', u'\u2014'), (u'--', u'\u2013'), (u'``', u'\u201c'), (u"''", u'\u201d'), (u'`', u'\u2018'),
+             (u"'", u'\u2019'), (u'~', u'\u00a0')]
+
+TOKENS = re.compile(r'(?P<display>\$\$(?P<d1>.*?)\$\$|\\\[(?P<d2>.*?)\\\])'
+                    r'|(?P<math>\$(?P<m1>(?:[^$\\]|\\.)+?)\$|\\\((?P<m2>.*?)\\\))'
+                    r'|(?P<par>\n[ \t]*\n\s*)'
+                    r'|(?P<space>\s+)'
+                    r'|\\(?P<macro>[a-zA-Z]+|.)'
+                    r'|(?P<brace>[{}])'
+                    r'|(?P<chars>[^\s$\\{}]+)', re.S)
+KINDS = ('display', 'math', 'par', 'space', 'macro', 'brace', 'chars')
+COMMENT = re.compile(r'(?<!\\)%[^\n]*')
+MATH_MACRO = re.compile(r'\\([a-zA-Z]+|.)')
+MATH_SYMBOLS = set(' ,;:!>/{}|%$#_&')
+
+MATH_MACROS = set()  # Filled in by load
+
+_lock = threading.Lock()  # matplotlib (its rc settings and its mathtext cache) is not thread safe
+_icons = {}
+# Formulas are parsed once to measure them and drawn from its cache: every renderer has its own parser otherwise
+_mathtext = None
+
+
+class Unsupported(ValueError):
+    """ The question uses something that only LaTeX can render."""
+
+
+def available():
+    """ Whether matplotlib is installed, without importing it."""
+    try:
+        imp.find_module('matplotlib')
+    except ImportError:
+        return False
+    return True
+
+
+def load():
+    """ Imports matplotlib and the macros known to mathtext. Returns False if matplotlib is not available."""
+    global numpy, matplotlib, Figure, FontProperties, FigureCanvasAgg, RendererAgg, imread, _mathtext
+    if _mathtext is not None:
+        return True
+    with _lock:
+        if _mathtext is not None:
+            return True
+        try:
+            import numpy
+            import matplotlib
+            from matplotlib.figure import Figure
+            from matplotlib.font_manager import FontProperties
+            from matplotlib.backends.backend_agg import FigureCanvasAgg, RendererAgg
+            from matplotlib.mathtext import MathTextParser, Parser
+            from matplotlib._mathtext_data import tex2uni
+            from matplotlib.image import imread
+        except ImportError:
+            return False
+        MATH_MACROS.update(tex2uni, Parser._function_names, Parser._wide_accents, Parser._fontnames)
+        MATH_MACROS.update(name for name in Parser._accent_map if name.isalpha())
+        MATH_MACROS.update(name.lstrip('\\') for name in Parser._space_widths if name[1:].isalpha())
+        MATH_MACROS.update(['math' + name for name in Parser._fontnames])
+        MATH_MACROS.update(['frac', 'dfrac', 'binom', 'genfrac', 'sqrt', 'stackrel', 'overline', 'operatorname',
+                            'left', 'right', 'displaystyle', 'textstyle', 'scriptstyle', 'scriptscriptstyle'])
+        _mathtext = MathTextParser('Agg')
+    return True
+
+
+def check(qblock):
+    """
+    Static analysis of a question block.
+    :return: the reason why the question has to be rendered with LaTeX, or None if the fast backend renders it.
+    """
+    if not load():
+        return "matplotlib is not installed"
+    if len(qblock.get('choices') or []) != 4:
+        return "%d choices" % len(qblock.get('choices') or [])
+    try:
+        for text in [qblock['question']] + list(qblock['choices']):
+            parse(text)
+    except Unsupported as e:
+        return str(e)
+    return None
+
+
+def parse(text):
+    """
+    Splits the LaTeX source of a statement or a choice into words (lists of text and math pieces that can not
+    be separated), line breaks, paragraphs and displayed equations.
+    :return: list of ('word', [(string, ismath), ...]), ('break',), ('par',) and ('display', string) items.
+    """
+    try:
+        text = text.decode('utf-8') if isinstance(text, str) else text
+    except UnicodeDecodeError:
+        raise Unsupported("not UTF-8")
+    text = COMMENT.sub('', text).strip()
+    items = []
+    word = []
+    pos = 0
+    while pos < len(text):
+        m = TOKENS.match(text, pos)
+        if m is None:
+            raise Unsupported("unbalanced math delimiters")
+        pos = m.end()
+        kind = [group for group in KINDS if m.group(group) is not None][0]
+        if kind in ('chars', 'math', 'brace') or (kind == 'macro' and m.group('macro') in TEXT_CHARS):
+            if kind == 'chars':
+                chars = m.group('chars')
+                for latex, char in LIGATURES:
+                    chars = chars.replace(latex, char)
+                word.append((chars, False))
+            elif kind == 'math':
+                word.append((u'$%s$' % check_math(m.group('m1') or m.group('m2')), True))
+            elif kind == 'macro':
+                word.append((TEXT_CHARS[m.group('macro')], False))
+            continue
+        if word:
+            items.append(('word', word))
+            word = []
+        if kind == 'display':
+            items.append(('display', u'$%s$' % check_math(m.group('d1') or m.group('d2'))))
+        elif kind == 'par':
+            items.append(('par',))
+        elif kind == 'macro':
+            macro = m.group('macro')
+            if macro in TEXT_BREAKS:
+                items.append(('break',))
+            elif macro == 'par':
+                items.append(('par',))
+            elif macro not in TEXT_SPACES and macro not in TEXT_IGNORED:
+                raise Unsupported(unsupported(macro))
+    if word:
+        items.append(('word', word))
+    return items
+
+
+def check_math(math):
+    """ Raises Unsupported if a formula uses anything that mathtext does not know."""
+    math = math.strip()
+    if not math:
+        raise Unsupported("empty formula")
+    if '&' in math.replace('\\&', ''):
+        raise Unsupported("alignment in a formula")
+    for m in MATH_MACRO.finditer(math):
+        macro = m.group(1)
+        if macro not in MATH_MACROS and macro not in MATH_SYMBOLS:
+            raise Unsupported(unsupported(macro))
+    return math
+
+
+def unsupported(macro):
+    if macro == 'begin':
+        return "environment"
+    return "macro \\%s" % macro
+
+
+class Block(object):
+    """ Laid out box: drawing operations relative to its top left corner, in points (1/72 in)."""
+
+    def __init__(self, width=0.0, height=0.0, ops=None, baseline=0.0):
+        self.width = width
+        self.height = height
+        self.ops = ops or []  # ('text', x, baseline, string, ismath, size) and ('icon', x, top, size, index)
+        self.baseline = baseline  # Of the first line
+
+    def place(self, block, x, y):
+        """ Adds the operations of another block with its top left corner at (x, y)."""
+        for op in block.ops:
+            self.ops.append(op[:1] + (op[1] + x, op[2] + y) + op[3:])
+        self.width = max(self.width, x + block.width)
+        self.height = max(self.height, y + block.height)
+
+    def bbox(self, margin=0.0):
+        """ Box (x0, y0, x1, y1) of the operations, from the extents of the text, plus a margin."""
+        boxes = []
+        for op in self.ops:
+            if op[0] == 'text':
+                boxes.append((op[1], op[2] - op[6], op[1] + op[7], op[2] + op[8]))
+            else:
+                boxes.append((op[1], op[2], op[1] + op[3], op[2] + op[3]))
+        if not boxes:
+            return 0.0, 0.0, 1.0, 1.0
+        return (min(b[0] for b in boxes) - margin, min(b[1] for b in boxes) - margin,
+                max(b[2] for b in boxes) + margin, max(b[3] for b in boxes) + margin)
+
+
+class FastRenderer(object):
+    """ Lays out questions in a design of Kajut and draws them into PNG images.
+
+        It keeps a copy of the settings of Kajut (like render.RenderJob), so that it can be pickled.
+    """
+
+    def __init__(self, design, page, margins, sizes, art):
+        """
+        :param design: name of the design (tabular, enumerate, tabbed).
+        :param page: width and height of the page in points.
+        :param margins: left, right, top and bottom margins in points.
+        :param sizes: selected sizes of Kajut (sel_sizes): statement and choices size commands, and icon width.
+        :param art: directory of the icons (image0.png, ...).
+        """
+        self.design = design
+        self.page = page
+        self.margins = margins
+        self.qsize = FONT_SIZES.get(sizes['qsize'].lstrip('\\'), 12)
+        self.size = FONT_SIZES.get(sizes['size'].lstrip('\\'), 12)
+        self.isize = float(sizes['isize'])
+        self.art = art
+        self.renderer = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['renderer'] = None
+        return state
+
+    def render(self, qblock, png, density, size=None, letterbox=False, crop=False):
+        """
+        Writes the PNG image of a question.
+        :param density: dots per inch, unless size is given.
+        :param size: (width, height) in pixels, either may be None; the page (or cropped box) fits in it.
+        :param letterbox: pad the image to exactly size (white, centered).
+        :param crop: crop the image to its contents, like pdfcrop.
+        :raise Unsupported: if the question can not be rendered by this backend.
+        """
+        if not load():
+            raise Unsupported("matplotlib is not installed")
+        left, right, top, bottom = self.margins
+        page = (-left, -top, self.page[0] - left, self.page[1] - top)
+        # Text is measured at the density of the image, when it is known beforehand, so that mathtext parses
+        # every formula once (its cache depends on the density)
+        if not size:
+            dpi = density
+        elif not crop:
+            dpi = fit_density((page[2] - page[0], page[3] - page[1]), *size)
+        else:
+            dpi = 72
+        with _lock, matplotlib.rc_context(RC):
+            self.renderer = RendererAgg(1, 1, dpi)
+            self.renderer.mathtext_parser = _mathtext
+            block = self.layout(qblock)
+            if block.height > self.page[1] - top - bottom:
+                raise Unsupported("more than one page")
+            self.draw(block, png, block.bbox(1.0) if crop else page, density, size, letterbox)
+
+    def layout(self, qblock):
+        """ Block of the statement followed by the choices, with its origin at the top left of the text area."""
+        width = self.page[0] - self.margins[0] - self.margins[1]
+        question = self.paragraph(parse(qblock['question']), self.qsize, width)
+        choices = [parse(choice) for choice in qblock['choices']]
+        block = Block(width)
+        block.place(question, 0, 0)
+        em = self.size
+        y = question.height + em
+        if self.design == 'tabular':
+            # One row of icon + text minipages (vertically centered) per two choices, 2em between the rows
+            icon = self.isize * width
+            x = 6.0  # \tabcolsep
+            for row in (0, 2):
+                cells = [self.paragraph(choices[k], self.size, 0.4 * width) for k in (row, row + 1)]
+                height = max([icon] + [cell.height for cell in cells])
+                xk = x
+                for k, cell in enumerate(cells):
+                    block.ops.append(('icon', xk, y + (height - icon) / 2, icon, row + k))
+                    xk += icon + 0.5 * em
+                    block.place(cell, xk, y + (height - cell.height) / 2)
+                    xk += 0.4 * width + 0.5 * em
+                y += height + 2 * em
+        elif self.design == 'enumerate':
+            # List with 1cm icons as labels, the first line indented by \itemindent (1cm)
+            indent = 2.5 * em
+            for k, choice in enumerate(choices):
+                item = self.paragraph(choice, self.size, width - indent, CM)
+                y = self.item(block, item, k, indent - 0.5 * em, indent, y) + 0.5 * em
+        else:
+            # Items in two columns (tabbedenum{2}): icon and text
+            column = width / 2
+            for row in (0, 2):
+                bottom = y
+                for k in (row, row + 1):
+                    x = (k - row) * column
+                    item = self.paragraph(choices[k], self.size, column - CM - em)
+                    bottom = max(bottom, self.item(block, item, k, x, x + CM + 0.5 * em, y))
+                y = bottom + 0.5 * em
+        return block
+
+    def item(self, block, item, k, icon_x, x, y):
+        """ Places an item with its icon (1cm) centered on the math axis of its first line. Returns its bottom."""
+        axis = item.baseline - 0.25 * self.size
+        shift = max(0.0, CM / 2 - axis)
+        block.ops.append(('icon', icon_x, y + shift + axis - CM / 2, CM, k % 4))
+        block.place(item, x, y + shift)
+        return max(y + shift + item.height, y + shift + axis + CM / 2)
+
+    def paragraph(self, items, size, width, indent=0.0):
+        """ Breaks words into lines of the given width (the first one indented) and stacks them."""
+        prop = FontProperties(family=TEXT_FONTS, size=size)
+        space = self.measure(u'x x', False, prop)[0] - self.measure(u'xx', False, prop)[0]
+        lines = [(False, [])]  # (displayed equation, [(x, string, ismath, width, height, descent), ...])
+        x = indent
+        for item in items:
+            if item[0] == 'word':
+                pieces = [(s, ismath) + self.measure(s, ismath, prop) for s, ismath in item[1]]
+                w = sum(piece[2] for piece in pieces)
+                if lines[-1][1] and x + space + w > width:
+                    lines.append((False, []))
+                    x = 0.0
+                elif lines[-1][1]:
+                    x += space
+                for s, ismath, pw, ph, pd in pieces:
+                    lines[-1][1].append((x, s, ismath, pw, ph, pd))
+                    x += pw
+            elif item[0] == 'display':
+                w, h, d = self.measure(item[1], True, prop)
+                lines.append((True, [(max(0.0, (width - w) / 2), item[1], True, w, h, d)]))
+                lines.append((False, []))
+                x = 0.0
+            elif lines[-1][1]:
+                lines.append((False, []))
+                x = 0.0
+        block = Block(width)
+        y = descent = 0.0
+        for display, boxes in lines:
+            if not boxes:
+                continue
+            ascent = max(h - d for x, s, ismath, w, h, d in boxes)
+            if not block.ops:
+                y = block.baseline = ascent
+            else:
+                # \baselineskip, or \lineskip between lines that do not fit in it
+                y += max(1.2 * size, descent + ascent + 1.0) + (0.5 * size if display else 0.0)
+            descent = max(d for x, s, ismath, w, h, d in boxes) + (0.5 * size if display else 0.0)
+            for x, s, ismath, w, h, d in boxes:
+                block.ops.append(('text', x, y, s, ismath, size, h - d, w, d))
+        block.height = y + descent
+        return block
+
+    def measure(self, s, ismath, prop):
+        """ Width, height and descent of a string, in points."""
+        if not ismath:
+            s = s.replace(u'\\$', u'$')  # Escaped for Figure.text
+        try:
+            scale = 72.0 / self.renderer.dpi
+            return tuple(length * scale for length in self.renderer.get_text_width_height_descent(s, prop, ismath))
+        except ValueError as e:  # A formula that mathtext can not parse
+            raise Unsupported("mathtext: %s" % str(e).split('\n')[0])
+
+    def draw(self, block, png, box, density, size, letterbox):
+        """ Draws the part box (x0, y0, x1, y1 in points, relative to the block) of a block into a PNG file."""
+        x0, y0, x1, y1 = box
+        if size:
+            density = fit_density((x1 - x0, y1 - y0), *size)
+        scale = density / 72.0
+        width, height = int(round((x1 - x0) * scale)), int(round((y1 - y0) * scale))
+        dx = dy = 0.0
+        if letterbox:
+            dx, dy = (size[0] - width) / 2.0, (size[1] - height) / 2.0
+            width, height = size
+        figure = Figure(figsize=((width + 0.5) / density, (height + 0.5) / density), dpi=density, facecolor='white')
+        canvas = FigureCanvasAgg(figure)
+        fonts = {}
+        for op in block.ops:
+            x = dx + (op[1] - x0) * scale
+            y = dy + (op[2] - y0) * scale
+            if op[0] == 'text':
+                if op[5] not in fonts:
+                    fonts[op[5]] = FontProperties(family=TEXT_FONTS, size=op[5])
+                figure.text(x / figure.bbox.width, (height - y) / figure.bbox.height, op[3],
+                            fontproperties=fonts[op[5]], va='baseline', ha='left')
+            else:
+                pixels = max(1, int(round(op[3] * scale)))
+                figure.figimage(self.icon(op[4], pixels), int(round(x)), int(round(height - y)) - pixels,
+                                origin='upper', zorder=0)
+        # Written by hand: faster than the PNG writer of matplotlib, and RGB like the rasterizers
+        canvas.get_renderer().mathtext_parser = _mathtext
+        canvas.draw()
+        rows = numpy.zeros((height, 3 * width + 1), numpy.uint8)  # Filter byte (none) and pixels of every row
+        rows[:, 1:] = numpy.frombuffer(canvas.tostring_rgb(), numpy.uint8).reshape(height, 3 * width)
+        write_png(png, width, height, zlib.compress(rows.tostring(), 6))
+
+    def icon(self, k, pixels):
+        """ Icon k, scaled to pixels x pixels by averaging the pixels of the original image."""
+        key = (self.art, k, pixels)
+        if key not in _icons:
+            image = imread(os.path.join(self.art, 'image%d.png' % k))
+            rows = numpy.linspace(0, image.shape[0], pixels + 1).astype(int)[:-1]
+            cols = numpy.linspace(0, image.shape[1], pixels + 1).astype(int)[:-1]
+            image = numpy.add.reduceat(image, rows, axis=0) / numpy.diff(list(rows) + [image.shape[0]])[:, None, None]
+            image = numpy.add.reduceat(image, cols, axis=1) / numpy.diff(list(cols) + [image.shape[1]])[None, :, None]
+            _icons[key] = image
+        return _icons[key]
@@ -21,7 +21,9 @@ import re
 import threading
 import urllib
 import logging
-from operator import add
+from collections import OrderedDict
+from core import Data, Kajut  # Data is imported from here by older scripts
+from render import RenderQueue
 
 try:
     import gi
@@ -52,436 +54,112 @@ except AttributeError:
     logging.exception("pygobject version too old.")
 
 try:
-    from gi.repository import Gtk, Gdk, GObject, GdkPixbuf
+    from gi.repository import Gtk, Gdk, GObject, GLib, GdkPixbuf
 except (ImportError, RuntimeError):
     logging.exception("Requires pygobject to be installed.")
 
 logging.getLogger('gui').addHandler(logging.NullHandler())
 TARGET_TYPE_URI_LIST = 0
+# Icons of the render status of the questions
+STATUS_ICONS = {'queued': 'gtk-media-pause', 'running': 'gtk-execute', 'done': 'gtk-apply',
+                'failed': 'gtk-dialog-error'}
+# Rows added to the list of questions at a time, when the GUI is idle
+FILL_CHUNK = 500
 
 
-class Data:
-    def __init__(self, opts, cwd="./"):
-        self.logger = logging.getLogger('gui.Data')
-
-        self.cwd = cwd
-        self.inputfile = opts['i']
-        self.density = opts['d']  # Default density for png conversion
-        self.qblocks = {}
-        self.texcwd = cwd
-        self.crop = opts['crop']
-        self.design = opts['design']
-        self.app_path = os.path.dirname(__file__)
-        self.logger.debug("The executable is in %s" % self.app_path)
-
-        # LaTeX related options
-        self.enumerate = ["enumerate", "tabbedenum"]
-        self.extra_packages = []
-        self.pagedimensions = {'A4': ['21cm', '29.7cm'], 'default': ['21cm', '10cm'], 'custom': ['21cm', '10cm']}
-        self.page = 'default'
-        self.margins = ['0.5cm', '0.5cm', '0.5cm', '0.5cm']
-
-        # Paths
-        if self.inputfile in (None, "None", "none", "null"):
-            self.texpath = None
-            self.texfile = None
-            self.texname = None
-            self.texdir = None
-            self.pngdir = None
-            self.pdfdir = None
-            self.tex = None
-        else:
-            # Opening .tex file
-            if self.open_texfile(self.inputfile):
-                self.qblocks = self.read_questions(self.tex)
-
-    def open_texfile(self, filepath):
-        """ Function that sets the variables for opening the input file """
-        if filepath[0] == '~':  # We expand (~/)
-            self.logger.debug(filepath)
-            self.texpath = os.path.expanduser(filepath)
-            self.logger.debug(self.texpath)
-        else:
-            self.texpath = filepath
-        self.logger.info("Loading %s ..." % self.texpath)
-        self.texfile = os.path.basename(self.texpath)
-        self.logger.debug('Tex file: %s' % self.texfile)
-        self.texname = self.texfile[0:-4]
-        self.logger.debug('Tex file name: %s' % self.texname)
-        self.texdir = os.path.dirname(self.texpath)
-        self.texdir = os.path.realpath(self.texdir)
-        self.texcwd = self.texdir
-        if self.texdir == "":  # If the file has local path format we add ./
-            self.texdir = "./"
-        self.logger.debug('Tex directory: %s' % self.texdir)
-        self.pngdir = self.texdir + '/png'
-        self.pdfdir = self.texdir + '/pdf'
-        # We check the existance of the file at that path and the extension
-        if self.check_file(self.texpath):
-            if not self.check_extension(self.texfile, 'tex'):
-                self.texpath = None
-                return False
-        else:
-            self.texpath = None
-            return False
-
-        # Prepare the tex file to read (tags)
-        f = open(self.texpath, 'r')
-        self.tex = f.read()
-        return True
+class PixbufCache(object):
+    """ Scaled previews of the questions (pixbufs), kept in memory and evicted in least recently used order.
+        Entries are keyed by path, modification time and size, so that a question rendered again is reloaded.
+        A background thread loads the previews that will probably be shown next.
+    """
 
-    def check_file(self, fin, critical=True, warning=False):
+    def __init__(self, width=880, maxsize=64):
         """
-        Check if the file exists
-        :param fin: input file's path.
-        :param critical: forces the program to stop if the file is not found. Default is True.
-        :param warning: Raise a warning instead of an error.
-        :return: True if the file exists. False if it does not.
+        :param width: width of the previews in pixels.
+        :param maxsize: maximum memory used by the previews in MB.
         """
-        self.logger.debug("Checking %s file ..." % fin)
-        if not os.path.exists(fin):
-            if critical:
-                raise IOError('File %s does not exist.' % fin)
-            elif warning:
-                self.logger.warning('File %s does not exist.' % fin)
-                return False
-            else:
-                self.logger.error('File %s does not exist.' % fin)
-                return False
-        else:
-            return True
+        self.logger = logging.getLogger('gui.PixbufCache')
+        self.width = width
+        self.maxsize = maxsize * 1024 * 1024
+        self.entries = OrderedDict()  # (path, mtime, size) -> (pixbuf, bytes)
+        self.paths = {}  # path -> current key
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.wanted = threading.Condition(self.lock)
+        self.queue = []
+        self.loader = threading.Thread(target=self.prefetch_loop)
+        self.loader.daemon = True
+        self.loader.start()
 
-    def check_extension(self, fin, extension):
-        """
-        Check the extension of file fin.
-        :param fin: input file's path.
-        :param extension: extension to be checked.
-        :return: True if the extension coincides.
-        """
-        self.logger.debug("Checking %s extension ..." % fin)
-        if not fin.endswith(extension):
-            self.logger.error("File %s is not a %s file." % (fin, extension))
-            return False
-        else:
-            return True
-
-    def read_questions(self, ifile):
-        """
-        Reads the already opened questions file. Looks for questions and choices.
-        :return: 'question' and 'choices'
-        """
-        # The questions files should have an specific format:
-        # % File_name: T1_c1.1_q1
-        # % Title: Pregunta 1
-        # Enunciado de la pregunta.
-        # \begin{enumerate}
-        # \Myitem Respuesta 1.
-        # \Myitem Respuesta 2.
-        # \Myitem Respuesta 3.
-        # \Myitem Respuesta 4. % Correct
-        # \end{enumerate}
-
-        # In case is a completely formatted .tex file we look for preambles and ends of the type:
-        # % BEGIN PREAMBLE
-        # % END PREAMBLE
-        # % BEGIN END
-        # % END END
-
-        self.logger.info("Searching for questions ...")
-        questions_pre = re.findall(r'% BEGIN PREAMBLE.*?% END PREAMBLE\n', ifile, re.DOTALL)
-        questions_end = re.findall(r'% BEGIN END(.*?)% END END\n', ifile, re.DOTALL)
-
-        # The questions should be inside these two blocks
-        if questions_pre and questions_end:
-            questions = re.findall(r'% END PREAMBLE.*?% BEGIN END\n', ifile, re.DOTALL)
-        else:
-            questions = [ifile]
-
-        enum = "(" + "|".join(map(str, self.enumerate)) + ")"
-        if questions:
-            question_blocks = re.findall(r'(% File_name: )(.*?)' + enum + r'(.*?)' + enum + r'(\}\n)',
-                                         questions[0], re.DOTALL)
-            if question_blocks:
-                for k, block in enumerate(question_blocks):
-                    question_blocks[k] = "".join(map(str, block))
-        else:
-            self.logger.warning('Bad format for questions or empty file ...')
+    @staticmethod
+    def key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
             return None
+        return path, st.st_mtime, st.st_size
 
-        self.logger.info("Number of questions detected: %d" % len(question_blocks))
-
-        qblocks = {}
-
-        for k, block in enumerate(question_blocks):
-            self.logger.debug("Block %d" % k)
-            if block:
-                self.logger.debug(block)
-                name = re.findall(r'% File_name: (.*?)\n', block)
-                self.logger.debug("File name: %s" % name[0])
-                title = re.findall(r'% Title: (.*?)\n', block)
-                self.logger.debug("Title: %s" % title[0])
-                time = re.findall(r'% Time: (.*?)\n', block)
-                if time:
-                    self.logger.debug("Time: %s" % time[0])
-                    question = re.findall(r'% Time:.*?\n(.*?)\\begin\{enumerate\}\n', block, re.DOTALL)
-                    if not question:
-                        self.logger.debug("Trying tabbedenum ...")
-                        question = re.findall(r'% Time:.*?\n(.*?)\\begin\{tabbedenum\}\{2\}\n', block, re.DOTALL)
-                else:
-                    time = ("None")
-                    question = re.findall(r'% Title:.*?\n(.*?)\\begin\{enumerate\}\n', block, re.DOTALL)
-                    if not question:
-                        self.logger.debug("Trying tabbedenum ...")
-                        question = re.findall(r'% Title:.*?\n(.*?)\\begin\{tabbedenum\}\{2\}\n', block, re.DOTALL)
-                if not question:
-                    self.logger.error('Bad format for questions or empty file %s ...' % name[0])
-                    raw_input("Continue ...")
-                    continue
-                self.logger.debug("Question: %s" % question[0])
-                choices = re.findall(r'\\Myitem*(.*?%*enditem).*?\n', block, re.DOTALL)
-                self.logger.debug("Choices:")
-                self.logger.debug(choices)
-                correct = None
-                for j, choice in enumerate(choices):
-                    if re.findall(r'%*Correct', choice):
-                        self.logger.debug("Correct choice is %d." % (j + 1))
-                        correct = j
-                qblocks[name[0]] = ({'name': name[0], 'title': title[0], 'question': question[0],
-                                     'choices': choices, 'correct': correct, 'time': time[0]})
-
-        self.logger.debug(qblocks)
-        return qblocks
-
-
-class Kajut(object):
-    def __init__(self, data):
-        self.logger = logging.getLogger('gui.Kajut')
-        self.d = data
-
-        # Basic configuration for LaTeX
-        self.preamble = None
-        self.ending = "\\end{document}\n"
-        self.latex_sizes = ['tiny', 'scriptsize', 'small', 'normalsize', 'large', 'Large', 'huge', 'Huge']
-        self.sel_sizes = {'qsize': "\\normalsize", 'size': "\\normalsize", "isize": 0.07}
-
-        self.sizes = None
-        self.set_sizes()
-        design = "\\def\\kajut#1#2#3#4{\n" \
-                 "  \\vspace*{1em}\n" \
-                 "  \\noindent\n" \
-                 "  \\begin{tabular}{c} \n" \
-                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
-                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image0}}}\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
-                 "      {\n" \
-                 "        \\Size #1\n" \
-                 "      }\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
-                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image1}}}\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
-                 "      {\n" \
-                 "        \\Size #2\n" \
-                 "      }\n" \
-                 "    \\end{minipage}\\\\[2em] \n" \
-                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
-                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image2}}}\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
-                 "      {\n" \
-                 "        \\Size #3\n" \
-                 "      }\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{\\ISize\\textwidth}\n" \
-                 "      {\\adjustbox{valign = c}{\\includegraphics[width=\\textwidth]{art/image3}}}\n" \
-                 "    \\end{minipage}\\hspace*{0.5em}\n" \
-                 "    \\begin{minipage}[c]{0.4\\textwidth}\n" \
-                 "      {\n" \
-                 "       \\Size #4\n" \
-                 "      }\n" \
-                 "    \\end{minipage}\\\\\n" \
-                 "  \\end{tabular}\n" \
-                 "}\n"
-
-        design2 = "\\def\\kajut#1#2#3#4{\n" \
-                  " \\noindent\n" \
-                  " \\begin{enumerate}\n" \
-                  "   \\Myitem \\Size #1\n" \
-                  "   \\Myitem \\Size #2\n" \
-                  "   \\Myitem \\Size #3\n" \
-                  "   \\Myitem \\Size #4\n" \
-                  " \\end{enumerate}  \n" \
-                  "}\n"
-
-        design3 = "\\def\\kajut#1#2#3#4{\n" \
-                  "  \\vspace*{1em}\n" \
-                  "  \\begin{tabbedenum}{2}\n" \
-                  "    \\Myitem \\Size #1\n" \
-                  "    \\Myitem \\Size #2\n" \
-                  "    \\Myitem \\Size #3\n" \
-                  "    \\Myitem \\Size #4\n" \
-                  "  \\end{tabbedenum}  \n" \
-                  "}\n"
-
-        self.designs = {"tabular": design, "enumerate": design2, "tabbed": design3}
-
-    def create_latex(self, qblock):
-        if not self.preamble:
-            self.set_preamble(self.d.page)
-        if not self.d.texdir:
-            self.logger.warning("There is no path defined ...")
-            # TODO: ask for a path to save files
-            exit(-1)
-        filename = "%s/tex-%s" % (self.d.texdir, qblock['name'])
-        filepath = filename + '.tex'
-        self.logger.debug("Writing latex file for question %s in %s ..." % (qblock['name'], filepath))
-
-        f = open(filepath, 'w')
-        f.write(self.preamble)
-        # Font sizes and design
-        f.write(self.sizes)
-        f.write(self.designs[self.d.design])
-        num_choices = len(qblock['choices'])
-        if num_choices < 4:
-            self.logger.warning("This question (%s) has only %d choices!" % (qblock['name'], num_choices))
-        else:
-            for a, choice in zip(["A", "B", "C", "D"], qblock['choices']):
-                f.write("\\def\\" + a + "{" + choice + "\n}\n")
-        # % File_name: T1_c1.1_q1
-        # % Title: Pregunta 1
-        f.write("% File_name: " + qblock['name'] + "\n")
-        f.write("% Title: " + qblock['name'] + "\n")
-        f.write("{\\QSize\n" + qblock['question'] + "\n}\n")
-        if num_choices == 4:
-            f.write("\\kajut{\\A}{\\B}{\\C}{\\D}\n")
-        else:
-            f.write("{\\noindent\n" + " \\begin{enumerate}\n")
-            for choice in qblock['choices']:
-                f.write("\\Myitem \\Size " + choice + "\n")
-            f.write(" \\end{enumerate}  \n" + "}\n")
-        f.write(self.ending)
-        f.close()
-        self.logger.debug("LaTeX file created!")
-        return filename
-
-    def create_png(self, filename):
-        filename = os.path.realpath(filename)
-        # Compile latex file
-        self.logger.debug("Using latex file  %s ..." % (filename + '.tex'))
-        filedir = os.path.realpath(self.d.texdir)
-        # Check for the necessary paths
-        if not os.path.exists(self.d.pngdir):
-            try:
-                os.mkdir(self.d.pngdir)
-            except:
-                raise IOError('Path %s does not exist.' % self.d.pngdir)
-        if not os.path.exists(self.d.pdfdir):
-            try:
-                os.mkdir(self.d.pdfdir)
-            except:
-                raise IOError('Path %s does not exist.' % self.d.pdfdir)
-
-        # Compile latex file
-        self.logger.debug("Compiling LaTeX ...")
-        os.chdir(self.d.texdir)
-        p = os.popen('pdflatex -output-directory=%s -interaction=nonstopmode -file-line-error  %s '
-                     '| grep ".*:[0-9]*:.*"' % (filedir, (filename + '.tex')))
-        p.close()
-        self.logger.debug("Done!")
-        if self.d.crop:
-            p = os.popen('pdfcrop --noverbose %s.pdf | grep nothing' % filename)
-            p.close()
-            p = os.popen('mv %s-crop.pdf %s.pdf' % (filename, filename))
-            p.close()
-
-        self.logger.debug("Removing auxiliary files ...")
-        p = os.popen('rm %s.aux %s.log' % (filename, filename))
-        p.close()
-        self.logger.debug("Done!")
-
-        self.logger.info("Creating png file, with density %d ..." % self.d.density)
-        p = os.popen('convert -flatten -density %d %s.pdf %s.png' % (self.d.density, filename, filename))
-        p.close()
-        self.logger.info("Done!")
-
-        p = os.popen('mv %s.png %s' % (filename, self.d.pngdir))
-        png = p.close()
-
-        if png:
-            p = os.popen('mv %s/*.png %s' % (self.d.texdir, self.d.pngdir))
-            p.close()
-
-        p = os.popen('mv %s.pdf %s' % (filename, self.d.pdfdir))
-        p.close()
-        self.logger.debug("All jobs finished.")
-        return True, png
-
-    def geometry(self, pagestyle='default'):
-        (width, height) = self.d.pagedimensions[pagestyle]
-        self.logger.debug("Paper dimensions: (W, H) = (%s, %s)." % (width, height))
-        margins = "".join(map(str, map(add, [',left=', ',right=', ',top=', ',bottom='], self.d.margins)))
-        self.logger.debug("Text margins:  %s." % margins)
-        geom = "\\usepackage[paperwidth=" + width + ",paperheight=" + height + margins + "]{geometry}\n"
-        return geom
-
-    def set_sizes(self):
-        self.sizes = "\\def\\Size{%s}\n" \
-                     "\\def\\QSize{%s}\n" \
-                     "\\def\\ISize{%f}\n" % (self.sel_sizes['size'], self.sel_sizes['qsize'], self.sel_sizes['isize'])
-
-    def set_preamble(self, pagestyle='default', external=None):
-        self.logger.debug("Generating LaTeX preamble...")
-        if not external:
-            geom = self.geometry(pagestyle)
-            self.preamble = "\\documentclass[12pt]{article}\n" \
-                            "\\usepackage[english, catalan]{babel}\n" \
-                            "\\usepackage[utf8]{inputenc}\n" \
-                            "\\usepackage{amsmath, amssymb, amsthm}\n" \
-                            "\\usepackage{color}\n" \
-                            "\\usepackage{graphicx}\n"
-            self.preamble = self.preamble + geom
-            self.preamble = self.preamble + "" \
-                                            "\\usepackage{adjustbox}\n" \
-                                            "\\setlength{\parindent}{0mm}\n" \
-                                            "\\usepackage{paralist}\n" \
-                                            "\\usepackage{tabto}\n" \
-                                            "\\usepackage{intcalc}\n" \
-                                            "\\usepackage{enumerate, letltxmacro}\n"
-            for package in self.d.extra_packages:
-                self.preamble += "\\usepackage{" + package + "}\n"
-            self.preamble = self.preamble + "\\graphicspath{{" + self.d.app_path + \
-                            "/}}\n" \
-                            "\\newcommand*{\Myitem}{ %\n" \
-                            "\\item[{\\adjustbox{valign = c}{\includegraphics[width = " \
-                            "1cm]{art/image\intcalcMod{\\value{enumi}}{4}}}}]\stepcounter{enumi} %\n" \
-                            "}\n" \
-                            "\\LetLtxMacro\itemold\Myitem\n" \
-                            "\\renewcommand{\Myitem}{\itemindent1cm\itemold}\n" \
-                            "\\newenvironment{tabbedenum}[1]\n" \
-                            "{\NumTabs{#1}\inparaenum\let\latexitem\Myitem\n" \
-                            "\\def\Myitem{\def\Myitem{\\tab\latexitem}\latexitem}}\n" \
-                            "{\endinparaenum}\n" \
-                            "\\begin{document}\n" \
-                            "\\setlength{\\parindent}{0pt}\n" \
-                            "\\pagestyle{empty}\n"
-        else:
-            self.logger.debug("Loading preamble from %s..." % external)
-            with open(external, "r") as f:
-                content = f.read()
-                preamble = re.findall(r'% BEGIN PREAMBLE\n(.*?)% END PREAMBLE\n', content, re.DOTALL)
-            if preamble:
-                self.preamble = preamble[0]
-            else:
-                self.logger.error("Bad format of the latex document. I could not detect any clear preamble.\n"
-                                  "Use:\n"
-                                  "% BEGIN PREAMBLE\n"
-                                  "[preamble]\n"
-                                  "% END PREAMBLE\n")
-                self.logger.warning("Using default preamble...")
-                self.set_preamble(self.d.page)
-        self.logger.debug("Done!")
+    def get(self, path):
+        """ Preview of a PNG file, from memory if possible. Returns None if the file does not exist."""
+        key = self.key(path)
+        if key is None:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = self.entries.pop(key)  # Most recently used
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        return self.load(key)
+
+    def load(self, key):
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(key[0], self.width, -1, True)
+        except GLib.GError:
+            self.logger.warning("Preview of %s could not be loaded." % key[0])
+            return None
+        nbytes = pixbuf.get_rowstride() * pixbuf.get_height()
+        with self.lock:
+            if key not in self.entries:
+                old = self.paths.get(key[0])
+                if old in self.entries:
+                    self.size -= self.entries.pop(old)[1]
+                self.entries[key] = (pixbuf, nbytes)
+                self.paths[key[0]] = key
+                self.size += nbytes
+                while self.size > self.maxsize and len(self.entries) > 1:
+                    old, (old_pixbuf, old_bytes) = self.entries.popitem(last=False)
+                    self.paths.pop(old[0], None)
+                    self.size -= old_bytes
+        return pixbuf
+
+    def prefetch(self, paths):
+        """ Loads these previews in the background, in order. Replaces the previous request."""
+        with self.lock:
+            self.queue = list(paths)
+            self.wanted.notify()
+
+    def prefetch_loop(self):
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.wanted.wait()
+                path = self.queue.pop(0)
+            key = self.key(path)
+            if key is not None:
+                with self.lock:
+                    cached = key in self.entries
+                if not cached:
+                    self.load(key)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return "%d previews in memory (%.1f of %.0f MB), %d hits and %d misses (%.0f%% hits)." \
+                   % (len(self.entries), self.size / 1048576.0, self.maxsize / 1048576.0, self.hits, self.misses,
+                      100.0 * self.hits / total if total else 0.0)
 
 
 class MainGui:
@@ -492,6 +170,7 @@ class MainGui:
             self.kj = kajut
         self.d = data
         self.logger = logging.getLogger('gui.MainGui')
+        self.previews = PixbufCache(880, self.d.previewcache)
         scriptpath = os.path.realpath(__file__)
         scriptdir = os.path.dirname(scriptpath)
 
@@ -543,6 +222,7 @@ class MainGui:
                    "on_edit_clicked": self.on_edit_clicked,
                    "on_generate_clicked": self.on_generate_clicked,
                    "on_generate_all_clicked": self.on_generate_all_clicked,
+                   "on_cancel_clicked": self.on_cancel_clicked,
                    "on_open_clicked": self.on_open_clicked,
                    "on_crop_toggled": self.on_crop_toggled,
                    "on_toggled": self.on_design_toggled,
@@ -579,36 +259,51 @@ class MainGui:
         self.png_image.set_from_icon_name('gtk-missing-image', Gtk.IconSize.DIALOG)
         color = Gdk.Color(red=65535, green=65535, blue=65535)
         self.png_image.modify_bg(Gtk.StateFlags.NORMAL, color)
-        self.timeout_id = None
         self.selected_name = None
-        self.all = False
         # Question's extra properties
         self.title_label = self.builder.get_object('title_label')
         self.time_label = self.builder.get_object('time_label')
         self.correct_box = self.builder.get_object('correct_box')
         self.correct_icon = self.builder.get_object("correct_icon")
 
-        # We create the listbox store for the questions
-        if self.d.qblocks:
-            for k, key in enumerate(self.d.qblocks.keys()):
-                self.namelist.append([k, key])
-            self.treeview.set_cursor(0)
-            model, iteration = self.treeview.get_selection().get_selected()
-            self.selected_name = model[iteration][1]
-            self.logger.debug("Default selection: %s" % self.selected_name)
+        # Render queue and status of every question in it ('queued', 'running', 'done' or 'failed')
+        self.queue = RenderQueue(self.d.workers, self.on_render_event, self.d.trace)
+        self.status = {}
+        self.cancelbutton = self.builder.get_object("cancel")
 
         renderer = Gtk.CellRendererText()
         column = Gtk.TreeViewColumn("Name", renderer, text=1)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(240)
+        column.set_resizable(True)
+        column.set_expand(True)
         self.treeview.append_column(column)
         column.set_sort_column_id(1)
+        renderer = Gtk.CellRendererPixbuf()
+        column = Gtk.TreeViewColumn("Status", renderer, icon_name=2)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(48)
+        self.treeview.append_column(column)
+        # All the rows have the same height: the list only measures the rows that are shown
+        self.treeview.set_fixed_height_mode(True)
         # Sort the quetions
         sorted_model = self.builder.get_object("question_sort")
         sorted_model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
-        self.treeview.set_cursor(0)
+
+        # We create the listbox store for the questions: rows of every question and questions not yet listed
+        self.rows = {}
+        self.pending = []
+        self.filling = None
+        if self.d.qblocks:
+            self.sync_liststore()
+            self.select_row(0)
         self.window.show_all()
 
     def on_exit_clicked(self, event):
         self.logger.debug('Button %s pressed' % event)
+        self.logger.info(self.previews.stats())
+        if self.d.trace is not None:
+            self.d.trace.summary()
         Gtk.main_quit()
 
     def on_open_clicked(self, event):
@@ -649,21 +344,65 @@ class MainGui:
                     self.update_liststore(path)
 
     def update_liststore(self, path):
-        if self.d.open_texfile(path):
-            new_qblocks = self.d.read_questions(self.d.tex)
-            if new_qblocks:
-                self.d.qblocks.update(new_qblocks)
-                # Add the new blocks to the listbox (store, etc.)
-                self.namelist.clear()
-                for k, key in enumerate(self.d.qblocks):
-                    self.namelist.append([k, key])
-                # Sort the quetions
-                sorted_model = self.builder.get_object("question_sort")
-                sorted_model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
-                self.treeview.set_cursor(0)
-                model, iteration = self.treeview.get_selection().get_selected()
-                self.selected_name = model[iteration][1]
-                self.logger.debug("Default selection: %s" % self.selected_name)
+        if self.d.open_bank(path):
+            # Add the new blocks to the listbox (store, etc.)
+            self.sync_liststore()
+            self.select_row(0)
+
+    def sync_liststore(self):
+        """ Updates the list of questions with the changes of the bank: only the rows of the questions that were
+            removed or added change. The first rows are added at once, the rest in chunks when the GUI is idle
+            (see fill_liststore).
+        """
+        removed = [name for name in self.rows if name not in self.d.qblocks]
+        if removed and len(removed) == len(self.rows):
+            self.namelist.clear()
+            self.rows = {}
+        else:
+            for name in removed:
+                self.namelist.remove(self.rows.pop(name))
+        # The rows are added in order: the first ones are shown while the rest are added
+        self.pending = sorted((name for name in self.d.qblocks if name not in self.rows), reverse=True)
+        self.logger.debug("%d rows removed, %d to add." % (len(removed), len(self.pending)))
+        if self.fill_liststore() and self.filling is None:
+            self.filling = GObject.idle_add(self.fill_liststore)
+
+    def fill_liststore(self):
+        """ Adds the next chunk of pending questions to the list, with the render status of each one.
+            :return: True while there are questions left.
+        """
+        for k in xrange(min(FILL_CHUNK, len(self.pending))):
+            self.add_row(self.pending.pop())
+        if self.pending:
+            return True
+        self.filling = None
+        return False
+
+    def add_row(self, name):
+        """ Adds the row of the question name to the list, if it is not there."""
+        if name in self.d.qblocks and name not in self.rows:
+            self.rows[name] = self.namelist.append([len(self.rows), name, STATUS_ICONS.get(self.status.get(name))])
+
+    def select_row(self, row=0):
+        """ Selects a row of the list (or the last one, if there are less rows)."""
+        model = self.treeview.get_model()
+        rows = model.iter_n_children(None)
+        if not rows:
+            self.selected_name = None
+            return
+        self.treeview.set_cursor(min(row, rows - 1))
+        model, iteration = self.treeview.get_selection().get_selected()
+        self.selected_name = model[iteration][1]
+        self.logger.debug("Default selection: %s" % self.selected_name)
+
+    def select_name(self, name):
+        """ Selects the row of the question name."""
+        self.add_row(name)
+        if name not in self.rows:
+            return
+        path = self.treeview.get_model().convert_child_path_to_path(self.namelist.get_path(self.rows[name]))
+        if path is not None:
+            self.treeview.set_cursor(path)
 
     @staticmethod
     def get_file_path_from_dnd_dropped_uri(uri):
@@ -771,35 +510,51 @@ class MainGui:
         # Store the selected element, for editing or removing
         self.selected_name = name
         self.logger.debug('Selected question: %s' % name)
-        filename = self.d.pngdir + '/tex-' + name + '.png'
-        filename2 = self.d.pngdir + '/tex-' + name + '-0.png'
+        # The question is parsed the first time it is selected
+        qblock = self.d.question(name)
+        if qblock is None:
+            GObject.idle_add(self.sync_liststore)
+            return 1
         # Change the title and time labels, update correct answer icon
-        if self.d.qblocks[name]['title']:
-            self.title_label.set_text(self.d.qblocks[name]['title'])
+        if qblock['title']:
+            self.title_label.set_text(qblock['title'])
         else:
             self.title_label.set_text("Not defined.")
-        if self.d.qblocks[name]['time']:
-            self.time_label.set_text(self.d.qblocks[name]['time'])
+        if qblock['time']:
+            self.time_label.set_text(qblock['time'])
         else:
             self.time_label.set_text("Not defined.")
-        if self.d.qblocks[name]['correct'] is not None:
-            correct = int(self.d.qblocks[name]['correct'])
+        if qblock['correct'] is not None:
+            correct = int(qblock['correct'])
             icon = self.d.app_path + ('/art/icon%d.png' % correct)
             self.logger.debug("Setting icon %s (%d) in %s" % (icon, correct, self.correct_icon))
             self.correct_icon.set_from_file(icon)
         else:
             self.correct_icon.set_from_icon_name('gtk-missing-image', Gtk.IconSize.DIALOG)
-        # Check whether a PNG file exists for the selected question
-        if self.d.check_file(filename, critical=False, warning=True):
-            # Display the PNG in the canvas area
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(filename, 880, -1, True)
-            self.png_image.set_from_pixbuf(pixbuf)
-        elif self.d.check_file(filename2, critical=False, warning=True):  # Check if the png is in multiple files
-            self.logger.warning("The file needs more than one page. Multiple PNG files created.")
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(filename2, 880, -1, True)
+        # Display the PNG of the selected question in the canvas area
+        pixbuf = self.previews.get(self.preview_file(name))
+        if pixbuf is not None:
             self.png_image.set_from_pixbuf(pixbuf)
         else:
+            self.logger.warning("There is no PNG file for question %s." % name)
             self.png_image.set_from_icon_name('gtk-missing-image', Gtk.IconSize.DIALOG)
+        # Load the previews of the neighbouring rows in the background
+        row = model.get_path(treeiter).get_indices()[0]
+        rows = model.iter_n_children(None)
+        neighbours = []
+        for k in xrange(1, self.d.prefetch + 1):
+            neighbours += [j for j in (row + k, row - k) if 0 <= j < rows]
+        self.previews.prefetch([self.preview_file(model[j][1]) for j in neighbours])
+        self.logger.debug(self.previews.stats())
+
+    def preview_file(self, name):
+        """ PNG file of a question (its first page, if there are several)."""
+        qblock = self.d.qblocks[name]
+        filename = qblock.get('pngdir', self.d.pngdir) + '/tex-' + qblock['name']
+        if not os.path.exists(filename + '.png') and os.path.exists(filename + '-0.png'):
+            self.logger.debug("Question %s needs more than one page. Showing the first one." % name)
+            return filename + '-0.png'
+        return filename + '.png'
 
     def on_add_clicked(self, event):
         """ Add a new row to the list box."""
@@ -809,9 +564,10 @@ class MainGui:
         dialog.run()
         if dialog.accept and dialog.new:
             self.selected_name = dialog.name
+            self.d.save_questions([self.selected_name])
             self.on_generate_clicked(None)
-            newfile = self.d.texdir + '/tex-' + self.selected_name + '.tex'
-            self.update_liststore(newfile)
+            self.sync_liststore()
+            self.select_name(self.selected_name)
         dialog.hide()
 
         # Modify the tree_store if the dialog is accepted
@@ -821,19 +577,15 @@ class MainGui:
     def on_remove_clicked(self, event):
         """ Remove the selected question."""
         self.logger.debug('Button %s pressed' % event)
-        if len(self.d.qblocks) > 0:
-            self.d.qblocks.pop(self.selected_name)
-            self.namelist.clear()
-            if len(self.d.qblocks) > 0:
-                for k, key in enumerate(self.d.qblocks):
-                    self.namelist.append([k, key])
-                # Sort the quetions
-                sorted_model = self.builder.get_object("question_sort")
-                sorted_model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
-                self.treeview.set_cursor(0)
-                model, iteration = self.treeview.get_selection().get_selected()
-                self.selected_name = model[iteration][1]
-                self.logger.debug("Default selection: %s" % self.selected_name)
+        if self.selected_name in self.d.qblocks:
+            model, iteration = self.treeview.get_selection().get_selected()
+            row = model.get_path(iteration).get_indices()[0] if iteration is not None else 0
+            # The question is also removed from its file
+            self.d.remove_question(self.selected_name)
+            if self.selected_name in self.rows:
+                self.namelist.remove(self.rows.pop(self.selected_name))
+            # The next question takes its place
+            self.select_row(row)
         if len(self.d.qblocks) == 0:
             self.selected_name = None
 
@@ -841,23 +593,34 @@ class MainGui:
         """ Edit the selected question """
         self.logger.debug('Button %s pressed' % event)
         # Open the edition dialog
-        if self.selected_name:
+        if self.selected_name and self.d.question(self.selected_name):
             dialog = EditDialog(self.d, selection=self.selected_name, parent=self.window)
             dialog.run()
-            if dialog.accept and dialog.new:
+            if dialog.accept:
+                # Only the block of the question is rewritten in its file, in place also when it is renamed
+                self.d.save_questions([dialog.name], renamed={dialog.name: dialog.renamed} if dialog.renamed else None)
+            if dialog.accept and (dialog.new or dialog.renamed):
                 self.selected_name = dialog.name
                 self.on_generate_clicked(None)
-                newfile = self.d.texdir + '/tex-' + self.selected_name + '.tex'
-                self.update_liststore(newfile)
+                self.sync_liststore()
+                self.select_name(self.selected_name)
             dialog.hide()
 
-    def on_generate_clicked(self, event):
+    def on_generate_clicked(self, event, names=None):
         self.logger.debug('Button %s pressed' % event)
         if self.d.texpath:
-            self.timeout_id = GObject.timeout_add(50, self.on_timeout, True)
-            self.thread = threading.Thread(target=self.outside_task)
-            self.thread.start()
-            self.watch = GObject.timeout_add(500, self.watch_thread, True)
+            if names is None:
+                names = [self.selected_name] if self.selected_name else []
+                self.png_image.set_from_icon_name('gtk-missing-image', Gtk.IconSize.DIALOG)
+            self.kj.set_sizes()
+            # Questions not parsed yet are parsed now (the ones that can not be parsed leave the list)
+            qblocks = self.d.details(names)
+            if len(qblocks) < len(names):
+                self.sync_liststore()
+            # Every job takes a snapshot of the current settings
+            self.queue.submit([self.kj.job([qblock]) for qblock in qblocks])
+            self.cancelbutton.set_sensitive(True)
+            self.update_progress()
         else:
             self.logger.warning("There is no TEX file loaded.")
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL,
@@ -866,49 +629,50 @@ class MainGui:
             dialog.destroy()
 
     def on_generate_all_clicked(self, event):
-        self.all = True
         self.logger.info("Generating PNG images for all questions...")
-        self.on_generate_clicked(event)
+        self.on_generate_clicked(event, sorted(self.d.qblocks))
 
-    def on_timeout(self, user_data):
-        self.pbar.pulse()
-        return user_data
-
-    def watch_thread(self, user_data):
-        if not self.thread.isAlive():
-            self.thread.join()
-            return False
-        else:
-            return user_data
-
-    def outside_task(self):
-        self.kj.set_sizes()
-        if self.all:
-            blocks = len(self.d.qblocks.keys())
-            for k, name in enumerate(self.d.qblocks.keys()):
-                self.logger.info("File %d/%d:" % (k+1, blocks))
-                filename = self.kj.create_latex(self.d.qblocks[name])
-                self.kj.create_png(filename)
-            self.all = False
-        else:
-            filename = self.kj.create_latex(self.d.qblocks[self.selected_name])
-            self.png_image.set_from_icon_name('gtk-missing-image', Gtk.IconSize.DIALOG)
-            success, png = self.kj.create_png(filename)
-            if success:
-                if not png:
-                    pngfile = self.d.pngdir + '/tex-' + self.selected_name + '.png'
-                else:
-                    pngfile = self.d.pngdir + '/tex-' + self.selected_name + '-0.png'
-                # Check whether a PNG file exists for the selected question
-                if self.d.check_file(pngfile, critical=False, warning=True):
-                    # Display the PNG in the canvas area
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(pngfile, 880, -1, True)
+    def on_cancel_clicked(self, event):
+        self.logger.debug('Button %s pressed' % event)
+        self.queue.cancel()
+
+    def on_render_event(self, event, name=None, success=None):
+        """ Progress of the render queue. Called from its worker threads: the GUI is updated in the main loop."""
+        if event == 'finished' and self.kj.cache:
+            self.kj.cache.trim()
+        GObject.idle_add(self.render_event, event, name, success)
+
+    def render_event(self, event, name, success):
+        if event == 'finished':
+            self.cancelbutton.set_sensitive(False)
+            self.logger.info("Done.")
+        elif event == 'done':
+            self.status[name] = 'done' if success else 'failed'
+            if success and name == self.selected_name:
+                # Display the PNG in the canvas area
+                pixbuf = self.previews.get(self.preview_file(name))
+                if pixbuf is not None:
                     self.png_image.set_from_pixbuf(pixbuf)
-                    if png:
-                        self.logger.warning("The file needs more than one page. Multiple PNG files created.")
-        self.logger.info("Done.")
-        GObject.source_remove(self.timeout_id)
-        self.pbar.set_fraction(0.0)
+        elif event == 'cancelled':
+            self.status.pop(name, None)
+        else:
+            self.status[name] = event
+        if name in self.rows and name in self.d.qblocks:
+            self.namelist.set_value(self.rows[name], 2, STATUS_ICONS.get(self.status.get(name)))
+        self.update_progress()
+        return False
+
+    def update_progress(self):
+        done, total, eta = self.queue.progress()
+        if not total:
+            self.pbar.set_fraction(0.0)
+            self.pbar.set_text("")
+            return
+        self.pbar.set_fraction(float(done) / total)
+        text = "%d/%d" % (done, total)
+        if eta is not None and done < total:
+            text += ", %d:%02d left" % divmod(int(eta), 60)
+        self.pbar.set_text(text)
 
     @staticmethod
     def add_filters(dialog):
@@ -945,7 +709,8 @@ class EditDialog(Gtk.Dialog):
 
         self.logger = logging.getLogger('gui.EditDialog')
         self._builder = builder
-        self.qblocks = data.qblocks
+        self.data = data
+        self.selection = selection
 
         signals = {"on_cancel": self._on_cancel,
                    "on_accept": self._on_accept}
@@ -972,7 +737,7 @@ class EditDialog(Gtk.Dialog):
 
         # If the dialog is for editing, modify the text in the buffers
         if selection:
-            self.entry.set_text(selection)
+            self.entry.set_text(data.qblocks[selection]['name'])
             self.title_entry.set_text(data.qblocks[selection]['title'])
             self.time_entry.set_text(data.qblocks[selection]['time'])
             self.sentence.set_text(data.qblocks[selection]['question'])
@@ -986,23 +751,39 @@ class EditDialog(Gtk.Dialog):
 
         self.accept = False
         self.new = False
+        self.renamed = None  # Former name of the edited question, if it was renamed
         self.name = selection
 
     def _on_accept(self, event):
         # If the dialog is for editing, modify the text in the buffers
         name = self.entry.get_text()
-        self.name = name
-        # Check if the name is new
-        if name not in self.qblocks:
-            self.new = True
         if name not in (None, ""):
+            # Check if the name is new (in the file of the edited question)
+            source = self.data.qblocks[self.selection]['source'] if self.selection else self.data.texpath
+            self.name = self.data.question_id(name, source)
+            if self.name != self.selection and self.name in self.data.qblocks:
+                # Another question of the file has this name: its block would be overwritten
+                self.logger.error("There is already a question %s in %s." % (name, source))
+                dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL,
+                                           "There is already a question named %s. Choose another name." % name)
+                dialog.run()
+                dialog.destroy()
+                self.name = self.selection
+                return
+            if self.selection and self.name != self.selection:
+                # The edited question is renamed, not copied
+                self.renamed = self.data.qblocks[self.selection]['name']
+                self.name = self.data.rename_question(self.selection, name)
+            elif self.name not in self.data.qblocks:
+                self.new = True
+                self.name = self.data.new_question(name, like=self.selection)
             title = self.title_entry.get_text()
             time = self.time_entry.get_text()
             sentence = self.get_text(self.sentence)
             choices = []
             for k, choice in enumerate(self.choices):
                 choices.append(self.get_text(choice))
-            self.qblocks[name].update({'question': sentence, 'name': name, 'choices': choices,
+            self.data.qblocks[self.name].update({'question': sentence, 'name': name, 'choices': choices,
                                        'title': title, 'time': time})
             self.hide()
             self.accept = True
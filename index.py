@@ -0,0 +1,187 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import marshal
+import hashlib
+import sqlite3
+import zlib
+import logging
+import qstore
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Persistent index of the questions files (SQLite), so that reopening a bank only parses the questions that
+    changed.
+
+    The questions region of the file is split into segments of a few questions, each one starting at a
+    '% File_name:' line. The parsed blocks of every segment are stored under the hash of its bytes, with offsets
+    and line numbers relative to the segment. On reopen, a file with the same hash is loaded at once from a
+    snapshot of all its blocks (see qstore.py); otherwise, only the segments whose hash is unknown are parsed
+    again.
+"""
+
+logging.getLogger('index').addHandler(logging.NullHandler())
+
+VERSION = 2
+NAME = re.compile(r'^% File_name: ([^\n]*)', re.M)
+SEGMENT = 32  # Mean number of questions per segment
+
+
+class QuestionIndex(object):
+    def __init__(self, indexdir, texpath, parser):
+        """
+        :param indexdir: directory of the index files (one per questions file).
+        :param texpath: path of the questions file.
+        :param parser: QuestionParser used for the segments not found in the index.
+        """
+        self.logger = logging.getLogger('index.QuestionIndex')
+        self.parser = parser
+        indexdir = os.path.realpath(os.path.expanduser(indexdir))
+        if not os.path.exists(indexdir):
+            try:
+                os.makedirs(indexdir)
+            except OSError:
+                if not os.path.isdir(indexdir):
+                    raise IOError('Path %s does not exist.' % indexdir)
+        texpath = os.path.realpath(os.path.expanduser(texpath))
+        self.path = os.path.join(indexdir, hashlib.sha1(texpath).hexdigest()[:16] + '.sqlite')
+        # Changes of the parser settings invalidate the whole index
+        self.config = repr((VERSION, qstore.VERSION, SEGMENT, parser.tokens.pattern, parser.choice.pattern))
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.text_factory = str
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+        db.execute("CREATE TABLE IF NOT EXISTS segments (hash TEXT PRIMARY KEY, blocks BLOB)")
+        config = db.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if config is None or str(config[0]) != self.config:
+            db.execute("DELETE FROM segments")
+            db.execute("DELETE FROM meta")
+            db.execute("INSERT INTO meta VALUES ('config', ?)", (self.config,))
+            db.commit()
+        return db
+
+    def parse(self, text, start=0, end=None, line=1):
+        """
+        Question blocks of text[start:end], as returned by QuestionParser.parse (or Question objects, when they
+        come from the snapshot), taken from the index when possible. Any problem with the index falls back to
+        parsing the whole text.
+        """
+        if end is None:
+            end = len(text)
+        try:
+            db = self.connect()
+        except sqlite3.Error as e:
+            self.logger.warning("The question index %s could not be opened (%s). Parsing the whole file ..."
+                                % (self.path, e))
+            return self.parser.parse(text, start, end, line)
+        try:
+            with db:
+                texhash = self.texhash(text, start, end, line)
+                qblocks = self.load(db, texhash)
+                if qblocks is not None:
+                    return qblocks
+                return self.update(db, text, start, end, line, texhash)
+        except (sqlite3.Error, ValueError, EOFError, TypeError) as e:
+            self.logger.warning("The question index %s could not be used (%s). Parsing the whole file ..."
+                                % (self.path, e))
+            return self.parser.parse(text, start, end, line)
+        finally:
+            db.close()
+
+    def snapshot(self, text, start=0, end=None, line=1):
+        """
+        Question blocks of text[start:end] if the index has a snapshot of this very text, without parsing
+        anything.
+        :return: list of Question objects (see qstore.py), or None.
+        """
+        if end is None:
+            end = len(text)
+        if not os.path.exists(self.path):
+            return None
+        try:
+            db = self.connect()
+            try:
+                return self.load(db, self.texhash(text, start, end, line))
+            finally:
+                db.close()
+        except (sqlite3.Error, ValueError, EOFError, TypeError) as e:
+            self.logger.warning("The question index %s could not be used (%s)." % (self.path, e))
+            return None
+
+    @staticmethod
+    def texhash(text, start, end, line):
+        return hashlib.sha1(text).hexdigest() + ':%d:%d:%d' % (start, end, line)
+
+    def load(self, db, texhash):
+        """ Snapshot of the file, if its hash is texhash. None otherwise."""
+        stored = db.execute("SELECT value FROM meta WHERE key = 'file'").fetchone()
+        if stored is None or str(stored[0]) != texhash:
+            return None
+        snapshot = db.execute("SELECT value FROM meta WHERE key = 'snapshot'").fetchone()
+        if snapshot is None:
+            return None
+        self.logger.debug("Unchanged file: questions loaded from the index.")
+        return qstore.loads(str(snapshot[0]))
+
+    @staticmethod
+    def bounds(text, start, end):
+        """
+        Limits of the segments of text[start:end]. Segments are cut before the questions whose name hashes to
+        0 (modulo SEGMENT), so that inserting or removing a question only changes the segment that contains it.
+        """
+        bounds = [start]
+        for m in NAME.finditer(text, start, end):
+            if m.start() > start and zlib.crc32(m.group(1)) % SEGMENT == 0:
+                bounds.append(m.start())
+        bounds.append(end)
+        return bounds
+
+    def update(self, db, text, start, end, line, texhash):
+        """ Parses the segments that are not in the index and stores the new snapshot of the file."""
+        bounds = self.bounds(text, start, end)
+        known = dict(db.execute("SELECT hash, blocks FROM segments"))
+        used = set()
+        qblocks = []
+        parsed = 0
+        for k in xrange(len(bounds) - 1):
+            a, b = bounds[k], bounds[k + 1]
+            if k:
+                line += text.count('\n', bounds[k - 1], a)
+            shash = hashlib.sha1(text[a:b]).hexdigest()
+            used.add(shash)
+            if shash in known:
+                for qblock in marshal.loads(str(known[shash])):
+                    qblock['line'] += line
+                    qblock['span'] = (qblock['span'][0] + a, qblock['span'][1] + a)
+                    qblocks.append(qblock)
+                continue
+            segment = self.parser.parse(text, a, b, line)
+            qblocks.extend(segment)
+            relative = [dict(qblock, line=qblock['line'] - line, span=(qblock['span'][0] - a, qblock['span'][1] - a))
+                        for qblock in segment]
+            known[shash] = marshal.dumps(relative)
+            db.execute("INSERT OR REPLACE INTO segments VALUES (?, ?)", (shash, buffer(known[shash])))
+            parsed += 1
+        db.executemany("DELETE FROM segments WHERE hash = ?", [(h,) for h in known if h not in used])
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('file', ?)", (texhash,))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('snapshot', ?)", (buffer(qstore.dumps(qblocks)),))
+        self.logger.debug("%d segments of %d parsed, the rest loaded from the index." % (parsed, len(used)))
+        return qblocks
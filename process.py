@@ -0,0 +1,148 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import errno
+import logging
+import threading
+import subprocess
+from timing import child
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Execution of the external programs of the render pipeline (pdflatex, pdfcrop, gs, ...), without a shell.
+"""
+
+logging.getLogger('process').addHandler(logging.NullHandler())
+
+
+class Cancel(object):
+    """ Cancellation of a group of programs, run from any number of threads: once cancelled, the running programs
+        are killed and the following ones are not started.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+        for p in processes:
+            kill(p)
+
+    def add(self, p):
+        with self.lock:
+            self.processes.add(p)
+            if not self.cancelled:
+                return
+        kill(p)
+
+    def discard(self, p):
+        with self.lock:
+            self.processes.discard(p)
+
+
+class Process(subprocess.Popen):
+    """ Popen that reaps the program with os.wait4, to know the resources it used."""
+    rusage = None
+    lost = False  # The exit status was lost (see wait)
+
+    def wait(self):
+        while self.returncode is None:
+            try:
+                pid, status, self.rusage = os.wait4(self.pid, 0)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                # Already reaped elsewhere: its status is lost, and its output may be incomplete
+                self.lost = True
+                self.returncode = -1
+                break
+            if pid == self.pid:
+                self._handle_exitstatus(status)
+        return self.returncode
+
+
+def run(args, cwd=None, env=None, timeout=None, cancel=None):
+    """
+    Runs a program and waits for it, capturing its output.
+    :param args: list with the program and its arguments.
+    :param cwd: working directory of the program.
+    :param env: environment variables added to the current environment.
+    :param timeout: seconds after which the program is killed.
+    :param cancel: Cancel object that may stop the program.
+    :return: exit status, standard output and standard error. The status is negative if the program was
+             killed (e.g. after the timeout) or if its status was lost, and None if it could not be started.
+    """
+    logger = logging.getLogger('process')
+    if cancel is not None and cancel.cancelled:
+        return None, '', 'Cancelled.'
+    environ = None
+    if env:
+        environ = dict(os.environ)
+        environ.update(env)
+    logger.debug("Running: %s" % " ".join(args))
+    try:
+        with open(os.devnull, 'r') as null:
+            p = Process(args, cwd=cwd, env=environ, stdin=null, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        close_fds=True)
+    except OSError as e:
+        logger.error("%s could not be started: %s" % (args[0], e))
+        return None, '', str(e)
+
+    if cancel is not None:
+        cancel.add(p)
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill, (p,))
+        timer.start()
+    try:
+        out, err = p.communicate()
+    finally:
+        if timer:
+            timer.cancel()
+        if cancel is not None:
+            cancel.discard(p)
+    child(args[0], p.rusage)
+    if p.lost:
+        logger.error("The exit status of %s was lost: it is taken as failed." % args[0])
+    elif p.returncode < 0 and cancel is not None and cancel.cancelled:
+        logger.debug("%s was cancelled." % args[0])
+    elif p.returncode < 0:
+        logger.error("%s was killed (signal %d)%s." % (args[0], -p.returncode,
+                                                       " after %d s" % timeout if timeout else ""))
+    elif p.returncode:
+        logger.debug("%s finished with exit status %d." % (args[0], p.returncode))
+    return p.returncode, out, err
+
+
+def kill(p):
+    try:
+        p.kill()
+    except OSError:  # It has already finished
+        pass
+
+
+def tail(text, lines=5):
+    """ Last lines of the output of a program, for error messages."""
+    return "\n".join(text.strip().splitlines()[-lines:])
@@ -18,34 +18,19 @@
 """
 
 import sys
-import logging
+import atexit
+import socket
 import argparse
 from sconf import parser_init, log_conf
-from gui import Data, Kajut, MainGui
+from core import Data, Kajut
+from render import render_batch
 import os
-try:
-    import gi
-except ImportError:
-    logging.exception("Requires pygobject to be installed.")
-    gi = None
-    exit(1)
-
-try:
-    gi.require_version("Gtk", "3.0")
-except ValueError:
-    logging.exception("Requires gtk3 development files to be installed.")
-except AttributeError:
-    logging.exception("pygobject version too old.")
-gi.require_version('Gtk', '3.0')
-try:
-    from gi.repository import Gtk, GObject
-except (ImportError, RuntimeError):
-    logging.exception("Requires pygobject to be installed.")
 
 
 __author__ = 'Jose M. Esnaola Acebes'
 
-""" Graphical script to replace texts on EPS files using LaTeX engine and psfrag.
+""" Command line of pykajut: generates the PNG images of quiz style questions from LaTeX question banks, with
+    the graphical interface or without it (batch, watch, archive and service modes).
 """
 
 print "\n\tPyKajut  Copyright (C) 2017  Jose M. Esnaola-Acebes\n" \
@@ -55,11 +40,6 @@ print "\n\tPyKajut  Copyright (C) 2017  Jose M. Esnaola-Acebes\n" \
 
 # -- Configuration I: parsing, debugging.
 conf_file, debug, args1, hlp = parser_init()
-if not hlp:
-    logger = log_conf(debug)
-    logger.debug('Formatting parser')
-else:
-    logger = None
 
 # -- Simulation configuration II: data entry (second parser).
 description = 'Utility to generate questions in PNG format to be displayed in kahoot.'
@@ -67,46 +47,185 @@ parser = argparse.ArgumentParser(
     description=description,
     usage='python %s  [-i input.tex] [-O <options>]' % sys.argv[0])
 
-parser.add_argument('-i', '--input', default=None, dest='i', type=str,
-                    help='Input .tex file containing the questions.')
+parser.add_argument('-i', '--input', default=None, dest='i', type=str, action='append',
+                    help='Input .tex file containing the questions, a directory or a glob pattern (quoted). '
+                         'It can be given several times: the questions are merged in a single bank.')
 parser.add_argument('-db', '--debug', default="INFO", dest='db', metavar='<debug>',
                     choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                     help='Debbuging level. Default is INFO.')
 parser.add_argument('-ng', '--nogui', default=False, dest='nogui', action='store_true',
                     help='Run the programm without graphical interface (X11).')
 parser.add_argument('-d', '--density', default=300, dest='d', type=int, help='Density of the png image.')
+parser.add_argument('--width-px', default=None, dest='width_px', type=int, metavar='<pixels>',
+                    help='Width of the png images. The density is computed for every page, instead of --density.')
+parser.add_argument('--height-px', default=None, dest='height_px', type=int, metavar='<pixels>',
+                    help='Height of the png images. With --width-px, the pages fit in both.')
+parser.add_argument('--letterbox', default=False, dest='letterbox', action='store_true',
+                    help='Pad the png images to exactly --width-px x --height-px pixels (white, centered).')
+parser.add_argument('--format', default='png', dest='format', type=str, metavar='<format>',
+                    choices=['png', 'svg'],
+                    help='Format of the images: png, or svg (compiled to DVI and converted with dvisvgm into '
+                         '<texdir>/svg, without PDF files; implies --nogui). Default is png.')
+parser.add_argument('--svg-fonts', default='paths', dest='svgfonts', type=str, metavar='<fonts>',
+                    choices=['paths', 'woff', 'woff2'],
+                    help='Fonts of the SVG images: converted into paths, or embedded as woff or woff2. '
+                         'Default is paths.')
+parser.add_argument('-t', '--target', default=None, dest='targets', type=str, action='append',
+                    metavar='<name>:<format>[:<options>]',
+                    help='Extra output of every question, converted from the same PDF file into <texdir>/<name>: '
+                         'png, webp or svg, with the options density, width, height, letterbox and quality (e.g. '
+                         'web:webp:width=480,quality=75). It can be given several times. See targets.py.')
 parser.add_argument('-c', '--crop', default=False, dest='crop', action='store_true',
                     help='Crop the image, erasing any white margins.')
 parser.add_argument('-D', '--design', default="tabular", dest='design', type=str, metavar='<design>',
                     choices=["tabular", "enumerate", "tabbed"],
                     help='LaTeX design of the enumerate environment.')
+parser.add_argument('-b', '--backend', default='latex', dest='backend', type=str, metavar='<backend>',
+                    choices=['latex', 'fast'],
+                    help='Render backend: fast draws the questions made of text and math with matplotlib, without '
+                         'LaTeX (the rest are rendered with LaTeX). Default is latex.')
+parser.add_argument('-j', '--jobs', default=1, dest='jobs', type=int, metavar='<jobs>',
+                    help='Number of questions rendered in parallel (--nogui). 0 uses all the cores. Default is 1.')
+parser.add_argument('--chunk', default=1, dest='chunk', type=int, metavar='<questions>',
+                    help='Number of questions compiled in a single LaTeX document (--nogui). Default is 1.')
+parser.add_argument('-r', '--rasterizer', default='auto', dest='rasterizer', type=str, metavar='<rasterizer>',
+                    choices=['auto', 'fitz', 'pdftoppm', 'pdftocairo', 'gs', 'convert'],
+                    help='Backend used to convert the PDF files into PNG images. Default is the first available.')
+parser.add_argument('--raster-threads', default=0, dest='rthreads', type=int, metavar='<threads>',
+                    help='Number of rendering threads of the rasterizer (gs, convert).')
+parser.add_argument('--raster-memory', default=256, dest='rmemory', type=int, metavar='<MB>',
+                    help='Memory cap of the rasterizer in MB (gs, convert). Default is 256.')
+parser.add_argument('--timeout', default=300, dest='timeout', type=int, metavar='<seconds>',
+                    help='Time after which pdflatex, pdfcrop or the rasterizer are killed. Default is 300 s.')
+parser.add_argument('--cache-dir', default='~/.cache/pykajut/renders', dest='cachedir', type=str, metavar='<dir>',
+                    help='Directory of the render cache. Default is ~/.cache/pykajut/renders.')
+parser.add_argument('--cache-size', default=1024, dest='cachesize', type=int, metavar='<MB>',
+                    help='Maximum size of the render cache in MB. Default is 1024.')
+parser.add_argument('--no-cache', default=False, dest='nocache', action='store_true',
+                    help='Do not use the render cache: every question is compiled again.')
+parser.add_argument('--format-dir', default='~/.cache/pykajut/formats', dest='fmtdir', type=str, metavar='<dir>',
+                    help='Directory of the precompiled LaTeX formats. Default is ~/.cache/pykajut/formats.')
+parser.add_argument('--no-format', default=False, dest='noformat', action='store_true',
+                    help='Do not precompile the LaTeX preamble: it is loaded again for every question.')
+parser.add_argument('--index-dir', default='~/.cache/pykajut/index', dest='indexdir', type=str, metavar='<dir>',
+                    help='Directory of the question indexes. Default is ~/.cache/pykajut/index.')
+parser.add_argument('--no-index', default=False, dest='noindex', action='store_true',
+                    help='Do not use the question index: the whole file is parsed every time it is opened.')
+parser.add_argument('--workers', default=0, dest='workers', type=int, metavar='<workers>',
+                    help='Number of questions rendered at the same time by the GUI and the render service. '
+                         'Default is all the cores.')
+parser.add_argument('--preview-cache', default=64, dest='previewcache', type=int, metavar='<MB>',
+                    help='Memory for the previews of the questions in the GUI, in MB. Default is 64.')
+parser.add_argument('--prefetch', default=3, dest='prefetch', type=int, metavar='<rows>',
+                    help='Previews loaded in advance above and below the selected question (GUI). Default is 3.')
+parser.add_argument('-a', '--archive', default=None, dest='archive', type=str, metavar='<file>',
+                    help='Write the questions and a manifest into a .zip, .tar, .tar.gz or .tar.bz2 file instead of '
+                         'the output directories (implies --nogui).')
+parser.add_argument('--trace', default=None, dest='trace', type=str, metavar='<file.jsonl>',
+                    help='Write the time, CPU and memory of every stage of every question into a JSONL file, and '
+                         'show the slowest questions at the end.')
+parser.add_argument('--profile', default=None, dest='profile', type=str, metavar='<file>',
+                    help='Profile the Python side of the program (cProfile) and dump the statistics into the file. '
+                         'Use -j 1 to include the render jobs.')
+parser.add_argument('--serve', default=False, dest='serve', action='store_true',
+                    help='Run as a render service (HTTP on localhost or a Unix socket). See service.py.')
+parser.add_argument('--port', default=8642, dest='port', type=int, metavar='<port>',
+                    help='Port of the render service, on localhost. Default is 8642.')
+parser.add_argument('--socket', default=None, dest='socket', type=str, metavar='<path>',
+                    help='Unix socket of the render service, instead of the port.')
+parser.add_argument('--backlog', default=16, dest='backlog', type=int, metavar='<requests>',
+                    help='Requests that may wait for a worker of the service before new ones are rejected (503).')
+parser.add_argument('-w', '--watch', default=False, dest='watch', action='store_true',
+                    help='Keep watching the input file and render the questions that change (implies --nogui).')
+parser.add_argument('--debounce', default=0.5, dest='debounce', type=float, metavar='<seconds>',
+                    help='Time without changes before the watched file is read again. Default is 0.5 s.')
+parser.add_argument('--poll-interval', default=1.0, dest='poll', type=float, metavar='<seconds>',
+                    help='Time between checks of the watched file, when inotify is not available. Default is 1 s.')
 
 args = parser.parse_args()
+if args.letterbox and not (args.width_px and args.height_px):
+    parser.error("--letterbox needs both --width-px and --height-px.")
+if args.targets:
+    from targets import parse_target
+    try:
+        args.targets = [parse_target(spec) for spec in args.targets]
+    except ValueError as e:
+        parser.error(str(e))
+else:
+    args.targets = []
+if len(set(target.name for target in args.targets)) < len(args.targets):
+    parser.error("The names of the output targets must be different.")
+if args.format == 'svg' and (args.targets or args.serve):
+    parser.error("--format svg writes no PDF file: it can not be used with --target or --serve.")
+# Only the graphical interface keeps a log file (in ./log): the other modes log to the console
+headless = args.nogui or args.watch or args.archive or args.serve or args.format == 'svg'
+logger = log_conf(debug, logdir=None if headless else './log')
 logger.debug('Introduced arguments: %s' % str(args))
 opts = vars(args)
+# The graphical interface lists the questions at once and parses each one when it is selected
+opts['lazy'] = not headless
 
 # Some environmental constants:
 scriptpath = os.path.realpath(__file__)
 scriptdir = os.path.dirname(scriptpath)
 cwd = os.getcwd()
 logger.debug('We are working in %s' % str(cwd))
+if opts['profile']:
+    from timing import start_profile
+    start_profile(opts['profile'])
 data = Data(opts, cwd)
 kajut = Kajut(data)
+if data.trace is not None:
+    atexit.register(data.trace.close)
 
-if opts['nogui']:
+# Each mode only loads the modules it uses
+if opts['serve']:
+    from service import serve
+    try:
+        serve(data, kajut, opts['port'], opts['socket'], opts['workers'], opts['backlog'])
+    except (IOError, socket.error) as e:
+        logger.error("The render service could not be started: %s" % e)
+        exit(1)
+elif opts['nogui'] or opts['watch'] or opts['archive'] or opts['format'] == 'svg':
     logger.info("Non-graphical UI selected.")
     if data.inputfile is None:
         logger.error("Select a .tex file using -i option.")
         exit(-1)
+    if opts['watch'] and opts['archive']:
+        logger.error("The --archive and --watch options can not be used together.")
+        exit(-1)
     if data.qblocks:
         logger.info("Creating PNG images of the questions...")
-        for name in data.qblocks.keys():
-            kajut.create_png(kajut.create_latex(data.qblocks[name]))
-        logger.info("All works done!")
+        archive = None
+        if opts['archive']:
+            from archive import Archive
+            try:
+                archive = Archive(opts['archive'])
+            except IOError as e:
+                logger.error(e)
+                exit(-1)
+        try:
+            done, failed = render_batch(kajut, data.qblocks, jobs=opts['jobs'], chunk=opts['chunk'], archive=archive)
+        except BaseException:
+            if archive:
+                archive.abort()
+            raise
+        if archive:
+            archive.close()
+        if opts['watch']:
+            from watch import Watcher
+            Watcher(data, kajut, jobs=opts['jobs'], debounce=opts['debounce'], interval=opts['poll']).watch()
+        elif failed:
+            exit(1)
+        else:
+            logger.info("All works done!")
     else:
         logger.error("The questions were not found. Check the format. Exiting.")
         exit(1)
 else:
+    # GTK and the graphical interface are only loaded when they are used
+    from gui import MainGui
+    from gi.repository import Gtk, GObject
     GObject.threads_init()
     mg = MainGui(data, kajut)
     mg.window.show_all()
@@ -0,0 +1,263 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import marshal
+import logging
+from contextlib import contextmanager
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Compact model of the questions of a bank.
+
+    Every question is a Question object, with its fields in slots instead of a dictionary, and the paths of its
+    file in an Origin object shared by all the questions of the file. Questions behave as the dictionaries
+    returned by QuestionParser.parse (qblock['name'], qblock.get('pngdir', pngdir), qblock.update(fields), ...),
+    with the paths of the file ('source', 'texdir', 'pngdir' and 'pdfdir', see core.bank_paths) as extra keys.
+
+    Snapshots store the parsed questions of a file column by column (one list per field), in marshal format:
+    they are smaller than a list of dictionaries and much faster to load. The garbage collector is paused while
+    the questions are created (see paused_gc), since collecting so many new objects takes longer than creating
+    them.
+"""
+
+logging.getLogger('qstore').addHandler(logging.NullHandler())
+
+VERSION = 1
+FIELDS = ('id', 'name', 'title', 'question', 'choices', 'correct', 'time', 'line', 'span', 'lazy')
+PATHS = ('source', 'texdir', 'pngdir', 'pdfdir')
+# Fields stored in the snapshots (the identifier depends on the rest of the bank)
+COLUMNS = ('name', 'title', 'question', 'choices', 'correct', 'time', 'line', 'span')
+# Fields with few different values, shared by all the questions
+INTERNED = ('time',)
+
+_fields = frozenset(FIELDS)
+_paths = frozenset(PATHS)
+
+
+class Origin(object):
+    """ File of a group of questions and the directories of its LaTeX, PNG and PDF files."""
+    __slots__ = PATHS
+
+    def __init__(self, source=None, texdir=None, pngdir=None, pdfdir=None):
+        self.source = source
+        self.texdir = texdir
+        self.pngdir = pngdir
+        self.pdfdir = pdfdir
+
+    def __reduce__(self):
+        return Origin, (self.source, self.texdir, self.pngdir, self.pdfdir)
+
+
+class Question(object):
+    """ Question block. Fields that were not set (e.g. the choices of a question that was only scanned, see
+        QuestionParser.scan) are missing keys, and so are the directories of a question without file.
+    """
+    __slots__ = FIELDS + ('origin',)
+
+    def __init__(self, fields=(), origin=None):
+        """
+        :param fields: dictionary (or pairs) with the fields of the question, and maybe the paths of its file.
+        :param origin: Origin object with the paths of its file.
+        """
+        self.origin = origin
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key in _fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if key in _paths:
+            value = getattr(self.origin, key) if self.origin is not None else None
+            if value is None and key != 'source':
+                raise KeyError(key)
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _paths:
+            self.update({key: value})
+        elif key in _fields:
+            if key in INTERNED and type(value) is str:
+                value = intern(value)
+            setattr(self, key, value)
+        else:
+            raise KeyError("%s is not a field of the questions." % key)
+
+    def __delitem__(self, key):
+        if key in _paths:
+            if key not in self:
+                raise KeyError(key)
+            self.update({key: None})
+        elif key in _fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return Question, (self.fields(), self.origin)
+
+    def keys(self):
+        keys = [field for field in FIELDS if hasattr(self, field)]
+        return keys + [key for key in PATHS if key in self]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, fields=(), **extra):
+        """ Sets several fields at once. The paths of the file are copied to a new Origin object, so that the
+            other questions of the file keep theirs.
+        """
+        if extra:
+            fields = dict(fields, **extra)
+        if isinstance(fields, dict):
+            fields = fields.iteritems()
+        elif hasattr(fields, 'keys'):
+            fields = [(key, fields[key]) for key in fields.keys()]
+        paths = {}
+        for key, value in fields:
+            if key in _fields:
+                if key in INTERNED and type(value) is str:
+                    value = intern(value)
+                setattr(self, key, value)
+            elif key in _paths:
+                paths[key] = value
+            else:
+                raise KeyError("%s is not a field of the questions." % key)
+        if paths:
+            origin = self.origin
+            self.origin = Origin(*[paths.get(key, getattr(origin, key) if origin is not None else None)
+                                   for key in PATHS])
+
+    def fields(self):
+        """ Dictionary with the fields of the question that are set, without the paths of its file."""
+        return dict((field, getattr(self, field)) for field in FIELDS if hasattr(self, field))
+
+    def copy(self):
+        return Question(self.fields(), self.origin)
+
+
+@contextmanager
+def paused_gc():
+    """ Pauses the garbage collector while many objects that are kept are created."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def questions(qblocks, origin=None):
+    """
+    Questions of a list of question blocks, all of them from the same file.
+    :param qblocks: Question objects (updated in place) or dictionaries (converted).
+    :param origin: Origin object of the file.
+    :return: list of Question objects.
+    """
+    result = []
+    with paused_gc():
+        for qblock in qblocks:
+            if isinstance(qblock, Question):
+                qblock.origin = origin
+            else:
+                qblock = Question(qblock, origin)
+            result.append(qblock)
+    return result
+
+
+def dumps(qblocks):
+    """
+    Snapshot of a list of parsed question blocks (Question objects or dictionaries), without their paths.
+    :return: string in marshal format.
+    """
+    columns = [[qblock[field] for qblock in qblocks] for field in COLUMNS]
+    return marshal.dumps((VERSION, COLUMNS, columns))
+
+
+def loads(data, origin=None):
+    """
+    Questions of a snapshot (see dumps).
+    :param data: snapshot.
+    :param origin: Origin object of their file.
+    :return: list of Question objects.
+    """
+    with paused_gc():
+        version, columns, values = marshal.loads(data)
+        if version != VERSION or tuple(columns) != COLUMNS:
+            raise ValueError("Unknown snapshot format (version %s)." % version)
+        result = []
+        for name, title, question, choices, correct, time, line, span in zip(*values):
+            qblock = Question.__new__(Question)
+            qblock.origin = origin
+            qblock.name = name
+            qblock.title = title
+            qblock.question = question
+            qblock.choices = choices
+            qblock.correct = correct
+            qblock.time = intern(time) if type(time) is str else time
+            qblock.line = line
+            qblock.span = span
+            result.append(qblock)
+    return result
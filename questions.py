@@ -0,0 +1,194 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import logging
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Parser of question banks. The questions files should have an specific format:
+
+    % File_name: T1_c1.1_q1
+    % Title: Pregunta 1
+    % Time: 20            (optional)
+    Enunciado de la pregunta.
+    \\begin{enumerate}
+    \\Myitem Respuesta 1. %enditem
+    \\Myitem Respuesta 2. %enditem
+    \\Myitem Respuesta 3. %enditem
+    \\Myitem Respuesta 4. % Correct %enditem
+    \\end{enumerate}
+
+    In case is a completely formatted .tex file, the questions are looked for between the preamble and
+    the end, marked as:
+    % BEGIN PREAMBLE
+    % END PREAMBLE
+    % BEGIN END
+    % END END
+"""
+
+logging.getLogger('questions').addHandler(logging.NullHandler())
+
+
+class QuestionParser(object):
+    def __init__(self, enumerate_envs=("enumerate", "tabbedenum")):
+        """
+        :param enumerate_envs: LaTeX environments that contain the choices of the questions.
+        """
+        self.logger = logging.getLogger('questions.QuestionParser')
+        envs = "|".join(map(re.escape, enumerate_envs))
+        # Every marker of a question block, found in a single pass over the file
+        self.tokens = re.compile(r'^% File_name: (?P<name>[^\n]*)\n'
+                                 r'|^% Title: (?P<title>[^\n]*)\n'
+                                 r'|^% Time: (?P<time>[^\n]*)\n'
+                                 r'|(?P<begin>\\begin\{(?:' + envs + r')\}(?:\{[0-9]+\})?\n)'
+                                 r'|(?P<end>\\end\{(?:' + envs + r')\}\n)', re.M)
+        # Choices, searched only inside the enumerate environment of each block
+        self.choice = re.compile(r'\\Myitem*(.*?%*enditem)[^\n]*\n', re.S)
+        # Names of the questions, for reading a file without parsing its questions (see scan)
+        self.names = re.compile(r'^% File_name: ([^\n]*)\n', re.M)
+        # What may follow a question block: blank lines and the next question or the end of the questions
+        self.follows = re.compile(r'\s*(?:^% File_name: |^% BEGIN END\n|\Z)', re.M)
+
+    @staticmethod
+    def region(text):
+        """ Part of the file that contains the questions: (start, end) offsets. In a formatted .tex file, the end
+            is the '% BEGIN END' line, where new questions are added (see format).
+        """
+        begin = text.find('% BEGIN PREAMBLE')
+        pre = text.find('% END PREAMBLE\n', begin) if begin >= 0 else -1
+        post = text.find('% BEGIN END\n', pre) if pre >= 0 else -1
+        if post >= 0 and text.find('% END END\n', post) >= 0:
+            return pre, post
+        return 0, len(text)
+
+    def parse(self, text, start=0, end=None, line=1):
+        """
+        Parses the question blocks of text[start:end] in a single pass.
+        :param text: contents of the file.
+        :param start: offset where the parsing starts.
+        :param end: offset where the parsing ends. Default is the end of the text.
+        :param line: line number of the start offset.
+        :return: list of question blocks, in the order of the file. Besides the fields of the question,
+                 each block has its first line ('line') and its (start, end) offsets in the text ('span').
+        """
+        if end is None:
+            end = len(text)
+        qblocks = []
+        block = None
+        position = start
+        for m in self.tokens.finditer(text, start, end):
+            kind = m.lastgroup
+            if kind == 'name':
+                if block is not None:
+                    self.logger.error('Bad format for question %s: the choices were not found ...' % block['name'])
+                line += text.count('\n', position, m.start())
+                position = m.start()
+                block = {'name': m.group('name'), 'title': None, 'time': 'None', 'line': line,
+                         'start': m.start(), 'header': m.end(), 'choices': None}
+            elif block is None or block['choices'] is not None and kind != 'end':
+                continue  # Outside a question, or inside its choices
+            elif kind == 'title' or kind == 'time':
+                if block[kind] in (None, 'None'):
+                    block[kind] = m.group(kind)
+                block['header'] = m.end()
+            elif kind == 'begin':
+                if block['choices'] is None:
+                    block['question'] = text[block['header']:m.start()]
+                    block['choices'] = m.end()
+            elif kind == 'end' and block['choices'] is not None:
+                qblock = self.close(text, block, m.start(), m.end())
+                if qblock:
+                    qblocks.append(qblock)
+                block = None
+        if block is not None:
+            self.logger.error('Bad format for question %s: the choices were not found ...' % block['name'])
+        return qblocks
+
+    def scan(self, text, start=0, end=None, line=1):
+        """
+        Names of the question blocks of text[start:end], without parsing them: much faster than parse, for
+        showing the list of questions of a large file. The rest of the fields are parsed by details.
+        :return: list of question blocks with their name, first line and span (up to the next question), marked
+                 as 'lazy'.
+        """
+        if end is None:
+            end = len(text)
+        names = [(m.start(), m.group(1)) for m in self.names.finditer(text, start, end)]
+        ends = [position for position, name in names[1:]] + [end]
+        qblocks = []
+        for (position, name), limit in zip(names, ends):
+            line += text.count('\n', start, position)
+            start = position
+            qblocks.append({'name': name, 'line': line, 'span': (position, limit), 'lazy': True})
+        return qblocks
+
+    def details(self, text, qblock):
+        """
+        Parses a question block returned by scan.
+        :param text: contents of the file, as it was scanned.
+        :return: the fields of the question (see parse), or None if the question is badly formatted or it is not
+                 in its span any more.
+        """
+        start, end = qblock['span']
+        # The span must still go from its name to the next question (or to the end of the questions)
+        m = self.names.match(text, start)
+        if m is None or m.group(1) != qblock['name'] or not self.follows.match(text, end):
+            return None
+        qblocks = self.parse(text, start, end, qblock['line'])
+        return qblocks[0] if len(qblocks) == 1 else None
+
+    def format(self, qblock, original=None):
+        """
+        Text of a question block, in the format of the questions files: parsing it gives the same question back.
+        :param qblock: question block (see parse).
+        :param original: former text of the block, whose environment of the choices is kept.
+        :return: text of the block, up to the end of its environment (newline included).
+        """
+        begin, end = '\\begin{enumerate}\n', '\\end{enumerate}\n'
+        if original:
+            for m in self.tokens.finditer(original):
+                if m.lastgroup == 'begin':
+                    begin = m.group('begin')
+                elif m.lastgroup == 'end':
+                    end = m.group('end')
+                    break
+        lines = ['%% File_name: %s\n' % qblock['name'], '%% Title: %s\n' % (qblock.get('title') or '')]
+        if qblock.get('time') not in (None, 'None', ''):
+            lines.append('%% Time: %s\n' % qblock['time'])
+        question = qblock.get('question') or ''
+        lines += [question if question.endswith('\n') or not question else question + '\n', begin]
+        for choice in qblock.get('choices') or []:
+            if 'enditem' not in choice:
+                choice = choice.rstrip('\n') + ' %enditem'
+            lines.append('\\Myitem%s%s\n' % ('' if choice[:1].isspace() else ' ', choice))
+        lines.append(end)
+        return ''.join(lines)
+
+    def close(self, text, block, choices_end, end):
+        """ Question block, once its limits are known."""
+        if block['title'] is None:
+            self.logger.error('Bad format for question %s: the title was not found ...' % block['name'])
+            return None
+        choices = self.choice.findall(text, block['choices'], choices_end)
+        correct = None
+        for j, choice in enumerate(choices):
+            if 'Correct' in choice:
+                correct = j
+        return {'name': block['name'], 'title': block['title'], 'question': block['question'], 'choices': choices,
+                'correct': correct, 'time': block['time'], 'line': block['line'], 'span': (block['start'], end)}
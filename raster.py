@@ -0,0 +1,286 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import glob
+import zlib
+import struct
+import logging
+import threading
+from process import run, tail
+from distutils.spawn import find_executable
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Rasterizers: convert all the pages of a PDF file into PNG images with a single call.
+
+    Every backend produces the files prefix-0.png, prefix-1.png, ... (one per page, in order). Most of them can
+    also write raw PPM images (prefix-0.ppm, ...), which are letterboxed into PNG images by letterbox().
+"""
+
+logging.getLogger('raster').addHandler(logging.NullHandler())
+
+# PyMuPDF is not thread safe: the render queue and the service rasterize from several threads
+fitz_lock = threading.Lock()
+
+
+class Rasterizer(object):
+    name = None
+    executable = None
+    formats = ('png', 'ppm')  # Output formats of the backend
+
+    def __init__(self, threads=0, memory=256, timeout=None):
+        """
+        :param threads: number of rendering threads (0 lets the backend decide).
+        :param memory: approximate memory cap in MB, for the backends that support it.
+        :param timeout: seconds after which the backend is killed.
+        """
+        self.logger = logging.getLogger('raster.%s' % self.__class__.__name__)
+        self.threads = threads
+        self.memory = memory
+        self.timeout = timeout
+        self.cancel = None  # process.Cancel object that may stop the backend
+
+    @classmethod
+    def available(cls):
+        return find_executable(cls.executable) is not None
+
+    def rasterize(self, pdf, prefix, density, first=None, last=None, fmt='png'):
+        """
+        Rasterizes all the pages of a PDF file.
+        :param pdf: path of the PDF file.
+        :param prefix: path of the PNG files, without the page number and the extension.
+        :param density: resolution in dots per inch (it may be fractional).
+        :param first: first page to rasterize (from 1). Default is all the pages.
+        :param last: last page to rasterize.
+        :param fmt: 'png' or, for the backends that support it, 'ppm' (raw pixels).
+        :return: list of the files created, in page order.
+        """
+        self.remove_pages(prefix, fmt)
+        command = self.command(pdf, prefix, '%.3f' % density if density % 1 else '%d' % density, first, last, fmt)
+        status, out, err = run(command, timeout=self.timeout, cancel=self.cancel)
+        if status != 0:
+            self.logger.error("%s failed (exit status %s) rasterizing %s:\n%s" % (self.name, status, pdf, tail(err)))
+        return self.collect(prefix, fmt)
+
+    def command(self, pdf, prefix, density, first, last, fmt):
+        raise NotImplementedError
+
+    @staticmethod
+    def collect(prefix, fmt='png'):
+        """ Renames the files written by the backend to prefix-0.png, prefix-1.png, ..."""
+        ext = len(fmt) + 1
+        pages = [png for png in glob.glob(prefix + '-*.' + fmt) if png[len(prefix) + 1:-ext].isdigit()]
+        pages.sort(key=lambda png: int(png[len(prefix) + 1:-ext]))
+        pngs = []
+        for k, png in enumerate(pages):
+            target = '%s-%d.%s' % (prefix, k, fmt)
+            if png != target:
+                os.rename(png, target)
+            pngs.append(target)
+        return pngs
+
+    @staticmethod
+    def remove_pages(prefix, fmt='png'):
+        for png in glob.glob(prefix + '-*.' + fmt):
+            if png[len(prefix) + 1:-len(fmt) - 1].isdigit():
+                os.remove(png)
+
+
+class Pdftoppm(Rasterizer):
+    """ Poppler. Pages are numbered from 1 (with leading zeros)."""
+    name = 'pdftoppm'
+    executable = 'pdftoppm'
+
+    def command(self, pdf, prefix, density, first, last, fmt):
+        command = [self.executable, '-r', density]
+        if first:
+            command += ['-f', str(first), '-l', str(last)]
+        # PPM is the default format of pdftoppm
+        return command + (['-png'] if fmt == 'png' else []) + [pdf, prefix]
+
+
+class Pdftocairo(Pdftoppm):
+    name = 'pdftocairo'
+    executable = 'pdftocairo'
+    formats = ('png',)
+
+
+class Ghostscript(Rasterizer):
+    """ Ghostscript, with several rendering threads and bounded band buffers. Pages are numbered from 1."""
+    name = 'gs'
+    executable = 'gs'
+
+    def command(self, pdf, prefix, density, first, last, fmt):
+        memory = self.memory * 1024 * 1024
+        command = [self.executable, '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE',
+                   '-sDEVICE=%s' % ('png16m' if fmt == 'png' else 'ppmraw'), '-r%s' % density,
+                   '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4', '-dNumRenderingThreads=%d' % max(self.threads, 1),
+                   '-dMaxBitmap=%d' % memory, '-dBufferSpace=%d' % min(memory, 64 * 1024 * 1024)]
+        if first:
+            command += ['-dFirstPage=%d' % first, '-dLastPage=%d' % last]
+        return command + ['-sOutputFile=%s-%%d.%s' % (prefix, fmt), pdf]
+
+
+class Convert(Rasterizer):
+    """ ImageMagick (through Ghostscript). Pages are numbered from 0."""
+    name = 'convert'
+    executable = 'convert'
+
+    def command(self, pdf, prefix, density, first, last, fmt):
+        command = [self.executable, '-limit', 'memory', '%dMiB' % self.memory, '-limit', 'map',
+                   '%dMiB' % (2 * self.memory)]
+        if self.threads:
+            command += ['-limit', 'thread', str(self.threads)]
+        if first:
+            pdf += '[%d-%d]' % (first - 1, last - 1)
+        return command + ['-density', density, pdf, '-background', 'white', '-alpha', 'remove',
+                          '%s-%%d.%s' % (prefix, fmt)]
+
+
+class Fitz(Rasterizer):
+    """ PyMuPDF, in this same process (no external program is started)."""
+    name = 'fitz'
+
+    @classmethod
+    def available(cls):
+        return fitz is not None
+
+    def rasterize(self, pdf, prefix, density, first=None, last=None, fmt='png'):
+        self.remove_pages(prefix, fmt)
+        zoom = density / 72.0
+        pngs = []
+        try:
+            with fitz_lock:
+                doc = fitz.open(pdf)
+                pages = xrange((first or 1) - 1, last or len(doc))
+                for k, number in enumerate(pages):
+                    page = doc[number]
+                    # The names of these methods changed in PyMuPDF 1.18
+                    pixmap = getattr(page, 'get_pixmap', None) or page.getPixmap
+                    pix = pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                    png = '%s-%d.%s' % (prefix, k, fmt)
+                    (getattr(pix, 'save', None) or pix.writeImage)(png)
+                    pngs.append(png)
+                doc.close()
+        except RuntimeError:
+            self.logger.exception("%s failed rasterizing %s." % (self.name, pdf))
+        return pngs
+
+
+# Backends in order of preference for 'auto'
+rasterizers = [Fitz, Pdftoppm, Pdftocairo, Ghostscript, Convert]
+
+
+def get_rasterizer(name='auto', threads=0, memory=256, timeout=None):
+    """
+    Rasterizer backend by name ('auto' selects the first available one).
+    :return: Rasterizer object, or None if the backend is not available.
+    """
+    logger = logging.getLogger('raster')
+    for backend in rasterizers:
+        if name in ('auto', backend.name) and backend.available():
+            logger.debug("Rasterizer: %s" % backend.name)
+            return backend(threads, memory, timeout)
+    logger.error("Rasterizer %s is not available." % name)
+    return None
+
+
+def page_sizes(pdf, timeout=None):
+    """
+    Size of every page of a PDF file (after cropping, if it was cropped), in points.
+    :return: list of (width, height) tuples, or None if neither PyMuPDF nor pdfinfo are available.
+    """
+    if fitz is not None:
+        try:
+            with fitz_lock:
+                doc = fitz.open(pdf)
+                sizes = [(page.rect.width, page.rect.height) for page in doc]
+                doc.close()
+            return sizes
+        except RuntimeError:
+            pass
+    if find_executable('pdfinfo') is None:
+        return None
+    status, out, err = run(['pdfinfo', '-f', '1', '-l', '100000', pdf], timeout=timeout)
+    sizes = [(float(w), float(h)) for w, h in re.findall(r'^Page +[0-9]+ size: +([0-9.]+) x ([0-9.]+) pts', out, re.M)]
+    return sizes if status == 0 and sizes else None
+
+
+def length_pt(length):
+    """ Points of a LaTeX length in cm, mm, in or pt (e.g. '21cm')."""
+    m = re.match(r'^\s*([0-9.]+)\s*(cm|mm|in|pt|bp)\s*$', length)
+    if m is None:
+        raise ValueError("Unknown length: %s" % length)
+    scale = {'cm': 72 / 2.54, 'mm': 72 / 25.4, 'in': 72.0, 'pt': 72 / 72.27, 'bp': 1.0}[m.group(2)]
+    return float(m.group(1)) * scale
+
+
+def fit_density(size, width=None, height=None):
+    """
+    Density (dots per inch) that makes a page of the given size (points) as large as possible within width x
+    height pixels. The density is slightly below the exact value, so that rounding never exceeds the target.
+    """
+    densities = []
+    if width:
+        densities.append((width - 0.01) * 72.0 / size[0])
+    if height:
+        densities.append((height - 0.01) * 72.0 / size[1])
+    return min(densities)
+
+
+def letterbox(ppm, png, width, height):
+    """
+    Centers a PPM image in a white canvas of width x height pixels and writes it as a PNG image (larger images
+    are cropped around their center). The rows are written unfiltered, so that no pixel has to be decoded.
+    """
+    with open(ppm, 'rb') as f:
+        data = f.read()
+    m = re.match(r'P6\s+(?:#[^\n]*\n\s*)*([0-9]+)\s+([0-9]+)\s+([0-9]+)\s', data)
+    if m is None or m.group(3) != '255':
+        raise IOError("%s is not an 8 bit PPM image." % ppm)
+    w, h = int(m.group(1)), int(m.group(2))
+    offset = m.end()
+    left, top = (width - w) // 2, (height - h) // 2
+    # Columns and rows of the image that fall inside the canvas
+    x0, x1 = max(0, -left), min(w, width - left)
+    y0, y1 = max(0, -top), min(h, height - top)
+    pad_left = '\xff' * (3 * max(left, 0))
+    pad_right = '\xff' * (3 * (width - max(left, 0) - (x1 - x0)))
+    blank = '\x00' + '\xff' * (3 * width)
+    rows = [blank] * max(top, 0)
+    for y in xrange(y0, y1):
+        start = offset + 3 * (y * w + x0)
+        rows.append('\x00' + pad_left + data[start:start + 3 * (x1 - x0)] + pad_right)
+    rows += [blank] * (height - len(rows))
+    write_png(png, width, height, zlib.compress(''.join(rows), 6))
+
+
+def write_png(path, width, height, idat):
+    """ Writes an 8 bit RGB PNG image from its compressed scanlines."""
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff)
+    with open(path, 'wb') as f:
+        f.write('\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+                + chunk('IDAT', idat) + chunk('IEND', ''))
@@ -0,0 +1,905 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import time
+import glob
+import Queue
+import itertools
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from cache import RenderCache, prune_pages, publish
+from fastrender import FastRenderer, Unsupported, available, check
+from raster import Rasterizer, fit_density, get_rasterizer, length_pt, letterbox, page_sizes
+from process import Cancel, run, tail
+from targets import embed_images, encode_webp, svg_pages
+from timing import stage
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Rendering of questions: render jobs, and batches of them either one after another or in a pool of
+    worker processes, or in a queue with worker threads (GUI).
+"""
+
+logging.getLogger('render').addHandler(logging.NullHandler())
+
+latex_error = re.compile(r'.*:[0-9]*:.*')  # -file-line-error format
+# The precompiled format could not be loaded (missing, or made by another version of LaTeX)
+format_error = re.compile(r"can't find the format file|Fatal format file error|format file .* made by different")
+
+
+class RenderJob(object):
+    """ Renders one or several questions into PNG and PDF files, and the files of the output targets.
+
+        The job keeps a copy of every setting it needs, so that it does not depend on the state of Kajut
+        (which may change in the meantime) and it can be pickled to another process. It compiles in its
+        own temporary directory (in /dev/shm when available) and only the final files are moved, atomically,
+        to the output directories. Hence, many jobs can run at the same time from threads or processes.
+    """
+
+    def __init__(self, kajut, qblocks):
+        """
+        :param kajut: Kajut object with the settings of the render.
+        :param qblocks: list of question blocks, all of them from the same file.
+        """
+        self.logger = logging.getLogger('render.RenderJob')
+        d = kajut.d
+        if len(set(qblock.get('source') for qblock in qblocks)) > 1:
+            raise ValueError("The questions of a render job must be in the same file.")
+        self.qblocks = [dict(qblock) for qblock in qblocks]
+        # Questions are reported by their identifier in the bank, and their files are named after them
+        self.names = [qblock.get('id', qblock['name']) for qblock in qblocks]
+        # LaTeX document
+        self.fmt = kajut.ensure_format()
+        self.fmtdir = os.path.realpath(os.path.expanduser(d.fmtdir)) if self.fmt else None
+        self.preamble = kajut.preamble
+        self.sizes = kajut.sizes
+        self.design = kajut.designs[d.design]
+        self.ending = kajut.ending
+        # Conversion
+        self.density = d.density
+        # Target size of the images in pixels (either may be None), which takes precedence over the density
+        self.size = (d.width_px, d.height_px) if d.width_px or d.height_px else None
+        self.letterbox = bool(d.letterbox and d.width_px and d.height_px)
+        self.page = tuple(length_pt(length) for length in d.pagedimensions[d.page])
+        self.crop = d.crop
+        self.timeout = d.timeout
+        # Output targets (see targets.py), converted from the same PDF file
+        self.targets = list(d.targets)
+        # Format of the images: png, or svg (compiled to DVI by latex and converted by dvisvgm, without PDF file)
+        self.format = d.format
+        self.svgfonts = d.svgfonts
+        self.app_path = d.app_path
+        # Fast backend (fastrender.py), for the questions that do not need LaTeX (the targets need the PDF file)
+        self.fast = None
+        if d.backend == 'fast' and available() and not self.targets and self.format == 'png':
+            self.fast = FastRenderer(d.design, self.page, tuple(length_pt(length) for length in d.margins),
+                                     kajut.sel_sizes, os.path.join(d.app_path, 'art'))
+        self.rasterizer = (kajut.raster.name, kajut.raster.threads, kajut.raster.memory) if kajut.raster else None
+        # Paths: relative \includegraphics are looked up in the directory of the .tex file
+        self.texdir = os.path.realpath(qblocks[0].get('texdir', d.texdir))
+        self.pngdir = qblocks[0].get('pngdir', d.pngdir)
+        self.pdfdir = qblocks[0].get('pdfdir', d.pdfdir)
+        if self.format == 'svg':
+            # pngdir is the directory of the images, whatever their format
+            self.pngdir = os.path.join(self.texdir, 'svg')
+        self.outdirs = dict((target.name, os.path.join(self.texdir, target.name)) for target in self.targets)
+        self.cache = (d.cachedir, d.cachesize) if kajut.cache else None
+        self.keys = [kajut.render_key(qblock) for qblock in qblocks] if kajut.cache else None
+        self.workdir = None
+        self.cancel = None  # process.Cancel object that may stop the job
+        # Timing of the stages (see timing.py), collected by whoever runs the job
+        self.trace = [] if kajut.d.trace is not None else None
+        self.ids = dict((qblock['name'], self.names[k]) for k, qblock in enumerate(qblocks))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('logger')
+        state['cancel'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger('render.RenderJob')
+
+    def run(self):
+        """
+        Renders the questions. Those found in the cache are not compiled. Several questions are compiled
+        in a single LaTeX document and, if it does not compile, one by one, so that only the wrong ones fail.
+        :return: list of (identifier, success) tuples, in the same order as the questions.
+        """
+        results = {}
+        pending = []
+        cache = RenderCache(*self.cache) if self.cache else None
+        self.check_dirs()
+        for k, qblock in enumerate(self.qblocks):
+            restored = False
+            if cache:
+                with self.timed('cache', [qblock]):
+                    restored = cache.get(self.keys[k], self.pngdir, self.pdfdir, self.outdirs, 'tex-' + qblock['name'])
+            if restored:
+                self.logger.debug("Question %s restored from the cache." % qblock['name'])
+                results[qblock['name']] = True
+            else:
+                pending.append(qblock)
+
+        if pending:
+            self.workdir = tempfile.mkdtemp(prefix='kajut-', dir=workspace())
+            try:
+                batch = []
+                if self.fast:
+                    # The questions that the fast backend can not render go on to LaTeX
+                    fast = [(qblock, self.render_fast(qblock)) for qblock in pending]
+                    batch = [result for qblock, result in fast if result is not None]
+                    pending = [qblock for qblock, result in fast if result is None]
+                compiled = None
+                if len(pending) > 1:
+                    compiled = self.render_batch(pending)
+                    if compiled is None and not self.cancelled():
+                        self.logger.warning("The chunk of %d questions could not be rendered. Rendering them one by "
+                                            "one ..." % len(pending))
+                if compiled is None:
+                    compiled = [self.render(qblock) for qblock in pending]
+                batch.extend(compiled)
+            finally:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+                self.workdir = None
+            files = [qblock['name'] for qblock in self.qblocks]
+            for name, success in batch:
+                results[name] = success
+                if success and cache:
+                    with self.timed('cache_store', [self.qblocks[files.index(name)]]):
+                        self.cache_store(cache, self.keys[files.index(name)], name)
+        return [(self.names[k], results[qblock['name']]) for k, qblock in enumerate(self.qblocks)]
+
+    def render(self, qblock):
+        """ Renders a single question. Returns (name, success)."""
+        name = qblock['name']
+        filename = os.path.join(self.workdir, 'tex-' + name)
+        if self.cancelled():
+            return name, False
+        try:
+            with self.timed('latex', [qblock]):
+                self.write_latex(filename, [qblock])
+            with self.timed('compile', [qblock]):
+                self.compile(filename)
+            if self.cancelled():
+                return name, False
+            if not os.path.exists(self.document(filename)):
+                self.logger.error("LaTeX did not produce a %s file for question %s."
+                                  % (self.document(filename)[-3:].upper(), name))
+                return name, False
+            if self.format == 'svg':
+                with self.timed('dvisvgm', [qblock]):
+                    svgs = self.convert_dvi(filename)
+                if not svgs:
+                    self.logger.error("No SVG file was created for question %s." % name)
+                    return name, False
+                with self.timed('publish', [qblock]):
+                    self.publish_svg(name, svgs)
+                return name, True
+            if self.crop:
+                with self.timed('crop', [qblock]):
+                    cropped = self.crop_pdf(filename + '.pdf')
+                if not cropped:
+                    return name, False
+
+            with self.timed('rasterize', [qblock]):
+                pngs, outputs = self.convert(filename)
+            if not pngs:
+                self.logger.error("No PNG file was created for question %s." % name)
+                return name, False
+            with self.timed('publish', [qblock]):
+                # Multiple pages are numbered as name-0.png, name-1.png, ...
+                if len(pngs) > 1:
+                    self.logger.warning("Question %s needs more than one page. Multiple PNG files created." % name)
+                self.publish_pages(pngs, os.path.join(self.pngdir, 'tex-' + name), 'png')
+                self.publish_outputs(name, outputs)
+                publish(filename + '.pdf', os.path.join(self.pdfdir, 'tex-%s.pdf' % name))
+        except (IOError, OSError):
+            self.logger.exception("Question %s could not be rendered." % name)
+            return name, False
+        return name, True
+
+    def render_fast(self, qblock):
+        """
+        Renders a single question with the fast backend (see fastrender.py).
+        :return: (name, success), or None if the question has to be rendered with LaTeX.
+        """
+        name = qblock['name']
+        reason = check(qblock)
+        if reason is not None:
+            self.logger.debug("Question %s is rendered with LaTeX: %s." % (name, reason))
+            return None
+        if self.cancelled():
+            return name, False
+        png = os.path.join(self.workdir, 'tex-%s.png' % name)
+        try:
+            with self.timed('fast', [qblock]):
+                self.fast.render(qblock, png, self.density, self.size, self.letterbox, self.crop)
+            with self.timed('publish', [qblock]):
+                self.publish_pages([png], os.path.join(self.pngdir, 'tex-' + name), 'png')
+                # There is no PDF file: the one of a previous LaTeX render would not match the image
+                pdf = os.path.join(self.pdfdir, 'tex-%s.pdf' % name)
+                if os.path.exists(pdf):
+                    os.remove(pdf)
+        except Unsupported as e:
+            self.logger.debug("Question %s is rendered with LaTeX: %s." % (name, e))
+            return None
+        except (IOError, OSError):
+            self.logger.exception("Question %s could not be rendered." % name)
+            return name, False
+        return name, True
+
+    def render_batch(self, qblocks):
+        """
+        Renders several questions compiling a single LaTeX document, one page per question. All the pages
+        are rasterized with a single call to the rasterizer (or converted by a single call to dvisvgm).
+        :return: list of (name, success) tuples, or None if the document did not compile (or its pages could not
+                 be split).
+        """
+        filename = os.path.join(self.workdir, 'tex-chunk')
+        try:
+            with self.timed('latex', qblocks):
+                self.write_latex(filename, qblocks)
+            self.logger.debug("Compiling LaTeX (%d questions) ..." % len(qblocks))
+            with self.timed('compile', qblocks):
+                errors = self.compile(filename)
+            pages = self.read_pages(filename + '.pages', len(qblocks))
+            if errors or pages is None or not os.path.exists(self.document(filename)):
+                return None
+            if self.format == 'svg':
+                with self.timed('dvisvgm', qblocks):
+                    self.convert_dvi(filename)
+                outputs = {}
+            else:
+                # pdfcrop crops every page separately
+                if self.crop:
+                    with self.timed('crop', qblocks):
+                        cropped = self.crop_pdf(filename + '.pdf')
+                    if not cropped:
+                        return None
+                with self.timed('rasterize', qblocks):
+                    outputs = self.convert(filename)[1]
+                # Single page PDF files: filename-page1.pdf, filename-page2.pdf, ...
+                with self.timed('split', qblocks):
+                    split = self.split_pdf(filename + '.pdf', filename + '-page%d.pdf')
+                if not split:
+                    return None
+        except (IOError, OSError):
+            self.logger.exception("The chunk %s could not be rendered." % ", ".join(self.names))
+            return None
+
+        results = []
+        for k, qblock in enumerate(qblocks):
+            name = qblock['name']
+            first, last = pages[k], pages[k + 1] - 1
+            pngs = ['%s-%d.%s' % (filename, page - 1, self.format) for page in xrange(first, last + 1)]
+            try:
+                if last < first or not all(map(os.path.exists, pngs)):
+                    self.logger.error("Question %s has no pages in the document." % name)
+                    results.append((name, False))
+                    continue
+                # The PDF file of the question is ready before any of its files is published
+                pdf = filename + '-page%d.pdf' % first
+                if self.format == 'png' and last > first:
+                    pdf = filename + '-%s.pdf' % name
+                    with self.timed('split', [qblock]):
+                        split = self.split_pdf(filename + '.pdf', pdf, first, last)
+                    if not split:
+                        self.logger.error("The PDF file of question %s could not be extracted." % name)
+                        results.append((name, False))
+                        continue
+                if self.format == 'png' and not os.path.exists(pdf):
+                    self.logger.error("Question %s has no PDF file in the document." % name)
+                    results.append((name, False))
+                    continue
+                with self.timed('publish', [qblock]):
+                    self.publish_outputs(name, outputs, (first, last))
+                    if self.format == 'svg':
+                        self.publish_svg(name, pngs)
+                    else:
+                        if len(pngs) > 1:
+                            self.logger.warning("Question %s needs more than one page. Multiple PNG files created."
+                                                % name)
+                        self.publish_pages(pngs, os.path.join(self.pngdir, 'tex-' + name), 'png')
+                        publish(pdf, os.path.join(self.pdfdir, 'tex-%s.pdf' % name))
+                results.append((name, True))
+            except (IOError, OSError):
+                self.logger.exception("Question %s could not be rendered." % name)
+                results.append((name, False))
+        return results
+
+    def write_latex(self, filename, qblocks):
+        """
+        Writes the LaTeX file of one or several questions. With several questions, there is one page per
+        question, and the first page of every question is written by LaTeX to the file filename.pages.
+        """
+        f = open(filename + '.tex', 'w')
+        f.write(self.preamble)
+        # Font sizes and design
+        f.write(self.sizes)
+        f.write(self.design)
+        if len(qblocks) == 1:
+            write_question(f, qblocks[0])
+        else:
+            f.write("\\newwrite\\kajutpages\n\\immediate\\openout\\kajutpages=\\jobname.pages\n")
+            for k, qblock in enumerate(qblocks):
+                f.write("\\immediate\\write\\kajutpages{%d \\thepage}\n{\n" % k)
+                write_question(f, qblock)
+                f.write("}\n\\clearpage\n")
+            # The last entry is the page after the last question
+            f.write("\\immediate\\write\\kajutpages{%d \\thepage}\n" % len(qblocks))
+            f.write("\\immediate\\closeout\\kajutpages\n")
+        f.write(self.ending)
+        f.close()
+
+    def compile(self, filename):
+        """
+        Compiles filename.tex, with the precompiled format of the preamble when possible.
+        :return: LaTeX errors, in file:line:error format.
+        """
+        errors = self.compile_latex(filename, self.fmt)
+        if self.fmt and format_error.search(errors) and not self.cancelled():
+            # The format is outdated (e.g. after upgrading LaTeX): it is discarded and built again next time. Other
+            # errors belong to the question, and the format is kept for the rest of the jobs
+            self.logger.warning("The format %s could not be loaded. Trying without it ..." % self.fmt)
+            fmtfile = os.path.join(self.fmtdir, self.fmt + '.fmt')
+            if os.path.exists(fmtfile):
+                os.remove(fmtfile)
+            self.fmt = None
+            errors = self.compile_latex(filename)
+        if errors and not self.cancelled():
+            self.logger.warning("LaTeX errors in %s.tex:\n%s" % (os.path.basename(filename), errors))
+        return errors
+
+    def compile_latex(self, filename, fmt=None):
+        """ Runs pdflatex (latex for SVG images) on filename.tex, using the precompiled format fmt if given. Returns
+            the errors.
+        """
+        command = ['latex' if self.format == 'svg' else 'pdflatex']
+        # Relative paths of \includegraphics, \input, ... are looked up in the directory of the .tex file
+        env = {'TEXINPUTS': self.texdir + ':' + os.environ.get('TEXINPUTS', '')}
+        if fmt:
+            command.append('-fmt=%s' % fmt)
+            # The trailing colon keeps the default search path
+            env['TEXFORMATS'] = self.fmtdir + ':'
+        status, out, err = run(command + ['-interaction=nonstopmode', '-file-line-error',
+                                          os.path.basename(filename) + '.tex'],
+                               cwd=self.workdir, env=env, timeout=self.timeout, cancel=self.cancel)
+        errors = "\n".join(line for line in (out + "\n" + err).splitlines()
+                           if latex_error.match(line) or format_error.search(line))
+        if status and not errors:
+            errors = "%s finished with exit status %s:\n%s" % (command[0], status, tail(out + err))
+        return errors
+
+    def document(self, filename):
+        """ Document written by LaTeX: filename.pdf, or filename.dvi for SVG images."""
+        return filename + ('.dvi' if self.format == 'svg' else '.pdf')
+
+    def convert_dvi(self, filename):
+        """
+        SVG images of every page of filename.dvi: filename-0.svg, filename-1.svg, ... The fonts are converted into
+        paths or embedded (see Data.svgfonts), and so are the bitmap images (the icons of the choices, figures).
+        """
+        command = ['dvisvgm', '--page=1-', '--bbox=%s' % ('min' if self.crop else 'papersize'),
+                   '--output=%s-%%p.svg' % os.path.basename(filename)]
+        command += ['--no-fonts'] if self.svgfonts == 'paths' else ['--font-format=%s' % self.svgfonts]
+        status, out, err = run(command + [os.path.basename(filename) + '.dvi'], cwd=self.workdir,
+                               timeout=self.timeout, cancel=self.cancel)
+        if status != 0:
+            self.logger.error("dvisvgm failed (exit status %s) on %s.dvi:\n%s"
+                              % (status, os.path.basename(filename), tail(out + err)))
+            return []
+        svgs = Rasterizer.collect(filename, 'svg')
+        for svg in svgs:
+            embed_images(svg, [self.workdir, self.texdir, self.app_path])
+        return svgs
+
+    def publish_svg(self, name, svgs):
+        """ Moves the SVG images of a question to the directory of the images."""
+        if len(svgs) > 1:
+            self.logger.warning("Question %s needs more than one page. Multiple SVG files created." % name)
+        self.publish_pages(svgs, os.path.join(self.pngdir, 'tex-' + name), 'svg')
+
+    @staticmethod
+    def publish_pages(files, filename, ext):
+        """
+        Moves the pages of a question to filename.ext or, for several pages, filename-0.ext, filename-1.ext, ...
+        The pages of an earlier render with another number of pages are removed (see cache.prune_pages).
+        """
+        if len(files) == 1:
+            targets = [filename + '.' + ext]
+        else:
+            targets = ['%s-%d.%s' % (filename, j, ext) for j in xrange(len(files))]
+        for path, target in zip(files, targets):
+            publish(path, target)
+        prune_pages(filename, targets)
+
+    def crop_pdf(self, pdf):
+        """ Removes the white margins of every page of a PDF file (in place). Returns True on success."""
+        cropped = pdf[:-4] + '-crop.pdf'
+        status, out, err = run(['pdfcrop', '--noverbose', pdf, cropped], cwd=self.workdir, timeout=self.timeout,
+                               cancel=self.cancel)
+        if status != 0 or not os.path.exists(cropped):
+            self.logger.error("pdfcrop failed on %s:\n%s" % (os.path.basename(pdf), tail(out + err)))
+            return False
+        os.rename(cropped, pdf)
+        return True
+
+    def rasterize(self, filename, target=None):
+        """
+        PNG files of every page of filename.pdf: filename-0.png, filename-1.png, ...
+        :param target: output target (see targets.py), whose density or size is used instead. Its files are
+                       filename.<target>-0.png, ...
+        """
+        if self.rasterizer is None:
+            raise IOError("No rasterizer found. Install poppler-utils, ghostscript or imagemagick.")
+        name, threads, memory = self.rasterizer
+        raster = get_rasterizer(name, threads, memory, self.timeout)
+        raster.cancel = self.cancel
+        prefix, density, size, boxed = filename, self.density, self.size, self.letterbox
+        if target is not None:
+            prefix, size, boxed = '%s.%s' % (filename, target.name), target.size, target.letterbox
+            density = target.density or self.density
+        if not size:
+            self.logger.debug("Creating png files with %s, density %s ..." % (name, density))
+            return raster.rasterize(filename + '.pdf', prefix, density)
+
+        # Every page is rasterized once, at the density that gives the target size
+        sizes = page_sizes(filename + '.pdf', self.timeout)
+        if sizes is None:
+            if self.crop:
+                self.logger.debug("The size of the cropped pages is unknown (install pdfinfo or PyMuPDF): the "
+                                  "images will be smaller than %s x %s." % size)
+            groups = [(None, None, fit_density(self.page, *size))]
+        else:
+            # Consecutive pages with the same density are rasterized together
+            groups = []
+            for page, page_size in enumerate(sizes, 1):
+                density = fit_density(page_size, *size)
+                if groups and abs(groups[-1][2] - density) < 1e-3:
+                    groups[-1] = (groups[-1][0], page, density)
+                else:
+                    groups.append((page, page, density))
+        fmt = 'ppm' if boxed and 'ppm' in raster.formats else 'png'
+        if boxed and fmt == 'png':
+            self.logger.warning("%s can not write raw images: the images are not letterboxed." % name)
+        self.logger.debug("Creating %s x %s %s files with %s, density %s ..."
+                          % (size + (fmt, name, ", ".join("%.2f" % g[2] for g in groups))))
+        images = []
+        for k, (first, last, density) in enumerate(groups):
+            if len(groups) == 1:
+                images = raster.rasterize(filename + '.pdf', prefix, density, fmt=fmt)
+                break
+            for image in raster.rasterize(filename + '.pdf', prefix + '-range%d' % k, density, first, last, fmt):
+                page = '%s-%d.%s' % (prefix, len(images), fmt)
+                os.rename(image, page)
+                images.append(page)
+        if fmt == 'png':
+            return images
+        pngs = []
+        for image in images:
+            png = image[:-4] + '.png'
+            letterbox(image, png, *size)
+            os.remove(image)
+            pngs.append(png)
+        return pngs
+
+    def convert(self, filename):
+        """
+        Rasterizes filename.pdf (see rasterize) and converts it into the files of every output target (see
+        export). The rasterizer and the converters of the targets run at the same time, in their own processes
+        (one after another with PyMuPDF, which runs in this process).
+        :return: PNG files, and dictionary of the files of every target, by name.
+        """
+        if not self.targets:
+            return self.rasterize(filename), {}
+        tasks = [None] + self.targets
+
+        def task(target):
+            return self.rasterize(filename) if target is None else self.export(filename, target)
+
+        if self.rasterizer is None or self.rasterizer[0] == 'fitz':
+            results = map(task, tasks)
+        else:
+            pool = ThreadPool(len(tasks))
+            try:
+                results = pool.map(task, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        return results[0], dict((target.name, files) for target, files in zip(self.targets, results[1:]))
+
+    def export(self, filename, target):
+        """
+        Converts filename.pdf into the files of an output target, one per page: filename.<target>-0.<format>, ...
+        :return: list of the files, in page order.
+        """
+        if target.format == 'svg':
+            return svg_pages(filename + '.pdf', '%s.%s' % (filename, target.name), self.timeout, self.cancel)
+        pngs = self.rasterize(filename, target)
+        if target.format == 'png':
+            return pngs
+        images = []
+        for png in pngs:
+            encode_webp(png, png[:-4] + '.webp', target.quality, self.timeout, self.cancel)
+            os.remove(png)
+            images.append(png[:-4] + '.webp')
+        return images
+
+    def publish_outputs(self, name, outputs, pages=None):
+        """
+        Moves the files of the output targets of a question to their directories (see convert).
+        :param outputs: files of every target, by name.
+        :param pages: first and last page of the question (from 1), when the document has several questions.
+        """
+        for target in self.targets:
+            files = outputs.get(target.name) or []
+            if pages is not None:
+                files = files[pages[0] - 1:pages[1]]
+            if not files:
+                raise IOError("No %s files were created for the output target %s." % (target.format, target.name))
+            self.publish_pages(files, os.path.join(self.outdirs[target.name], 'tex-' + name), target.format)
+
+    def split_pdf(self, pdf, output, first=None, last=None):
+        """
+        Extracts pages of a PDF file with ghostscript.
+        :param pdf: path of the PDF file.
+        :param output: path of the new file. With %d, one file is written per page (numbered from 1).
+        :param first: first page to extract. Default is all the pages.
+        :param last: last page to extract.
+        :return: True on success.
+        """
+        command = ['gs', '-q', '-dSAFER', '-dNOPAUSE', '-dBATCH', '-sDEVICE=pdfwrite']
+        if first:
+            command += ['-dFirstPage=%d' % first, '-dLastPage=%d' % last]
+        status, out, err = run(command + ['-sOutputFile=%s' % output, pdf], timeout=self.timeout, cancel=self.cancel)
+        if status != 0:
+            self.logger.error("gs failed splitting %s:\n%s" % (os.path.basename(pdf), tail(out + err)))
+        return status == 0
+
+    @staticmethod
+    def read_pages(pagesfile, count):
+        """ First page of every question (and the page after the last one), as written by LaTeX."""
+        pages = {}
+        if not os.path.exists(pagesfile):
+            return None
+        with open(pagesfile, 'r') as f:
+            for line in f:
+                k, page = line.split()
+                pages[int(k)] = int(page)
+        if len(pages) != count + 1:
+            return None
+        return [pages[k] for k in xrange(count + 1)]
+
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.cancelled
+
+    def timed(self, name, qblocks):
+        """ Records a stage of the given questions in the trace of the job (see timing.stage)."""
+        return stage(self.trace, name, [self.ids[qblock['name']] for qblock in qblocks])
+
+    def check_dirs(self):
+        """ Creates the output directories, if necessary."""
+        for path in [self.pngdir] + ([self.pdfdir] if self.format == 'png' else []) + self.outdirs.values():
+            if not os.path.exists(path):
+                try:
+                    os.mkdir(path)
+                except OSError:
+                    if not os.path.isdir(path):  # Another job may have created it
+                        raise IOError('Path %s does not exist.' % path)
+
+    def cache_store(self, cache, key, name):
+        """ Stores the images and the PDF file of a question, and the files of its output targets, in the cache."""
+        pngs = page_files(os.path.join(self.pngdir, 'tex-' + name), self.format)
+        pdf = os.path.join(self.pdfdir, 'tex-%s.pdf' % name)
+        outputs = dict((target.name, page_files(os.path.join(self.outdirs[target.name], 'tex-' + name), target.format))
+                       for target in self.targets)
+        if pngs:
+            cache.put(key, pngs + [pdf] if self.format == 'png' and os.path.exists(pdf) else pngs, outputs)
+
+
+def write_question(f, qblock):
+    """ Writes the question and its choices (the body of the LaTeX document) in the file f."""
+    num_choices = len(qblock['choices'])
+    if num_choices < 4:
+        logging.getLogger('render').warning("This question (%s) has only %d choices!" % (qblock['name'], num_choices))
+    else:
+        for a, choice in zip(["A", "B", "C", "D"], qblock['choices']):
+            f.write("\\def\\" + a + "{" + choice + "\n}\n")
+    # % File_name: T1_c1.1_q1
+    # % Title: Pregunta 1
+    f.write("% File_name: " + qblock['name'] + "\n")
+    f.write("% Title: " + qblock['name'] + "\n")
+    f.write("{\\QSize\n" + qblock['question'] + "\n}\n")
+    if num_choices == 4:
+        f.write("\\kajut{\\A}{\\B}{\\C}{\\D}\n")
+    else:
+        f.write("{\\noindent\n" + " \\begin{enumerate}\n")
+        for choice in qblock['choices']:
+            f.write("\\Myitem \\Size " + choice + "\n")
+        f.write(" \\end{enumerate}  \n" + "}\n")
+
+
+def png_files(filename):
+    """ PNG files of a given file name: filename.png or, for several pages, filename-0.png, filename-1.png, ..."""
+    return page_files(filename, 'png')
+
+
+def page_files(filename, ext):
+    """ Files of a given file name and extension: filename.ext or, for several pages, filename-0.ext, ..."""
+    if os.path.exists(filename + '.' + ext):
+        return [filename + '.' + ext]
+    size = len(ext) + 1
+    pages = [page for page in glob.glob(filename + '-*.' + ext) if page[len(filename) + 1:-size].isdigit()]
+    return sorted(pages, key=lambda page: int(page[len(filename) + 1:-size]))
+
+
+def workspace():
+    """ Directory for the temporary files of the render jobs: memory backed (/dev/shm) when available."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK | os.X_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _init_worker():
+    # Ctrl+C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run(job):
+    # The timing of the stages goes back to the parent along with the results
+    return job.run(), job.trace
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def render_batch(kajut, qblocks, names=None, jobs=1, chunk=1, archive=None):
+    """
+    Renders a set of questions, showing the progress of each of them.
+    :param kajut: Kajut object with the settings of the render.
+    :param qblocks: dictionary of question blocks, by identifier (see Data.qblocks).
+    :param names: identifiers of the questions to be rendered. Default is all of them.
+    :param jobs: number of worker processes. 1 renders in this process, 0 uses all the cores.
+    :param chunk: number of questions compiled in a single LaTeX document.
+    :param archive: archive.Archive object. The questions are written into it as they finish, instead of
+                    into the output directories.
+    :return: lists with the names of the questions successfully rendered and of the failed ones.
+    """
+    logger = logging.getLogger('render')
+    if names is None:
+        names = qblocks.keys()
+    # The questions are always processed (and reported) in the same order
+    names = sorted(names)
+    if kajut.raster is None and kajut.d.format == 'png' and kajut.d.backend != 'fast':
+        logger.error("No rasterizer found. Install poppler-utils, ghostscript or imagemagick (or use --format svg).")
+        return [], names
+    if jobs < 1:
+        jobs = cpu_count()
+
+    done = []
+    failed = []
+    pool = None
+    t0 = time.time()
+    chunk = max(chunk, 1)
+    # Every job takes a snapshot of the settings (and the LaTeX format is built once, before them). The questions
+    # compiled together are always from the same file
+    batch = []
+    for source, group in itertools.groupby(names, lambda name: qblocks[name].get('source')):
+        group = list(group)
+        batch += [kajut.job([qblocks[name] for name in group[i:i + chunk]]) for i in xrange(0, len(group), chunk)]
+    staging = None
+    if archive is not None:
+        # Every job publishes its files in its own directory, which is emptied into the archive when it finishes
+        staging = tempfile.mkdtemp(prefix='kajut-archive-', dir=workspace())
+        for k, job in enumerate(batch):
+            job.pngdir = job.pdfdir = os.path.join(staging, str(k))
+            job.outdirs = dict((target.name, os.path.join(job.pngdir, target.name)) for target in job.targets)
+    jobs = min(jobs, len(batch)) or 1
+    if jobs > 1:
+        logger.info("Rendering %d questions with %d worker processes (rasterizer: %s) ..."
+                    % (len(names), jobs, kajut.raster.name if kajut.raster else None))
+        pool = multiprocessing.Pool(jobs, _init_worker)
+        results = pool.imap(_run, batch)
+    else:
+        logger.info("Rendering %d questions (rasterizer: %s) ..."
+                    % (len(names), kajut.raster.name if kajut.raster else None))
+        results = (_run(job) for job in batch)
+
+    try:
+        for job, (job_results, trace) in itertools.izip(batch, results):
+            if kajut.d.trace is not None:
+                kajut.d.trace.extend(trace)
+            for name, success in job_results:
+                k = len(done) + len(failed)
+                if success and archive is not None:
+                    success = archive_question(archive, qblocks[name], job.pngdir, job.targets, job.format)
+                if success:
+                    done.append(name)
+                    logger.info("File %d/%d: %s ... done." % (k + 1, len(names), name))
+                else:
+                    failed.append(name)
+                    logger.error("File %d/%d: %s ... failed." % (k + 1, len(names), name))
+            if staging:
+                shutil.rmtree(job.pngdir, ignore_errors=True)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted by the user.")
+        if pool:
+            pool.terminate()
+            pool.join()
+        raise
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+    if pool:
+        pool.close()
+        pool.join()
+    if kajut.cache:
+        kajut.cache.trim()
+    if kajut.d.trace is not None:
+        kajut.d.trace.summary()
+
+    logger.info("%d questions rendered in %.1f s: %d succeeded, %d failed."
+                % (len(names), time.time() - t0, len(done), len(failed)))
+    if failed:
+        logger.error("Failed questions: %s" % ", ".join(failed))
+    return done, failed
+
+
+def archive_question(archive, qblock, outdir, targets=(), ext='png'):
+    """
+    Moves the files of a rendered question from outdir into the archive. The files of the output targets are in
+    subdirectories of outdir, named after them. Returns True on success.
+    :param ext: format of the images (png or svg).
+    """
+    filename = os.path.join(outdir, 'tex-' + qblock['name'])
+    pngs = page_files(filename, ext)
+    outputs = dict((target.name, page_files(os.path.join(outdir, target.name, 'tex-' + qblock['name']),
+                                            target.format)) for target in targets)
+    try:
+        if not pngs:
+            raise IOError("no %s files found" % ext.upper())
+        archive.add(qblock, pngs, filename + '.pdf' if os.path.exists(filename + '.pdf') else None, outputs)
+    except (IOError, OSError) as e:
+        logging.getLogger('render').error("Question %s could not be archived (%s)." % (qblock['name'], e))
+        return False
+    return True
+
+
+class RenderQueue(object):
+    """ Queue of render jobs, run by a pool of worker threads (the work is done by pdflatex, the rasterizer,
+        ... in their own processes, so that all the cores are used).
+
+        Progress is reported through callback(event, name, success), called from the worker threads, where the
+        event is 'queued', 'running', 'done' or 'cancelled' for each question, and 'finished' (with no name)
+        when the queue becomes empty.
+    """
+
+    def __init__(self, workers=0, callback=None, trace=None):
+        """
+        :param workers: number of worker threads. 0 uses as many as cores.
+        :param callback: function that receives the progress of the questions.
+        :param trace: timing.Trace object where the stages of the jobs are written.
+        """
+        self.logger = logging.getLogger('render.RenderQueue')
+        self.workers = workers if workers > 0 else cpu_count()
+        self.callback = callback or (lambda event, name=None, success=None: None)
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.token = Cancel()
+        self.total = 0
+        self.finished = 0
+        self.busy = 0
+        self.times = []  # Seconds per question, as measured
+        self.threads = []
+        self.trace = trace
+
+    def submit(self, jobs):
+        """ Adds render jobs (RenderJob objects) to the queue."""
+        with self.lock:
+            if not self.busy and self.queue.empty():
+                # A new round: the progress starts again
+                self.total = self.finished = 0
+            for job in jobs:
+                job.cancel = self.token
+                self.total += len(job.names)
+                self.queue.put(job)
+        for job in jobs:
+            for name in job.names:
+                self.callback('queued', name)
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                self.busy += 1
+            counted = False
+            try:
+                if job.cancelled():
+                    results = None
+                else:
+                    for name in job.names:
+                        self.callback('running', name)
+                    t0 = time.time()
+                    results = job.run()
+                    elapsed = (time.time() - t0) / len(job.names)
+                    if self.trace is not None:
+                        self.trace.extend(job.trace)
+                cancelled = job.cancelled()
+                with self.lock:
+                    self.finished += len(job.names)
+                    counted = True
+                    if results is not None and not cancelled:
+                        self.times.extend([elapsed] * len(job.names))
+                for name, success in results or [(name, False) for name in job.names]:
+                    self.callback('cancelled' if cancelled else 'done', name, success)
+            except Exception:
+                self.logger.exception("The render of %s failed." % ", ".join(job.names))
+                with self.lock:
+                    if not counted:
+                        # The questions are finished (failed): otherwise the progress never reaches the total
+                        self.finished += len(job.names)
+                for name in job.names:
+                    self.callback('done', name, False)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    last = not self.busy and self.queue.empty()
+                if last:
+                    self.callback('finished')
+
+    def cancel(self):
+        """ Cancels the queued jobs and stops the running ones."""
+        with self.lock:
+            token, self.token = self.token, Cancel()
+        token.cancel()
+        self.logger.info("Render cancelled.")
+
+    def progress(self):
+        """
+        :return: questions finished, total number of questions and estimated seconds to finish them (None until
+                 the first question is done).
+        """
+        with self.lock:
+            done, total = self.finished, self.total
+            times = self.times[-100:]  # The most recent questions are more representative
+        eta = None
+        if times:
+            eta = sum(times) / len(times) * (total - done) / min(self.workers, max(total - done, 1))
+        return done, total, eta
+
+    def running(self):
+        with self.lock:
+            return self.busy > 0 or not self.queue.empty()
@@ -1,22 +1,9 @@
 import argparse
-
-try:
-    import yaml
-except:
-    raise ImportError(
-        'Istall pyyaml package. In debian based systems:\n'
-        '\t # apt-get install python-yaml\n or\n\t pip install PyYAML ')
 import os
 import sys
 import datetime
 import logging.config
 
-try:
-    from colorlog import ColoredFormatter
-except:
-    raise ImportError('Install colorlog module. In debian based systems:\n'
-                      '\t# apt-get install python-colorlog\nor\n\tpip install colorlog')
-
 __author__ = 'Jose M. Esnaola Acebes'
 
 """ General pourpose library for simulations.
@@ -96,6 +83,7 @@ def parser(config_file, arguments=None, description=None, usage=None, parameters
             choices:     [False, True]
     """
 
+    yaml = load_yaml()
     # Opening the configuration file to load parameters
     options = None
     prmts = None
@@ -155,39 +143,46 @@ def parser(config_file, arguments=None, description=None, usage=None, parameters
     return opts, args
 
 
+def load_yaml():
+    """ Imports yaml when it is needed: only configuration files use it."""
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError(
+            'Istall pyyaml package. In debian based systems:\n'
+            '\t # apt-get install python-yaml\n or\n\t pip install PyYAML ')
+    return yaml
+
+
 def log_conf(db, config_file=None, name='simulation', logdir='./log'):
     """ Logging configuration
     :param db: debugging level, must be an attribute in logging. See help(logging).
     :param config_file: external logging configuration file for handlers configuration.
     :param name: name of the logger.
-    :param logdir: Directory where the log file is stored.
+    :param logdir: Directory where the log file is stored. None logs to the console only.
     """
     global log
-    logging_doc = """
-        version: 1
-        formatters:
-          simple:
-            format: "[%(levelname)-8.8s]:%(name)-20.20s:%(funcName)-10.10s:\n\t%(message)s"
-        handlers:
-          console:
-            class: logging.StreamHandler
-            level: DEBUG
-            formatter: simple
-            stream: ext://sys.stdout
-          file:
-            class: logging.FileHandler
-            level: DEBUG
-            formatter: simple
-            filename: 'log/simulation.log'
-        loggers:
-          simulation:
-            level: DEBUG
-            handlers: [console, file]
-            propagate: no
-        root:
-          level: DEBUG
-          handlers: [console, file]
-    """
+    try:
+        from colorlog import ColoredFormatter
+    except ImportError:
+        raise ImportError('Install colorlog module. In debian based systems:\n'
+                          '\t# apt-get install python-colorlog\nor\n\tpip install colorlog')
+    filename = "%s/%s.log" % (logdir, name)
+    handlers = ['console', 'file'] if logdir else ['console']
+    logging_doc = {
+        'version': 1,
+        'formatters': {
+            'simple': {'format': "[%(levelname)-8.8s]:%(name)-20.20s:%(funcName)-10.10s:\n\t%(message)s"}},
+        'handlers': {
+            'console': {'class': 'logging.StreamHandler', 'level': 'DEBUG', 'formatter': 'simple',
+                        'stream': 'ext://sys.stdout'},
+            'file': {'class': 'logging.FileHandler', 'level': 'DEBUG', 'formatter': 'simple', 'filename': filename}},
+        'loggers': {
+            'simulation': {'level': 'DEBUG', 'handlers': handlers, 'propagate': False}},
+        'root': {'level': 'DEBUG', 'handlers': handlers}
+    }
+    if not logdir:
+        logging_doc['handlers'].pop('file')
 
     # Setting debug level
     debug = getattr(logging, db.upper(), None)
@@ -195,21 +190,21 @@ def log_conf(db, config_file=None, name='simulation', logdir='./log'):
     if not isinstance(debug, int):
         raise ValueError('Invalid log level: %s' % db)
     # Check logging folder (default is log)
-    cwd = os.getcwd()
-    if not os.path.exists(logdir):
-        try:
-            os.mkdir(logdir)
-        except:
-            raise IOError('Path %s/%s does not exist.' % (cwd, logdir))
-    filename = "%s/%s.log" % (logdir, name)
-    if os.path.exists(filename):
-        f = file(filename, 'a+')
-    else:
-        f = file(filename, 'w+')
-    day, hour = now()
-    f.write("\n[%s\t%s]\n" % (day, hour))
-    f.write("-------------------------\n")
-    f.close()
+    if logdir:
+        cwd = os.getcwd()
+        if not os.path.exists(logdir):
+            try:
+                os.mkdir(logdir)
+            except:
+                raise IOError('Path %s/%s does not exist.' % (cwd, logdir))
+        if os.path.exists(filename):
+            f = file(filename, 'a+')
+        else:
+            f = file(filename, 'w+')
+        day, hour = now()
+        f.write("\n[%s\t%s]\n" % (day, hour))
+        f.write("-------------------------\n")
+        f.close()
 
     # Output format
     logformat = "%(log_color)s[%(levelname)-7.8s]%(reset)s %(name)-12.12s:%(funcName)-8.8s: " \
@@ -224,9 +219,9 @@ def log_conf(db, config_file=None, name='simulation', logdir='./log'):
 
     # General Configuration
     if config_file:
-        logging.config.dictConfig(yaml.load(file(config_file, 'rstored')))
+        logging.config.dictConfig(load_yaml().load(file(config_file, 'rstored')))
     else:
-        logging.config.dictConfig(yaml.load(logging_doc))
+        logging.config.dictConfig(logging_doc)
 
     # Handler
     handler = logging.root.handlers[0]
@@ -0,0 +1,386 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import logging
+import SocketServer
+import BaseHTTPServer
+from render import cpu_count, png_files, workspace
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Render service: the render pipeline as a long running HTTP server, on localhost or on a Unix socket, so that
+    other programs get question images without starting pykajut (and LaTeX) every time.
+
+    POST /render        JSON request:
+                            {"qblock": {"name": "q1", "title": "...", "question": "...", "choices": [...]},
+                             "options": {"density": 150, "width_px": 880, "height_px": 495, "letterbox": true,
+                                         "crop": true, "design": "tabular", "backend": "fast"},
+                             "reply": "png"}
+                        "text" (a question block in the format of the questions files) can be given instead of
+                        "qblock". The reply is the PNG image ("page" selects the page of long questions) or,
+                        with "reply": "ref", a JSON reference to the files in the render cache.
+    GET /cache/<key>/<file>  File of a cached render.
+    GET /health         Status of the service (JSON).
+    GET /metrics        Counters of the service, in the Prometheus text format.
+
+    Renders run on a bounded pool of workers. When all of them are busy and the waiting list is full, requests
+    are rejected with 503 (and Retry-After), so that clients back off instead of piling up.
+"""
+
+logging.getLogger('service').addHandler(logging.NullHandler())
+
+OPTIONS = {'density': int, 'width_px': int, 'height_px': int, 'letterbox': bool, 'crop': bool, 'design': str,
+           'backend': str}
+NAME = re.compile(r'^[A-Za-z0-9_.+-]+$')
+KEY = re.compile(r'^[0-9a-f]{40}$')
+MAX_BODY = 1024 * 1024
+
+
+class RequestError(Exception):
+    """ Wrong request: reported to the client with the given HTTP status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class RenderService(object):
+    def __init__(self, data, kajut, workers=0, backlog=16):
+        """
+        :param data: Data object with the default settings.
+        :param kajut: Kajut object with the settings of the render.
+        :param workers: number of questions rendered at the same time. 0 uses all the cores.
+        :param backlog: number of requests that may wait for a worker before new ones are rejected.
+        """
+        self.logger = logging.getLogger('service.RenderService')
+        self.d = data
+        self.kj = kajut
+        self.workers = workers if workers > 0 else cpu_count()
+        self.backlog = backlog
+        self.slots = threading.Semaphore(self.workers + backlog)  # Requests accepted (running or waiting)
+        self.pool = threading.Semaphore(self.workers)  # Requests running
+        self.lock = threading.Lock()  # Settings of the data, while a job takes its snapshot
+        self.texdir = os.path.realpath(self.d.texdir or self.d.cwd)
+        self.started = time.time()
+        self.metrics = {'requests': {}, 'renders': 0, 'failed': 0, 'cache_hits': 0, 'rejected': 0,
+                        'render_seconds': 0.0, 'running': 0, 'waiting': 0}
+        self.mlock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.mlock:
+            self.metrics[name] += value
+            return self.metrics[name]
+
+    def request(self, status):
+        with self.mlock:
+            self.metrics['requests'][status] = self.metrics['requests'].get(status, 0) + 1
+
+    def qblock(self, request):
+        """ Question block of a request, validated."""
+        if 'text' in request:
+            qblocks = self.d.parser.parse(request['text'])
+            if not qblocks:
+                raise RequestError(400, "No question found in the text (see the format of the questions files).")
+            qblock = qblocks[0]
+        elif isinstance(request.get('qblock'), dict):
+            qblock = dict(request['qblock'])
+        else:
+            raise RequestError(400, "The request needs a 'qblock' or a 'text'.")
+        qblock = dict((key, value.encode('utf-8') if isinstance(value, unicode) else value)
+                      for key, value in qblock.items())
+        qblock['choices'] = [choice.encode('utf-8') if isinstance(choice, unicode) else choice
+                             for choice in qblock.get('choices') or []]
+        qblock.setdefault('time', 'None')
+        qblock.setdefault('correct', None)
+        if not NAME.match(str(qblock.get('name', ''))):
+            raise RequestError(400, "The name of the question must be made of letters, digits and _.+-")
+        if not isinstance(qblock.get('question'), str):
+            raise RequestError(400, "The question has no statement.")
+        qblock['title'] = qblock.get('title') or qblock['name']
+        # Relative paths of figures are looked up in the directory of the service
+        qblock['texdir'] = self.texdir
+        return qblock
+
+    def options(self, request):
+        options = request.get('options') or {}
+        unknown = set(options) - set(OPTIONS)
+        if unknown:
+            raise RequestError(400, "Unknown options: %s" % ", ".join(sorted(unknown)))
+        try:
+            options = dict((key, OPTIONS[key](value)) for key, value in options.items())
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, "Wrong option: %s" % e)
+        if options.get('design', self.d.design) not in self.kj.designs:
+            raise RequestError(400, "Unknown design %s." % options['design'])
+        if options.get('backend', self.d.backend) not in ('latex', 'fast'):
+            raise RequestError(400, "Unknown backend %s." % options['backend'])
+        return options
+
+    def job(self, qblock, options):
+        """ Render job with the options of the request (the settings of the service are not changed)."""
+        # The service only replies with the PNG images: the output targets are not converted
+        options = dict(options, targets=[])
+        with self.lock:
+            saved = dict((key, getattr(self.d, key)) for key in options)
+            try:
+                for key, value in options.items():
+                    setattr(self.d, key, value)
+                job = self.kj.job([qblock])
+            except IOError as e:
+                raise RequestError(400, "The question can not be rendered: %s" % e)
+            finally:
+                for key, value in saved.items():
+                    setattr(self.d, key, value)
+        return job
+
+    def render(self, request):
+        """
+        Renders the question of a request.
+        :return: cache key (or None, without the render cache) and the PNG pages, read into memory.
+        """
+        qblock = self.qblock(request)
+        options = self.options(request)
+        if not self.slots.acquire(False):
+            self.count('rejected')
+            raise RequestError(503, "The service is busy. Try again later.")
+        try:
+            # The job (the format of the preamble, the cache key) is only built for the accepted requests
+            job = self.job(qblock, options)
+            self.count('waiting')
+            with self.pool:
+                self.count('waiting', -1)
+                self.count('running')
+                try:
+                    return self.run(job, qblock)
+                finally:
+                    self.count('running', -1)
+        finally:
+            self.slots.release()
+
+    def run(self, job, qblock):
+        key = job.keys[0] if job.keys else None
+        cached = key is not None and os.path.isdir(self.kj.cache.entry(key))
+        outdir = tempfile.mkdtemp(prefix='kajut-service-', dir=workspace())
+        job.pngdir = job.pdfdir = outdir
+        t0 = time.time()
+        try:
+            name, success = job.run()[0]
+            self.count('render_seconds', time.time() - t0)
+            renders = self.count('cache_hits' if cached else 'renders')
+            pngs = png_files(os.path.join(outdir, 'tex-' + qblock['name']))
+            if not success or not pngs:
+                self.count('failed')
+                raise RequestError(422, "The question %s could not be rendered (see the log of the service)."
+                                   % qblock['name'])
+            pages = []
+            for png in pngs:
+                with open(png, 'rb') as f:
+                    pages.append(f.read())
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+        if self.kj.cache and not cached and renders % 100 == 0:
+            self.kj.cache.trim()
+        return key, pages
+
+    def cached(self, key, filename):
+        """ Contents of a file of a cached render."""
+        if self.kj.cache is None or not KEY.match(key) or not NAME.match(filename):
+            raise RequestError(404, "Not found.")
+        try:
+            with open(os.path.join(self.kj.cache.entry(key), filename), 'rb') as f:
+                return f.read()
+        except IOError:
+            raise RequestError(404, "Not found.")
+
+    def health(self):
+        with self.mlock:
+            return {'status': 'ok', 'uptime': time.time() - self.started, 'workers': self.workers,
+                    'backlog': self.backlog, 'running': self.metrics['running'], 'waiting': self.metrics['waiting'],
+                    'rasterizer': self.kj.raster.name if self.kj.raster else None,
+                    'cache': self.kj.cache is not None}
+
+    def prometheus(self):
+        """ Metrics in the Prometheus text format."""
+        with self.mlock:
+            m = dict(self.metrics, requests=dict(self.metrics['requests']))
+        lines = ["# TYPE kajut_requests_total counter"]
+        for status, count in sorted(m['requests'].items()):
+            lines.append('kajut_requests_total{status="%d"} %d' % (status, count))
+        for name, kind, value in (('renders_total', 'counter', m['renders']),
+                                  ('cache_hits_total', 'counter', m['cache_hits']),
+                                  ('failed_total', 'counter', m['failed']),
+                                  ('rejected_total', 'counter', m['rejected']),
+                                  ('render_seconds_total', 'counter', m['render_seconds']),
+                                  ('running', 'gauge', m['running']),
+                                  ('waiting', 'gauge', m['waiting']),
+                                  ('workers', 'gauge', self.workers),
+                                  ('uptime_seconds', 'gauge', time.time() - self.started)):
+            lines.append("# TYPE kajut_%s %s" % (name, kind))
+            lines.append("kajut_%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'pykajut'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        try:
+            if self.path == '/health':
+                self.reply(200, json.dumps(service.health()), 'application/json')
+            elif self.path == '/metrics':
+                self.reply(200, service.prometheus(), 'text/plain; version=0.0.4')
+            elif self.path.startswith('/cache/') and self.path.count('/') == 3:
+                key, filename = self.path.split('/')[2:]
+                self.reply(200, service.cached(key, filename),
+                           'application/pdf' if filename.endswith('.pdf') else 'image/png')
+            else:
+                raise RequestError(404, "Not found.")
+        except RequestError as e:
+            self.error(e)
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            try:
+                length = int(self.headers.getheader('content-length') or 0)
+            except ValueError:
+                length = -1
+            if not 0 <= length <= MAX_BODY:
+                # The body is not read: the rest of the connection can not be parsed as requests
+                self.close_connection = 1
+                if length < 0:
+                    raise RequestError(400, "Bad Content-Length.")
+                raise RequestError(413, "The request is too large.")
+            # The body is read before any other error, so that the connection can be kept alive
+            body = self.rfile.read(length)
+            if self.path != '/render':
+                raise RequestError(404, "Not found.")
+            try:
+                request = json.loads(body)
+                if not isinstance(request, dict):
+                    raise ValueError("not an object")
+            except ValueError as e:
+                raise RequestError(400, "The request is not valid JSON: %s" % e)
+            key, pages = service.render(request)
+            if request.get('reply', 'png') == 'ref':
+                if key is None:
+                    raise RequestError(400, "References need the render cache (the service runs without it).")
+                files = sorted(os.listdir(service.kj.cache.entry(key)))
+                self.reply(200, json.dumps({'key': key, 'pages': len(pages),
+                                            'files': ['/cache/%s/%s' % (key, name) for name in files]}),
+                           'application/json')
+            else:
+                page = int(request.get('page', 0))
+                if not 0 <= page < len(pages):
+                    raise RequestError(400, "The question has %d pages." % len(pages))
+                headers = {'X-Kajut-Pages': len(pages)}
+                if key:
+                    headers['X-Kajut-Key'] = key
+                self.reply(200, pages[page], 'image/png', headers)
+        except RequestError as e:
+            self.error(e)
+        except Exception as e:
+            self.server.service.logger.exception("Request failed.")
+            self.error(RequestError(500, "Internal error: %s" % e))
+
+    def reply(self, status, body, content_type, headers=None):
+        self.server.service.request(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, e):
+        headers = {'Retry-After': 1} if e.status == 503 else {}
+        if self.close_connection:
+            headers['Connection'] = 'close'
+        self.reply(e.status, json.dumps({'error': str(e)}), 'application/json', headers)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, fmt, *args):
+        self.server.service.logger.debug("%s %s" % (self.address_string(), fmt % args))
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        # Only the user can talk to the service
+        os.chmod(self.server_address, 0o600)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def serve(data, kajut, port=8642, path=None, workers=0, backlog=16):
+    """
+    Runs the render service until the user interrupts it (Ctrl+C).
+    :param port: port of the HTTP server, on localhost.
+    :param path: path of a Unix socket, used instead of the port.
+    """
+    logger = logging.getLogger('service')
+    service = RenderService(data, kajut, workers, backlog)
+    if path:
+        path = os.path.expanduser(path)
+        if os.path.exists(path):
+            # A socket left by a previous service that did not exit cleanly
+            test = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                test.connect(path)
+                raise IOError("Another service is listening on %s." % path)
+            except socket.error:
+                os.remove(path)
+            finally:
+                test.close()
+        server = UnixHTTPServer(path, Handler)
+        where = path
+    else:
+        server = HTTPServer(('127.0.0.1', port), Handler)
+        where = 'http://127.0.0.1:%d' % server.server_address[1]
+    server.service = service
+    logger.info("Render service on %s (%d workers, %d waiting requests at most). Ctrl+C to stop."
+                % (where, service.workers, backlog))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.warning("Interrupted by the user.")
+    finally:
+        server.server_close()
+        if path and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,192 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import base64
+import logging
+from distutils.spawn import find_executable
+from process import run, tail
+from raster import Rasterizer, fitz_lock, page_sizes
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Output targets: extra files of every question, converted from the PDF file of a single compilation (see
+    RenderJob.convert). Every target has a format (png, webp or svg), a density or a size, and its own directory
+    next to the questions file (<texdir>/<target name>). They are given as <name>:<format>[:<option>,...]:
+
+        print:png:density=600
+        web:webp:width=480,quality=75
+        kahoot:png:width=880,height=495,letterbox
+        slides:svg
+
+    SVG images are vector images: the density and the size do not apply to them. The SVG images of --format svg,
+    converted from DVI files by dvisvgm, have their bitmap images embedded by embed_images.
+"""
+
+logging.getLogger('targets').addHandler(logging.NullHandler())
+
+FORMATS = ('png', 'webp', 'svg')
+# Directories of the main output, which the targets can not take
+RESERVED = ('png', 'pdf', 'svg')
+
+
+class Target(object):
+    def __init__(self, name, fmt='png', density=None, width=None, height=None, letterbox=False, quality=80):
+        """
+        :param name: name of the target, and of its output directory.
+        :param fmt: format of the files: png, webp or svg.
+        :param density: density of the images (dots per inch). Default is the density of the main output.
+        :param width: width of the images in pixels, instead of the density.
+        :param height: height of the images in pixels. With the width, the pages fit in both.
+        :param letterbox: pad the images to exactly width x height pixels.
+        :param quality: quality of the WebP images (0-100).
+        """
+        self.name = name
+        self.format = fmt
+        self.density = density
+        self.width = width
+        self.height = height
+        self.letterbox = letterbox
+        self.quality = quality
+
+    @property
+    def size(self):
+        return (self.width, self.height) if self.width or self.height else None
+
+    def __repr__(self):
+        return ("Target(%r, %r, density=%r, width=%r, height=%r, letterbox=%r, quality=%r)"
+                % (self.name, self.format, self.density, self.width, self.height, self.letterbox, self.quality))
+
+
+def parse_target(spec):
+    """
+    Output target of a specification <name>:<format>[:<option>=<value>,...], where the options are density,
+    width, height, quality and letterbox (without value).
+    :return: Target object.
+    """
+    m = re.match(r'^([A-Za-z0-9_][A-Za-z0-9_.-]*):([a-z]+)(?::(.*))?$', spec)
+    if m is None:
+        raise ValueError("Bad output target %s: use <name>:<format>[:<option>=<value>,...]." % spec)
+    name, fmt, options = m.groups()
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format %s of the output target %s (use %s)." % (fmt, name, ", ".join(FORMATS)))
+    if name in RESERVED:
+        raise ValueError("The output target can not be named %s: it is the directory of the main output." % name)
+    kwargs = {}
+    for option in (options or '').split(','):
+        key, sep, value = option.strip().partition('=')
+        if not key:
+            continue
+        elif key == 'letterbox' and not sep:
+            kwargs['letterbox'] = True
+        elif key in ('density', 'width', 'height', 'quality'):
+            try:
+                kwargs[key] = float(value) if key == 'density' else int(value)
+            except ValueError:
+                raise ValueError("Bad value of %s in the output target %s: %s." % (key, name, value))
+        else:
+            raise ValueError("Unknown option %s of the output target %s." % (key, name))
+    target = Target(name, fmt, **kwargs)
+    if target.letterbox and not (target.width and target.height):
+        raise ValueError("The output target %s needs both width and height to be letterboxed." % name)
+    return target
+
+
+def encode_webp(png, webp, quality=80, timeout=None, cancel=None):
+    """
+    Converts a PNG image into a WebP image, with cwebp or ImageMagick.
+    :param quality: quality of the image (0-100).
+    :param cancel: process.Cancel object that may stop the encoder.
+    """
+    if find_executable('cwebp'):
+        command = ['cwebp', '-quiet', '-q', str(quality), png, '-o', webp]
+    elif find_executable('convert'):
+        command = ['convert', png, '-quality', str(quality), webp]
+    else:
+        raise IOError("No WebP encoder was found (install cwebp or ImageMagick).")
+    status, out, err = run(command, timeout=timeout, cancel=cancel)
+    if status != 0 or not os.path.exists(webp):
+        raise IOError("%s failed (exit status %s) on %s:\n%s" % (command[0], status, png, tail(out + err)))
+
+
+def svg_pages(pdf, prefix, timeout=None, cancel=None):
+    """
+    Converts every page of a PDF file into an SVG image (text as paths), with pdftocairo, pdf2svg, dvisvgm or
+    PyMuPDF, the first available.
+    :param prefix: path of the SVG files, without the page number and the extension.
+    :return: list of the files created, prefix-0.svg, prefix-1.svg, ..., in page order.
+    """
+    Rasterizer.remove_pages(prefix, 'svg')
+    if find_executable('pdftocairo'):
+        sizes = page_sizes(pdf, timeout)
+        if sizes is None:
+            raise IOError("The pages of %s could not be counted (install pdfinfo)." % pdf)
+        # pdftocairo writes a single page per SVG file
+        commands = [['pdftocairo', '-svg', '-f', str(page), '-l', str(page), pdf, '%s-%d.svg' % (prefix, page)]
+                    for page in xrange(1, len(sizes) + 1)]
+    elif find_executable('pdf2svg'):
+        commands = [['pdf2svg', pdf, prefix + '-%d.svg', 'all']]
+    elif find_executable('dvisvgm'):
+        commands = [['dvisvgm', '--pdf', '--page=1-', '--no-fonts', '--output=%s-%%p.svg' % prefix, pdf]]
+    elif fitz is not None:
+        with fitz_lock:
+            doc = fitz.open(pdf)
+            for k, page in enumerate(doc):
+                with open('%s-%d.svg' % (prefix, k), 'w') as f:
+                    f.write((getattr(page, 'get_svg_image', None) or page.getSVGimage)(text_as_path=True))
+            doc.close()
+        commands = []
+    else:
+        raise IOError("No SVG converter was found (install poppler-utils, pdf2svg or dvisvgm).")
+    for command in commands:
+        status, out, err = run(command, timeout=timeout, cancel=cancel)
+        if status != 0:
+            raise IOError("%s failed (exit status %s) on %s:\n%s" % (command[0], status, pdf, tail(out + err)))
+    return Rasterizer.collect(prefix, 'svg')
+
+
+def embed_images(svg, dirs=()):
+    """
+    Embeds the bitmap images linked from an SVG file (dvisvgm links the PNG and JPEG images of \\includegraphics,
+    such as the icons of the choices) as data URIs, so that the file can be moved without them.
+    :param svg: path of the SVG file, changed in place.
+    :param dirs: directories where the relative paths of the images are looked up.
+    """
+    with open(svg, 'r') as f:
+        data = f.read()
+
+    def inline(m):
+        path = m.group(2)
+        for directory in [''] if os.path.isabs(path) else dirs:
+            image = os.path.join(directory, path)
+            if os.path.isfile(image):
+                with open(image, 'rb') as f:
+                    kind = 'png' if image.lower().endswith('.png') else 'jpeg'
+                    return '%s="data:image/%s;base64,%s"' % (m.group(1), kind, base64.b64encode(f.read()))
+        return m.group(0)
+
+    embedded = re.sub(r'((?:xlink:)?href)="([^":#]+\.(?:png|jpe?g))"', inline, data, flags=re.I)
+    if embedded != data:
+        with open(svg, 'w') as f:
+            f.write(embedded)
@@ -0,0 +1,53 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from archive import png_size
+from raster import write_png
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the size of the images in the archive manifests (archive.png_size).
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+
+class PngSizeTest(unittest.TestCase):
+    def test_png(self):
+        tmpdir = tempfile.mkdtemp(prefix='kajut-test-')
+        try:
+            path = os.path.join(tmpdir, 'image.png')
+            write_png(path, 3, 2, zlib.compress(('\x00' + '\xff' * 9) * 2))
+            with open(path, 'rb') as f:
+                self.assertEqual(png_size(f.read()), (3, 2))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def test_not_png(self):
+        self.assertEqual(png_size(''), (None, None))
+        self.assertEqual(png_size('GIF89a' + '\x00' * 30), (None, None))
+        # PNG signature without its header chunk first
+        self.assertEqual(png_size('\x89PNG\r\n\x1a\n' + '\x00\x00\x00\x00IEND' + '\x00' * 12), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cache import RenderCache, prune_pages
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the render cache and of the pages left by earlier renders."""
+
+
+class PruneTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='kajut-test-')
+        self.filename = os.path.join(self.tmpdir, 'tex-q1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def touch(self, *names):
+        paths = [os.path.join(self.tmpdir, name) for name in names]
+        for path in paths:
+            open(path, 'w').close()
+        return paths
+
+    def test_single_page_replaces_pages(self):
+        self.touch('tex-q1-0.png', 'tex-q1-1.png', 'tex-q10.png', 'tex-q1.pdf')
+        prune_pages(self.filename, self.touch('tex-q1.png'))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['tex-q1.pdf', 'tex-q1.png', 'tex-q10.png'])
+
+    def test_fewer_pages(self):
+        self.touch('tex-q1.png', 'tex-q1-2.png', 'tex-q1-3.png', 'tex-q1-0.svg')
+        prune_pages(self.filename, self.touch('tex-q1-0.png', 'tex-q1-1.png'))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['tex-q1-0.png', 'tex-q1-0.svg', 'tex-q1-1.png'])
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='kajut-test-')
+        self.cache = RenderCache(os.path.join(self.tmpdir, 'cache'), 10)
+        self.pngdir = os.path.join(self.tmpdir, 'png')
+        self.pdfdir = os.path.join(self.tmpdir, 'pdf')
+        self.work = os.path.join(self.tmpdir, 'work')
+        for path in (self.pngdir, self.work):
+            os.mkdir(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_restore_removes_stale_pages(self):
+        files = []
+        for name in ('tex-q1.png', 'tex-q1.pdf'):
+            files.append(os.path.join(self.work, name))
+            with open(files[-1], 'w') as f:
+                f.write(name)
+        self.cache.put('k1', files)
+        for name in ('tex-q1-0.png', 'tex-q1-1.png'):
+            open(os.path.join(self.pngdir, name), 'w').close()
+        self.assertTrue(self.cache.get('k1', self.pngdir, self.pdfdir, name='tex-q1'))
+        self.assertEqual(os.listdir(self.pngdir), ['tex-q1.png'])
+        self.assertEqual(os.listdir(self.pdfdir), ['tex-q1.pdf'])
+        self.assertFalse(self.cache.get('k2', self.pngdir, self.pdfdir, name='tex-q1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
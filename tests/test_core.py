@@ -0,0 +1,170 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from core import Data, read_text, write_text
+from questions import QuestionParser
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the question bank (core.Data): renaming and writing back the questions into their file.
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+BANK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tex_files', 'input.tex')
+
+
+class BankTestCase(unittest.TestCase):
+    """ Copy of the example bank in a temporary directory."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='kajut-test-')
+        self.path = os.path.join(self.tmpdir, 'input.tex')
+        shutil.copy(BANK, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def data(self, lazy=False):
+        return Data({'i': self.path, 'd': 300, 'crop': False, 'design': 'tabular', 'noindex': True,
+                     'nocache': True, 'lazy': lazy}, self.tmpdir)
+
+    def parsed(self):
+        """ Questions of the file, as a full parse finds them, in order."""
+        text = read_text(self.path)
+        parser = QuestionParser()
+        start, end = parser.region(text)
+        return parser.parse(text, start, end, text.count('\n', 0, start) + 1)
+
+
+class RenameTest(BankTestCase):
+    def test_rename_keeps_place(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        new_id = d.rename_question(names[1], 'Renamed')
+        self.assertTrue(d.save_questions([new_id], renamed={new_id: names[1]}))
+        self.assertEqual([qblock['name'] for qblock in self.parsed()], [names[0], 'Renamed'] + names[2:])
+        self.assertEqual(sorted(d.qblocks), sorted([names[0], 'Renamed'] + names[2:]))
+
+    def test_rename_to_existing_name(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        text = read_text(self.path)
+        other = d.qblocks[names[2]].fields()
+        with self.assertRaises(ValueError):
+            d.rename_question(names[1], names[2])
+        # Neither question changed, in the bank or in the file
+        self.assertEqual(d.qblocks[names[1]]['name'], names[1])
+        self.assertEqual(d.qblocks[names[2]].fields(), other)
+        self.assertEqual(read_text(self.path), text)
+
+    def test_rename_to_same_name(self):
+        d = self.data()
+        name = sorted(d.qblocks)[0]
+        self.assertEqual(d.rename_question(name, name), name)
+
+
+class WriteTest(BankTestCase):
+    """ Questions written back into their file, splicing only their blocks."""
+
+    def assertSpans(self, d):
+        """ The bank knows where every question of the file is, as if the file had been read again."""
+        text = read_text(self.path)
+        parsed = self.parsed()
+        self.assertEqual(sorted(d.qblocks), sorted(qblock['name'] for qblock in parsed))
+        for qblock in parsed:
+            self.assertEqual(d.qblocks[qblock['name']]['span'], qblock['span'])
+            self.assertEqual(d.qblocks[qblock['name']]['line'], qblock['line'])
+            self.assertTrue(text[slice(*qblock['span'])].startswith('%% File_name: %s\n' % qblock['name']))
+
+    def test_edit_in_place(self):
+        d = self.data()
+        text = read_text(self.path)
+        name = sorted(d.qblocks)[2]
+        a, b = d.qblocks[name]['span']
+        d.qblocks[name]['title'] = 'Edited'
+        d.qblocks[name]['question'] = 'One line.\nTwo lines.\n'
+        self.assertTrue(d.save_questions([name]))
+        new_text = read_text(self.path)
+        # Only the block of the question changed
+        self.assertEqual(new_text[:a], text[:a])
+        self.assertEqual(new_text[d.qblocks[name]['span'][1]:], text[b:])
+        parsed = dict((qblock['name'], qblock) for qblock in self.parsed())
+        self.assertEqual((parsed[name]['title'], parsed[name]['question']), ('Edited', 'One line.\nTwo lines.\n'))
+        self.assertSpans(d)
+
+    def test_add(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        name = d.new_question('New', like=names[0])
+        d.qblocks[name].update(title='Added', question='Text.\n', choices=[' Yes. % Correct', ' No.'])
+        self.assertTrue(d.save_questions([name]))
+        parsed = self.parsed()
+        self.assertEqual([qblock['name'] for qblock in parsed], names + ['New'])
+        self.assertEqual((parsed[-1]['title'], parsed[-1]['correct']), ('Added', 0))
+        self.assertSpans(d)
+
+    def test_remove(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        self.assertTrue(d.remove_question(names[0]))
+        self.assertTrue(d.remove_question(names[-1]))
+        self.assertEqual([qblock['name'] for qblock in self.parsed()], names[1:-1])
+        self.assertTrue(read_text(self.path).startswith('%% File_name: %s\n' % names[1]))
+        self.assertSpans(d)
+
+    def test_external_edit(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        # Another program adds a question at the beginning of the file after it was read
+        text = read_text(self.path)
+        other = text[slice(*d.qblocks[names[1]]['span'])].replace(names[1], 'External')
+        write_text(self.path, other + '\n' + text)
+        d.qblocks[names[3]]['title'] = 'Edited'
+        self.assertTrue(d.save_questions([names[3]]))
+        parsed = self.parsed()
+        self.assertEqual([qblock['name'] for qblock in parsed], ['External'] + names)
+        self.assertEqual(parsed[4]['title'], 'Edited')
+
+    def test_rename_after_external_edit(self):
+        d = self.data()
+        names = [qblock['name'] for qblock in self.parsed()]
+        text = read_text(self.path)
+        write_text(self.path, '% Comment\n\n' + text)
+        new_id = d.rename_question(names[2], 'Renamed')
+        self.assertTrue(d.save_questions([new_id], renamed={new_id: names[2]}))
+        parsed = [qblock['name'] for qblock in self.parsed()]
+        self.assertEqual(parsed, names[:2] + ['Renamed'] + names[3:])
+        self.assertTrue(read_text(self.path).startswith('% Comment\n\n'))
+
+    def test_lazy(self):
+        d = self.data(lazy=True)
+        names = [qblock['name'] for qblock in self.parsed()]
+        self.assertTrue(all(d.qblocks[name].get('lazy') for name in names))
+        d.question(names[1])['title'] = 'Edited'
+        self.assertTrue(d.save_questions([names[1]]))
+        self.assertEqual(self.parsed()[1]['title'], 'Edited')
+        # The questions that were not parsed are still found in the file
+        self.assertEqual(d.question(names[4])['choices'], self.parsed()[4]['choices'])
+
+
+if __name__ == '__main__':
+    unittest.main()
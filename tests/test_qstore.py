@@ -0,0 +1,98 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pickle
+import marshal
+import unittest
+from qstore import Origin, Question, dumps, loads, questions
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the compact model of the questions (qstore): Question objects and snapshots.
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+FIELDS = [{'name': 'q1', 'title': 'First', 'question': u'\xbfQu\xe9?\n', 'choices': [' A. %enditem'],
+           'correct': 0, 'time': '30', 'line': 1, 'span': (0, 80)},
+          {'name': 'q2', 'title': 'Second', 'question': 'Text.\n', 'choices': [], 'correct': None, 'time': 'None',
+           'line': 9, 'span': (81, 120)}]
+ORIGIN = Origin('/bank/input.tex', '/bank/tex', '/bank/png', '/bank/pdf')
+
+
+class QuestionTest(unittest.TestCase):
+    def test_dictionary(self):
+        qblock = Question(FIELDS[0], ORIGIN)
+        self.assertEqual(qblock['name'], 'q1')
+        self.assertEqual((qblock['source'], qblock['pngdir']), ('/bank/input.tex', '/bank/png'))
+        self.assertNotIn('lazy', qblock)
+        self.assertEqual(qblock.get('lazy', False), False)
+        self.assertEqual(dict(qblock.items()), dict(FIELDS[0], source='/bank/input.tex', texdir='/bank/tex',
+                                                    pngdir='/bank/png', pdfdir='/bank/pdf'))
+        self.assertEqual(qblock.fields(), FIELDS[0])
+        with self.assertRaises(KeyError):
+            qblock['other'] = 1
+        with self.assertRaises(KeyError):
+            qblock['lazy']
+
+    def test_without_file(self):
+        qblock = Question(FIELDS[1])
+        self.assertIsNone(qblock['source'])
+        self.assertNotIn('pngdir', qblock)
+        self.assertEqual(qblock.get('pngdir', '/default'), '/default')
+
+    def test_paths_are_not_shared_when_set(self):
+        first, second = questions(FIELDS, ORIGIN)
+        self.assertIs(first.origin, second.origin)
+        first['pngdir'] = '/other/png'
+        self.assertEqual(first['pngdir'], '/other/png')
+        self.assertEqual(first['source'], '/bank/input.tex')
+        self.assertEqual(second['pngdir'], '/bank/png')
+
+    def test_pop_and_delete(self):
+        qblock = Question(dict(FIELDS[0], lazy=True))
+        self.assertTrue(qblock.pop('lazy'))
+        self.assertEqual(qblock.pop('lazy', None), None)
+        del qblock['span']
+        self.assertNotIn('span', qblock)
+        with self.assertRaises(KeyError):
+            del qblock['span']
+
+    def test_pickle(self):
+        # The questions are sent to the render processes
+        qblock = pickle.loads(pickle.dumps(Question(FIELDS[0], ORIGIN), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(qblock.fields(), FIELDS[0])
+        self.assertEqual(qblock['texdir'], '/bank/tex')
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_round_trip(self):
+        for qblocks in (FIELDS, questions(FIELDS, ORIGIN)):
+            loaded = loads(dumps(qblocks), ORIGIN)
+            self.assertEqual([qblock.fields() for qblock in loaded], FIELDS)
+            self.assertTrue(all(qblock.origin is ORIGIN for qblock in loaded))
+
+    def test_empty(self):
+        self.assertEqual(loads(dumps([])), [])
+
+    def test_unknown_version(self):
+        with self.assertRaises(ValueError):
+            loads(marshal.dumps((0, (), [])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from questions import QuestionParser
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the parser of question banks (questions.QuestionParser).
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+BANK = ('% File_name: T1_q1\n'
+        '% Title: First\n'
+        '% Time: 30\n'
+        'Which one?\n'
+        '\\begin{enumerate}\n'
+        '\\Myitem One. %enditem\n'
+        '\\Myitem Two. % Correct %enditem\n'
+        '\\end{enumerate}\n'
+        '\n'
+        '% File_name: T1_q2\n'
+        '% Title: Second\n'
+        'Multi\n'
+        'line.\n'
+        '\\begin{tabbedenum}{2}\n'
+        '\\Myitem $\\alpha$. % Correct %enditem\n'
+        '\\Myitem $\\beta$. %enditem\n'
+        '\\end{tabbedenum}\n')
+
+PREAMBLE = '\\documentclass{article}\n% BEGIN PREAMBLE\n\\begin{document}\n% END PREAMBLE\n'
+END = '% BEGIN END\n\\end{document}\n% END END\n'
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = QuestionParser()
+
+    def test_fields(self):
+        first, second = self.parser.parse(BANK)
+        self.assertEqual((first['name'], first['title'], first['time']), ('T1_q1', 'First', '30'))
+        self.assertEqual(first['question'], 'Which one?\n')
+        self.assertEqual(first['choices'], [' One. %enditem', ' Two. % Correct %enditem'])
+        self.assertEqual(first['correct'], 1)
+        self.assertEqual((second['name'], second['time'], second['correct']), ('T1_q2', 'None', 0))
+        self.assertEqual(second['question'], 'Multi\nline.\n')
+        self.assertEqual(len(second['choices']), 2)
+
+    def test_lines_and_spans(self):
+        first, second = self.parser.parse(BANK)
+        self.assertEqual((first['line'], second['line']), (1, 10))
+        self.assertEqual(BANK[slice(*first['span'])], BANK[:BANK.index('\n\n') + 1])
+        self.assertTrue(BANK[slice(*second['span'])].startswith('% File_name: T1_q2\n'))
+        self.assertEqual(second['span'][1], len(BANK))
+
+    def test_bad_blocks_are_skipped(self):
+        # No title in the first question, no choices in the second one
+        text = (BANK.replace('% Title: First\n', '') + '\n% File_name: T1_q3\n% Title: Third\nNo choices.\n'
+                + BANK[BANK.index('% File_name: T1_q2'):].replace('T1_q2', 'T1_q4'))
+        self.assertEqual([qblock['name'] for qblock in self.parser.parse(text)], ['T1_q2', 'T1_q4'])
+
+    def test_region(self):
+        text = PREAMBLE + BANK + END
+        start, end = self.parser.region(text)
+        self.assertEqual(text[start:end], '% END PREAMBLE\n' + BANK)
+        qblocks = self.parser.parse(text, start, end, text.count('\n', 0, start) + 1)
+        self.assertEqual([qblock['line'] for qblock in qblocks], [5, 14])
+        # Without the markers, the whole file is read
+        self.assertEqual(self.parser.region(BANK), (0, len(BANK)))
+
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = QuestionParser()
+
+    def test_scan_matches_parse(self):
+        text = PREAMBLE + BANK + END
+        start, end = self.parser.region(text)
+        line = text.count('\n', 0, start) + 1
+        parsed = self.parser.parse(text, start, end, line)
+        scanned = self.parser.scan(text, start, end, line)
+        self.assertEqual([(qblock['name'], qblock['line']) for qblock in scanned],
+                         [(qblock['name'], qblock['line']) for qblock in parsed])
+        for lazy, qblock in zip(scanned, parsed):
+            self.assertTrue(lazy['lazy'])
+            self.assertEqual(self.parser.details(text, lazy), qblock)
+
+    def test_details_of_moved_question(self):
+        lazy = self.parser.scan(BANK)[1]
+        # The file changed after it was scanned
+        self.assertIsNone(self.parser.details('\n' + BANK, lazy))
+        self.assertIsNone(self.parser.details(BANK.replace('T1_q2', 'T1_q9'), lazy))
+
+
+class FormatTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = QuestionParser()
+
+    def test_round_trip(self):
+        for qblock in self.parser.parse(BANK):
+            original = BANK[slice(*qblock['span'])]
+            text = self.parser.format(qblock, original)
+            self.assertEqual(text, original.rstrip('\n') + '\n')
+            again, = self.parser.parse(text)
+            for key in ('name', 'title', 'time', 'question', 'choices', 'correct'):
+                self.assertEqual(again[key], qblock[key])
+
+    def test_new_question(self):
+        qblock = {'name': 'New', 'title': 'Added', 'question': 'Text', 'choices': [' Yes. % Correct', 'No.']}
+        text = self.parser.format(qblock)
+        self.assertTrue(text.startswith('% File_name: New\n% Title: Added\nText\n\\begin{enumerate}\n'))
+        parsed, = self.parser.parse(text)
+        self.assertEqual(parsed['choices'], [' Yes. % Correct %enditem', ' No. %enditem'])
+        self.assertEqual((parsed['correct'], parsed['time']), (0, 'None'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from raster import fit_density, length_pt, letterbox, write_png
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the images written without external programs (raster.letterbox and raster.write_png).
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+WHITE = (255, 255, 255)
+
+
+def read_png(path):
+    """ Width, height and pixels (rows of RGB tuples) of an unfiltered 8 bit RGB PNG image, checking its chunks."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:8] == '\x89PNG\r\n\x1a\n'
+    chunks, position = [], 8
+    while position < len(data):
+        length, = struct.unpack('>I', data[position:position + 4])
+        kind, body = data[position + 4:position + 8], data[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(kind + body) & 0xffffffff
+        chunks.append((kind, body))
+        position += 12 + length
+    assert [chunk[0] for chunk in chunks] == ['IHDR', 'IDAT', 'IEND']
+    width, height, depth, color, compression, filtering, interlace = struct.unpack('>IIBBBBB', chunks[0][1])
+    assert (depth, color, compression, filtering, interlace) == (8, 2, 0, 0, 0)
+    raw = zlib.decompress(chunks[1][1])
+    assert len(raw) == height * (1 + 3 * width)
+    rows = []
+    for y in range(height):
+        row = raw[y * (1 + 3 * width):(y + 1) * (1 + 3 * width)]
+        assert row[0] == '\x00'
+        rows.append([tuple(ord(c) for c in row[1 + 3 * x:4 + 3 * x]) for x in range(width)])
+    return width, height, rows
+
+
+class LetterboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='kajut-test-')
+        self.ppm = os.path.join(self.tmpdir, 'page.ppm')
+        self.png = os.path.join(self.tmpdir, 'page.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def image(self, width, height, comment=False):
+        """ PPM image whose pixel (x, y) is (x, y, 0)."""
+        pixels = ''.join(chr(x) + chr(y) + '\x00' for y in range(height) for x in range(width))
+        with open(self.ppm, 'wb') as f:
+            f.write('P6\n%s%d %d\n255\n' % ('# comment\n' if comment else '', width, height) + pixels)
+
+    def test_write_png(self):
+        write_png(self.png, 2, 1, zlib.compress('\x00' + '\x01\x02\x03\x04\x05\x06'))
+        self.assertEqual(read_png(self.png), (2, 1, [[(1, 2, 3), (4, 5, 6)]]))
+
+    def test_centered(self):
+        self.image(3, 2, comment=True)
+        letterbox(self.ppm, self.png, 5, 4)
+        width, height, rows = read_png(self.png)
+        self.assertEqual((width, height), (5, 4))
+        self.assertEqual(rows[0], [WHITE] * 5)
+        self.assertEqual(rows[1], [WHITE, (0, 0, 0), (1, 0, 0), (2, 0, 0), WHITE])
+        self.assertEqual(rows[2], [WHITE, (0, 1, 0), (1, 1, 0), (2, 1, 0), WHITE])
+        self.assertEqual(rows[3], [WHITE] * 5)
+
+    def test_cropped(self):
+        self.image(4, 5)
+        letterbox(self.ppm, self.png, 2, 3)
+        width, height, rows = read_png(self.png)
+        self.assertEqual((width, height), (2, 3))
+        self.assertEqual(rows, [[(x, y, 0) for x in (1, 2)] for y in (1, 2, 3)])
+
+    def test_wider_and_shorter(self):
+        self.image(4, 1)
+        letterbox(self.ppm, self.png, 2, 3)
+        self.assertEqual(read_png(self.png)[2], [[WHITE] * 2, [(1, 0, 0), (2, 0, 0)], [WHITE] * 2])
+
+    def test_not_ppm(self):
+        with open(self.ppm, 'wb') as f:
+            f.write('P5\n1 1\n255\n\x00')
+        with self.assertRaises(IOError):
+            letterbox(self.ppm, self.png, 2, 2)
+
+
+class SizeTest(unittest.TestCase):
+    def test_length_pt(self):
+        self.assertAlmostEqual(length_pt('1in'), 72.0)
+        self.assertAlmostEqual(length_pt('2.54cm'), 72.0)
+        self.assertAlmostEqual(length_pt('72.27pt'), 72.0)
+
+    def test_fit_density(self):
+        # A4 page, in points
+        size = (595.0, 842.0)
+        for width, height in ((880, 495), (480, None), (None, 1000)):
+            density = fit_density(size, width, height)
+            self.assertTrue(width is None or round(size[0] * density / 72) <= width)
+            self.assertTrue(height is None or round(size[1] * density / 72) <= height)
+            self.assertTrue((width and round(size[0] * density / 72) == width)
+                            or (height and round(size[1] * density / 72) == height))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from targets import parse_target
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Tests of the specifications of the output targets (targets.parse_target).
+    Run them from the root of the repository with: python -m unittest discover
+"""
+
+
+class ParseTargetTest(unittest.TestCase):
+    def test_defaults(self):
+        target = parse_target('slides:svg')
+        self.assertEqual((target.name, target.format), ('slides', 'svg'))
+        self.assertEqual((target.density, target.size, target.letterbox, target.quality), (None, None, False, 80))
+
+    def test_options(self):
+        target = parse_target('print:png:density=600')
+        self.assertEqual(target.density, 600.0)
+        target = parse_target('web:webp:width=480, quality=75')
+        self.assertEqual((target.format, target.size, target.quality), ('webp', (480, None), 75))
+        target = parse_target('kahoot:png:width=880,height=495,letterbox')
+        self.assertEqual((target.size, target.letterbox), ((880, 495), True))
+
+    def test_bad_specifications(self):
+        for spec in ('web', 'web:', ':png', '-web:png', 'web:gif', 'png:png', 'pdf:webp', 'web:png:size=3',
+                     'web:png:width=wide', 'web:png:letterbox=1', 'web:png:width=480,letterbox'):
+            with self.assertRaises(ValueError):
+                parse_target(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
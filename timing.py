@@ -0,0 +1,184 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+import logging
+from StringIO import StringIO
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Timing of the stages of the render pipeline (reading the bank, writing LaTeX, pdflatex, pdfcrop, the
+    rasterizer, moving the files, ...).
+
+    Each stage is recorded with its wall time and with the CPU time and peak memory of the programs run during
+    it (see process.run). The records are written to a JSONL trace, one per line:
+
+    {"stage": "compile", "questions": ["T1_c1.1_q1"], "start": 1500000000.0, "wall": 0.41, "cpu": 0.38,
+     "rss": 38.2, "programs": ["pdflatex"], "pid": 1234}
+"""
+
+logging.getLogger('timing').addHandler(logging.NullHandler())
+
+_local = threading.local()
+
+
+class Stage(object):
+    """ Context manager that records a stage of the render into a trace (any object with an append method)."""
+
+    def __init__(self, trace, name, questions=None, **extra):
+        self.trace = trace
+        self.record = dict(extra, stage=name, questions=list(questions or []))
+        self.cpu = 0.0
+        self.rss = 0.0
+        self.programs = []
+
+    def __enter__(self):
+        self.parent = getattr(_local, 'stage', None)
+        _local.stage = self
+        self.start = time.time()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        wall = time.time() - self.start
+        _local.stage = self.parent
+        if self.parent is not None:
+            # The programs of a nested stage also count for the enclosing one
+            self.parent.cpu += self.cpu
+            self.parent.rss = max(self.parent.rss, self.rss)
+        self.record.update({'start': self.start, 'wall': wall, 'cpu': self.cpu, 'rss': self.rss,
+                            'programs': self.programs, 'pid': os.getpid()})
+        if kind is not None:
+            self.record['error'] = kind.__name__
+        self.trace.append(self.record)
+        return False
+
+
+class NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+def stage(trace, name, questions=None, **extra):
+    """
+    Records a stage in the trace, if any:
+
+        with stage(self.trace, 'compile', self.names):
+            ...
+
+    :param trace: list or Trace object where the record is appended. None records nothing.
+    :param name: name of the stage.
+    :param questions: identifiers of the questions processed in the stage.
+    """
+    if trace is None:
+        return NoStage()
+    return Stage(trace, name, questions, **extra)
+
+
+def child(program, rusage):
+    """ Adds the resources used by a program (os.wait4) to the stage running in this thread."""
+    current = getattr(_local, 'stage', None)
+    if current is None or rusage is None:
+        return
+    current.cpu += rusage.ru_utime + rusage.ru_stime
+    # ru_maxrss is in bytes on OS X, in kB on Linux
+    current.rss = max(current.rss, rusage.ru_maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0))
+    current.programs.append(os.path.basename(program))
+
+
+class Trace(object):
+    """ JSONL trace of the stages of a run, with the totals needed for the summary at the end of it."""
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('timing.Trace')
+        self.path = os.path.expanduser(path)
+        self.f = open(self.path, 'a')
+        self.lock = threading.Lock()
+        self.stages = {}  # stage: [count, wall, cpu, peak rss]
+        self.questions = {}  # question: [wall, {stage: wall}]
+
+    def append(self, record):
+        """ Writes a record and adds it to the totals. The time of a stage is split among its questions."""
+        with self.lock:
+            self.f.write(json.dumps(record, sort_keys=True) + '\n')
+            self.f.flush()
+            totals = self.stages.setdefault(record['stage'], [0, 0.0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += record['wall']
+            totals[2] += record['cpu']
+            totals[3] = max(totals[3], record['rss'])
+            questions = record['questions']
+            for name in questions:
+                question = self.questions.setdefault(name, [0.0, {}])
+                share = record['wall'] / len(questions)
+                question[0] += share
+                question[1][record['stage']] = question[1].get(record['stage'], 0.0) + share
+
+    def extend(self, records):
+        for record in records or []:
+            self.append(record)
+
+    def summary(self, top=10):
+        """ Logs the time spent in every stage and the slowest questions."""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+            slowest = sorted(self.questions.items(), key=lambda item: -item[1][0])[:top]
+        if not stages:
+            return
+        lines = ["%-12s %6s %10s %10s %9s" % ("stage", "count", "wall (s)", "cpu (s)", "rss (MB)")]
+        for name, (count, wall, cpu, rss) in stages:
+            lines.append("%-12s %6d %10.3f %10.3f %9.1f" % (name, count, wall, cpu, rss))
+        self.logger.info("Time per stage (trace in %s):\n%s" % (self.path, "\n".join(lines)))
+        if slowest:
+            lines = ["%-30s %9s  %s" % ("question", "wall (s)", "slowest stage")]
+            for name, (wall, by_stage) in slowest:
+                worst = max(by_stage, key=by_stage.get)
+                lines.append("%-30s %9.3f  %s (%.3f s)" % (name, wall, worst, by_stage[worst]))
+            self.logger.info("Slowest questions:\n%s" % "\n".join(lines))
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def start_profile(path, top=20):
+    """
+    Profiles the Python side of the program (cProfile) until it exits: the statistics are dumped into path
+    (see the pstats module) and the functions with the largest cumulative time are logged.
+    """
+    profiler = cProfile.Profile()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(path)
+        report = StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+        logging.getLogger('timing').info("Profile written into %s:\n%s" % (path, report.getvalue().strip()))
+
+    atexit.register(dump)
+    profiler.enable()
+    return profiler
@@ -0,0 +1,281 @@
+"""
+    PyKajut - Graphical Tool to generate quiz style PNGs from latex input.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from Queue import Empty
+from render import page_files, png_files, cpu_count
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+__author__ = 'Jose M. Esnaola Acebes'
+
+""" Watch mode: the questions file is monitored and only the questions that change are rendered again.
+"""
+
+logging.getLogger('watch').addHandler(logging.NullHandler())
+
+
+class PollingMonitor(object):
+    """ Detects changes of a file comparing its modification time, size and inode periodically."""
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.last = self.stat()
+        self.checked = time.time()
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def wait(self, timeout):
+        """ Waits at most timeout seconds. Returns True if the file changed."""
+        time.sleep(max(min(timeout, self.checked + self.interval - time.time()), 0))
+        if time.time() - self.checked < self.interval:
+            return False
+        self.checked = time.time()
+        current = self.stat()
+        if current != self.last:
+            self.last = current
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    """ Detects changes of a file with inotify. The directory is watched, since editors often save files by
+        writing a new one and renaming it.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.realpath(path)
+        self.changed = False
+        self.manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE \
+            | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM
+        self.manager.add_watch(os.path.dirname(self.path), mask)
+        self.notifier = pyinotify.Notifier(self.manager, self.event)
+
+    def event(self, event):
+        if os.path.realpath(event.pathname) == self.path:
+            self.changed = True
+
+    def wait(self, timeout):
+        """ Waits at most timeout seconds. Returns True if the file changed."""
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        changed, self.changed = self.changed, False
+        return changed
+
+    def close(self):
+        self.notifier.stop()
+
+
+class Watcher(object):
+    def __init__(self, data, kajut, jobs=1, debounce=0.5, interval=1.0):
+        """
+        :param data: Data object, with the questions files already read.
+        :param kajut: Kajut object with the settings of the render.
+        :param jobs: number of questions rendered at the same time. 0 uses all the cores.
+        :param debounce: seconds without changes of the file before it is read again.
+        :param interval: seconds between checks of the file, when inotify is not available.
+        """
+        self.logger = logging.getLogger('watch.Watcher')
+        self.d = data
+        self.kj = kajut
+        self.jobs = jobs if jobs > 0 else cpu_count()
+        self.debounce = debounce
+        self.monitors = []
+        for path in self.d.sources:
+            if pyinotify is not None:
+                self.monitors.append((path, InotifyMonitor(path)))
+            else:
+                self.monitors.append((path, PollingMonitor(path, interval)))
+        if pyinotify is None:
+            self.logger.debug("Checking the files every %.1f s (install pyinotify to avoid polling)." % interval)
+        # Render key of every question as last read, questions waiting to be rendered and running jobs
+        self.keys = dict((name, self.kj.render_key(qblock)) for name, qblock in self.d.qblocks.items())
+        # Output files of every question: name and directories (the output targets are in the LaTeX one)
+        self.files = dict((name, (qblock['name'], qblock['pngdir'], qblock['pdfdir'], qblock['texdir']))
+                          for name, qblock in self.d.qblocks.items())
+        self.pending = {}
+        self.running = {}
+        self.rendered = False  # Some job finished since the cache was last trimmed
+        self.results = multiprocessing.Queue()
+
+    def watch(self):
+        """ Renders the changes of the questions file until the user interrupts it (Ctrl+C)."""
+        self.logger.info("Watching %s for changes (Ctrl+C to stop) ..." % ", ".join(self.d.sources))
+        changed = {}  # Time of the last change of every file
+        try:
+            while True:
+                timeout = 0.2 if self.running or changed else 1.0
+                for k, (path, monitor) in enumerate(self.monitors):
+                    # Only the first monitor waits
+                    if monitor.wait(timeout if k == 0 else 0):
+                        changed[path] = time.time()
+                # Debounce: a file is read again once it has not changed for a while
+                for path in [path for path, t in changed.items() if time.time() - t >= self.debounce]:
+                    del changed[path]
+                    self.reload(path)
+                self.collect()
+                self.start()
+        except KeyboardInterrupt:
+            self.logger.warning("Interrupted by the user.")
+        finally:
+            for name in self.running.keys():
+                self.cancel(name)
+            for path, monitor in self.monitors:
+                monitor.close()
+            if self.d.trace is not None:
+                self.d.trace.summary()
+
+    def reload(self, path):
+        """ Reads a questions file again and schedules the questions that were added or modified."""
+        if not os.path.exists(path) or not self.d.open_bank(path):
+            self.logger.warning("%s can not be read. Waiting for it ..." % path)
+            return
+        qblocks = dict((name, qblock) for name, qblock in self.d.qblocks.items() if qblock['source'] == path)
+        keys = dict((name, self.kj.render_key(qblock)) for name, qblock in qblocks.items())
+        modified = [name for name in keys if keys[name] != self.keys.get(name)]
+        deleted = [name for name in self.keys if name not in self.d.qblocks]
+        for name in modified:
+            if name in self.running:
+                self.logger.info("Question %s changed while being rendered: cancelled." % name)
+                self.cancel(name)
+            self.pending[name] = qblocks[name]
+        for name in deleted:
+            self.cancel(name)
+            self.pending.pop(name, None)
+            self.remove(name)
+            del self.keys[name]
+        self.keys.update(keys)
+        for name, qblock in qblocks.items():
+            self.files[name] = (qblock['name'], qblock['pngdir'], qblock['pdfdir'], qblock['texdir'])
+        if modified or deleted:
+            self.logger.info("%s changed: %d questions to render, %d removed."
+                             % (os.path.basename(path), len(modified), len(deleted)))
+
+    def start(self):
+        """ Starts the pending jobs, up to the maximum number of jobs running at the same time."""
+        for name in sorted(self.pending):
+            if len(self.running) >= self.jobs:
+                break
+            qblock = self.pending.pop(name)
+            job = self.kj.job([qblock])
+            process = multiprocessing.Process(target=_run, args=(job, self.results))
+            process.daemon = True
+            process.start()
+            self.running[name] = process
+
+    def collect(self):
+        """ Reports the jobs that finished."""
+        # The results of the jobs that already exited are in the queue
+        finished = [name for name, process in self.running.items() if not process.is_alive()]
+        while True:
+            try:
+                pid, results, trace = self.results.get_nowait()
+            except Empty:
+                break
+            if self.d.trace is not None:
+                self.d.trace.extend(trace)
+            for name, success in results:
+                process = self.running.get(name)
+                if process is None or process.pid != pid:
+                    continue  # Cancelled
+                process.join()
+                del self.running[name]
+                self.rendered = True
+                if success:
+                    self.logger.info("%s ... done." % name)
+                else:
+                    self.logger.error("%s ... failed." % name)
+        for name in finished:
+            process = self.running.pop(name, None)
+            if process is not None:
+                # Finished without reporting (e.g. killed by the system)
+                process.join()
+                self.rendered = True
+                self.logger.error("%s ... failed (exit code %s)." % (name, process.exitcode))
+        # The cache is trimmed once all the questions of the changes were rendered, as in a batch
+        if self.rendered and not self.running and not self.pending:
+            self.rendered = False
+            if self.kj.cache:
+                self.kj.cache.trim()
+
+    def cancel(self, name):
+        """ Stops the job of a question, along with the programs it started (pdflatex, ...)."""
+        process = self.running.pop(name, None)
+        if process is None:
+            return
+        # Only a job that was not reaped yet is signalled: the pid of a reaped one may belong to another process
+        if process.is_alive():
+            _kill(process, signal.SIGTERM)
+            process.join(5)
+            if process.is_alive():
+                _kill(process, signal.SIGKILL)
+        process.join()
+
+    def remove(self, name):
+        """ Removes the files of a deleted question."""
+        filename, pngdir, pdfdir, texdir = self.files.pop(name)
+        if self.d.format == 'svg':
+            outputs = page_files(os.path.join(texdir, 'svg', 'tex-' + filename), 'svg')
+        else:
+            outputs = png_files(os.path.join(pngdir, 'tex-' + filename))
+            outputs.append(os.path.join(pdfdir, 'tex-%s.pdf' % filename))
+        for target in self.d.targets:
+            outputs += page_files(os.path.join(texdir, target.name, 'tex-' + filename), target.format)
+        for path in outputs:
+            if os.path.exists(path):
+                os.remove(path)
+        self.logger.info("Question %s deleted: its files were removed." % name)
+
+
+def _kill(process, signum):
+    # The job and the programs it started are in its own process group, once it has created it
+    try:
+        os.killpg(process.pid, signum)
+    except OSError:
+        os.kill(process.pid, signum)
+
+
+def _terminate(signum, frame):
+    # Unwinds the job, so that its temporary directory is removed
+    raise SystemExit(1)
+
+
+def _run(job, results):
+    # Own process group: cancelling the job also stops the programs it is running
+    os.setsid()
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    results.put((os.getpid(), job.run(), job.trace))